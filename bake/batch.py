@@ -0,0 +1,270 @@
+import concurrent.futures
+import datetime
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+
+from bake.engine import BakeResult, BakeTimestampMapper, bake, open_output_file
+from bake.headless import bake_file_incremental, create_bake_algorithm, default_output_filename, \
+    detect_funscripts, funscript_duration, load_device_configuration, settings_fingerprint
+from funscript.collect_funscripts import Resource, collect_funscripts
+from funscript.funscript import sha1_hash
+from qt_ui import settings
+from qt_ui.models.funscript_kit import FunscriptKitModel
+
+logger = logging.getLogger('restim.bake_audio')
+
+media_extensions = {
+    '.mp4', '.m4v', '.mkv', '.webm', '.avi', '.mov', '.wmv', '.flv', '.mpg', '.mpeg', '.ts',
+    '.mp3', '.m4a', '.ogg', '.opus', '.flac', '.wav',
+}
+
+MANIFEST_VERSION = 1
+
+
+@dataclass
+class BatchJob:
+    media: str
+    output: str
+    funscripts: list[str]
+    funscript_hash: str
+
+
+@dataclass
+class BatchSummary:
+    baked: int = 0
+    up_to_date: int = 0
+    no_funscripts: int = 0
+    skipped: list[str] = field(default_factory=list)    # funscripts without actions
+    failed: list[str] = field(default_factory=list)
+    audio_duration: float = 0.0     # seconds of audio baked
+    elapsed_time: float = 0.0       # wall clock
+
+    def summary(self) -> str:
+        text = (f'{self.baked} baked, {self.up_to_date} up to date, {self.no_funscripts} without funscripts, '
+                f'{len(self.skipped)} skipped, {len(self.failed)} failed. {self.audio_duration:.0f} seconds of audio in {self.elapsed_time:.1f} seconds')
+        if self.elapsed_time > 0 and self.audio_duration > 0:
+            text += f' ({self.audio_duration / self.elapsed_time:.1f}x realtime)'
+        return text
+
+
+class NothingToBake(Exception):
+    """
+    The funscripts of a media file have no actions, the output would be empty.
+    """
+    pass
+
+
+def find_media_files(paths: list[str]) -> list[str]:
+    """
+    Media files in the given directories (recursive), and the given files themselves.
+    """
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(os.path.abspath(path))
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() in media_extensions:
+                    found.append(os.path.abspath(os.path.join(dirpath, filename)))
+    return found
+
+
+def funscript_content_hash(resources: list[Resource]) -> str:
+    """
+    Hash of the names and contents of the funscripts. Names matter because they decide which axis
+    a funscript is linked to.
+    """
+    sha1 = hashlib.sha1()
+    for resource in sorted(resources, key=lambda r: r.name()):
+        sha1.update(resource.name().encode('utf-8'))
+        sha1.update(sha1_hash(resource.path).encode('ascii'))
+    return sha1.hexdigest()
+
+
+class Manifest:
+    """
+    Record of baked files, used to skip files that are up to date.
+    Written after every bake, so an interrupted batch loses no work.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}   # absolute output path -> dict
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f'could not read manifest {self.path}: {e}. All files will be baked.')
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self.entries = data.get('entries', {})
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def is_up_to_date(self, job: BatchJob, settings_hash: str) -> bool:
+        entry = self.entries.get(job.output)
+        return (entry is not None
+                and entry['funscript_hash'] == job.funscript_hash
+                and entry['settings_hash'] == settings_hash
+                and os.path.isfile(job.output))
+
+    def record(self, job: BatchJob, settings_hash: str, result: BakeResult):
+        self.entries[job.output] = {
+            'media': job.media,
+            'funscripts': job.funscripts,
+            'funscript_hash': job.funscript_hash,
+            'settings_hash': settings_hash,
+            'samplerate': result.samplerate,
+            'duration': result.duration,
+            'elapsed_time': result.elapsed_time,
+            'realtime_factor': result.realtime_factor,
+            'peak_rss': result.peak_rss,
+            'baked_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+
+
+def create_job(media: str, extension: str) -> BatchJob | None:
+    """
+    :return: None if the media file has no funscripts.
+    """
+    dirname, basename = os.path.split(media)
+    resources = collect_funscripts([dirname] + settings.additional_search_paths.get(), basename)
+    if not resources:
+        return None
+    return BatchJob(media, default_output_filename(media, extension),
+                    sorted(str(r) for r in resources), funscript_content_hash(resources))
+
+
+def init_worker(config_path: str | None):
+    if config_path:
+        settings.set_settings_path(config_path)
+
+
+def bake_job(job: BatchJob, samplerate: int, waveform: str | None, incremental: bool) -> BakeResult:
+    """
+    Bake one file. Runs in a worker process. Writes to a temporary file first,
+    so an interrupted bake never looks complete.
+    """
+    kit = FunscriptKitModel.load_from_settings()
+    script_mapping = detect_funscripts(job.media, kit)
+    duration = funscript_duration(script_mapping)
+    duration_in_samples = int(samplerate * duration)
+    if duration_in_samples <= 0:
+        raise NothingToBake('the funscripts have no actions')
+
+    if incremental:
+        return bake_file_incremental(job.media, job.output, samplerate, waveform, duration).bake
+
+    epoch = time.time() + 100
+    mapper = BakeTimestampMapper(epoch)
+    algorithm = create_bake_algorithm(load_device_configuration(waveform), kit, script_mapping, mapper, mapper)
+
+    base, ext = os.path.splitext(job.output)
+    partial = base + '.partial' + ext
+    with open_output_file(partial, samplerate, algorithm.channel_count()) as file:
+        result = bake(algorithm, file, samplerate, duration_in_samples, epoch)
+    os.replace(partial, job.output)
+    return result
+
+
+def find_collisions(jobs: list[BatchJob]) -> dict[str, list[BatchJob]]:
+    """
+    Jobs that would write the same output file, like video.mp4 and video.mp3 -> video.wav.
+    :return: output -> jobs, only outputs with more than one job
+    """
+    by_output = {}
+    for job in jobs:
+        by_output.setdefault(os.path.normcase(job.output), []).append(job)
+    return {colliding[0].output: colliding for colliding in by_output.values() if len(colliding) > 1}
+
+
+def run_batch(paths: list[str], manifest_path: str, concurrency: int = None, samplerate: int = 44100,
+              waveform: str = None, extension: str = '.wav', config_path: str = None, force: bool = False,
+              incremental: bool = False, report=print) -> BatchSummary:
+    """
+    Bake every media file with funscripts found in paths, skipping files whose funscripts and
+    settings did not change since the last bake recorded in the manifest.
+
+    :param concurrency: number of files baked at the same time, one process each.
+    :param incremental: only regenerate the changed parts of existing outputs, see bake.incremental.
+    :param report: callable receiving one line of text per file.
+    """
+    start_time = time.time()
+    summary = BatchSummary()
+    manifest = Manifest(manifest_path)
+    manifest.load()
+
+    kit = FunscriptKitModel.load_from_settings()
+    settings_hash = settings_fingerprint(kit, samplerate=samplerate, waveform=waveform)
+
+    media_files = find_media_files(paths)
+    # do not treat earlier bake outputs as media
+    outputs = {default_output_filename(media, extension) for media in media_files}
+    media_files = [media for media in media_files
+                   if media not in outputs and not os.path.splitext(media)[0].endswith('.partial')]
+
+    candidates = []
+    for media in media_files:
+        job = create_job(media, extension)
+        if job is None:
+            summary.no_funscripts += 1
+        else:
+            candidates.append(job)
+
+    # refuse to guess which media file an output belongs to
+    collisions = find_collisions(candidates)
+    for output, colliding in collisions.items():
+        for job in colliding:
+            summary.failed.append(job.media)
+        report(f'{output}: baked from more than one media file '
+               f'({", ".join(job.media for job in colliding)}), rename all but one. Not baked.')
+    colliding_media = {job.media for colliding in collisions.values() for job in colliding}
+
+    jobs = []
+    for job in candidates:
+        if job.media in colliding_media:
+            continue
+        if not force and manifest.is_up_to_date(job, settings_hash):
+            summary.up_to_date += 1
+        else:
+            jobs.append(job)
+    report(f'{len(jobs)} files to bake, {summary.up_to_date} up to date, '
+           f'{summary.no_funscripts} without funscripts, {len(colliding_media)} with colliding outputs')
+
+    with concurrent.futures.ProcessPoolExecutor(concurrency, initializer=init_worker,
+                                                initargs=(config_path, )) as pool:
+        futures = {pool.submit(bake_job, job, samplerate, waveform, incremental): job for job in jobs}
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            job = futures[future]
+            try:
+                result = future.result()
+            except NothingToBake as e:
+                summary.skipped.append(job.media)
+                report(f'[{i + 1}/{len(jobs)}] {job.media}: skipped, {e}')
+                continue
+            except Exception as e:
+                logger.exception(f'bake failed: {job.media}')
+                summary.failed.append(job.media)
+                report(f'[{i + 1}/{len(jobs)}] {job.media}: failed ({e})')
+                continue
+            summary.baked += 1
+            summary.audio_duration += result.duration
+            manifest.record(job, settings_hash, result)
+            manifest.save()
+            report(f'[{i + 1}/{len(jobs)}] {job.output}: {result.summary()}')
+
+    summary.elapsed_time = time.time() - start_time
+    return summary
@@ -0,0 +1,429 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import pickle
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import soundfile as sf
+
+from bake.resample import StreamingResampler
+from stim_math.audio_gen.base_classes import AudioGenerationAlgorithm
+from stim_math.axis import AbstractMediaSync, AbstractTimestampMapper
+
+logger = logging.getLogger('restim.bake_audio')
+
+
+class BakeTimestampMapper(AbstractTimestampMapper, AbstractMediaSync):
+    """
+    Media sync for offline rendering: media is always playing, and media time 0 is at epoch.
+    """
+    def __init__(self, epoch):
+        self.epoch = epoch
+
+    def is_playing(self) -> bool:
+        return True
+
+    def map_timestamp(self, timestamp):
+        return timestamp - self.epoch
+
+
+@dataclass
+class BakeResult:
+    samples_written: int
+    samplerate: int
+    elapsed_time: float     # wall clock, in seconds
+    peak_rss: int | None    # peak resident memory of the process in bytes, None if unknown
+    interrupted: bool
+    synthesis_time: float | None = None    # time spent generating audio, None if not measured
+    encode_time: float | None = None       # time spent encoding and writing, None if not measured
+
+    @property
+    def duration(self) -> float:
+        return self.samples_written / self.samplerate
+
+    @property
+    def realtime_factor(self) -> float:
+        return self.duration / max(self.elapsed_time, 1e-9)
+
+    def summary(self) -> str:
+        text = (f'{self.duration:.1f} seconds of audio in {self.elapsed_time:.1f} seconds '
+                f'({self.realtime_factor:.1f}x realtime)')
+        stages = []
+        if self.synthesis_time:
+            stages.append(f'synthesis {self.duration / self.synthesis_time:.1f}x')
+        if self.encode_time:
+            stages.append(f'encoding {self.duration / self.encode_time:.1f}x')
+        if stages:
+            text += ' [' + ', '.join(stages) + ' realtime]'
+        if self.peak_rss is not None:
+            text += f', peak memory {self.peak_rss / 2**20:.0f} MiB'
+        return text
+
+
+class EncoderThread:
+    """
+    Writes chunks to a sound file on a separate thread, so compression (mp3, flac, ogg)
+    overlaps with synthesis. libsndfile releases the GIL while encoding.
+
+    The queue is bounded, synthesis blocks when the encoder falls behind.
+    """
+    def __init__(self, file: sf.SoundFile, queue_size: int = 16):
+        self.file = file
+        self.queue = queue.Queue(queue_size)
+        self.busy_time = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='restim bake encoder', daemon=True)
+        self.thread.start()
+
+    def write(self, data: np.ndarray):
+        """
+        :param data: array of shape (n, channels). Must not be modified after the call.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(data)
+
+    def close(self):
+        """
+        Wait until all queued chunks are written.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if self.error is not None:
+                continue    # drain the queue so the producer does not block
+            start = time.perf_counter()
+            try:
+                self.file.write(data)
+            except Exception as e:
+                self.error = e
+            self.busy_time += time.perf_counter() - start
+
+
+def peak_rss() -> int | None:
+    """
+    Peak resident set size of the current process in bytes.
+    """
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD),
+                        ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return counters.PeakWorkingSetSize
+        except (AttributeError, OSError):
+            pass
+        return None
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss       # bytes
+    return maxrss * 1024    # kilobytes
+
+
+def chunk_timestamps(epoch: float, samplerate: int, start: int, n: int) -> np.ndarray:
+    """
+    Timestamps of samples [start, start + n), computed from the sample counter
+    so the full timeline never has to be held in memory.
+    """
+    return epoch + (start + np.arange(n)) / samplerate
+
+
+def open_output_file(filename: str, samplerate: int, channels: int) -> sf.SoundFile:
+    _, ext = os.path.splitext(filename)
+    if ext.lower() == '.mp3':
+        # use constant instead of variable bitrate for mp3
+        # to improve seeking accuracy in VLC and other players
+        compression_level = 0.9
+        bitrate_mode = 'CONSTANT'
+    else:
+        compression_level = None
+        bitrate_mode = None
+
+    return sf.SoundFile(filename, mode='w', samplerate=samplerate, channels=channels,
+                        compression_level=compression_level, bitrate_mode=bitrate_mode)
+
+
+def bake(algorithm: AudioGenerationAlgorithm, file: sf.SoundFile, samplerate: int, duration_in_samples: int,
+         epoch: float, chunk_size: int = None, progress=None, is_interrupted=None) -> BakeResult:
+    """
+    Render duration_in_samples of audio and write it to file.
+    Encoding runs on a separate thread, see EncoderThread.
+    :param epoch: timestamp of the first sample
+    :param progress: optional callable, receives the number of samples processed so far
+    :param is_interrupted: optional callable, return True to stop early
+    """
+    chunk_size = chunk_size or int(samplerate / 10)
+    start_time = time.time()
+    samples_processed = 0
+    synthesis_time = 0.0
+    interrupted = False
+
+    encoder = EncoderThread(file)
+    try:
+        while samples_processed < duration_in_samples:
+            if is_interrupted is not None and is_interrupted():
+                interrupted = True
+                break
+            n = min(chunk_size, duration_in_samples - samples_processed)
+            synthesis_start = time.perf_counter()
+            timestamps = chunk_timestamps(epoch, samplerate, samples_processed, n)
+            data = np.vstack(algorithm.generate_audio(samplerate, timestamps, timestamps)).T
+            synthesis_time += time.perf_counter() - synthesis_start
+            encoder.write(data)
+            samples_processed += n
+            if progress is not None:
+                progress(samples_processed)
+    finally:
+        encoder.close()
+
+    return BakeResult(samples_processed, samplerate, time.time() - start_time, peak_rss(), interrupted,
+                      synthesis_time, encoder.busy_time)
+
+
+@dataclass
+class OutputTarget:
+    filename: str
+    samplerate: int
+
+
+def bake_multi(algorithm: AudioGenerationAlgorithm, targets: list[OutputTarget], duration: float, epoch: float,
+               chunk_size: int = None, progress=None, is_interrupted=None) -> list[BakeResult]:
+    """
+    Bake to several files in one pass. Audio is synthesized once, at the highest samplerate of the
+    targets, and resampled for the other targets. Every target has its own encoder thread.
+    :param duration: in seconds
+    :param progress: optional callable, receives the number of samples processed so far,
+        at the highest samplerate
+    :return: one result per target
+    """
+    samplerate = max(target.samplerate for target in targets)
+    chunk_size = chunk_size or int(samplerate / 10)
+    duration_in_samples = int(duration * samplerate)
+    channels = algorithm.channel_count()
+    start_time = time.time()
+
+    files = []
+    encoders = []
+    resamplers = []
+    try:
+        for target in targets:
+            file = open_output_file(target.filename, target.samplerate, channels)
+            files.append(file)
+            encoders.append(EncoderThread(file))
+            resamplers.append(StreamingResampler(samplerate, target.samplerate, channels)
+                              if target.samplerate != samplerate else None)
+
+        samples_processed = 0
+        synthesis_time = 0.0
+        interrupted = False
+        while samples_processed < duration_in_samples:
+            if is_interrupted is not None and is_interrupted():
+                interrupted = True
+                break
+            n = min(chunk_size, duration_in_samples - samples_processed)
+            synthesis_start = time.perf_counter()
+            timestamps = chunk_timestamps(epoch, samplerate, samples_processed, n)
+            data = np.vstack(algorithm.generate_audio(samplerate, timestamps, timestamps)).T
+            synthesis_time += time.perf_counter() - synthesis_start
+            for encoder, resampler in zip(encoders, resamplers):
+                encoder.write(data if resampler is None else resampler.process(data))
+            samples_processed += n
+            if progress is not None:
+                progress(samples_processed)
+
+        for encoder, resampler in zip(encoders, resamplers):
+            if resampler is not None and not interrupted:
+                encoder.write(resampler.flush())
+    finally:
+        for encoder in encoders:
+            encoder.close()
+        for file in files:
+            file.close()
+
+    elapsed_time = time.time() - start_time
+    rss = peak_rss()
+    results = []
+    for target, encoder, resampler in zip(targets, encoders, resamplers):
+        samples_written = samples_processed if resampler is None else resampler.samples_out
+        results.append(BakeResult(samples_written, target.samplerate, elapsed_time, rss, interrupted,
+                                  synthesis_time, encoder.busy_time))
+    return results
+
+
+def checkpoint(algorithm: AudioGenerationAlgorithm) -> bytes:
+    """
+    Serialize the full state of the algorithm, including the global random state
+    used for pulse randomization.
+    """
+    return pickle.dumps((algorithm, np.random.get_state()), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def restore(data: bytes) -> AudioGenerationAlgorithm:
+    algorithm, random_state = pickle.loads(data)
+    np.random.set_state(random_state)
+    return algorithm
+
+
+def advance(algorithm: AudioGenerationAlgorithm, samplerate: int, epoch: float, start: int, n: int, chunk_size: int):
+    """
+    Fast-forward the algorithm over samples [start, start + n) using the same chunks as bake().
+    """
+    for position in range(start, start + n, chunk_size):
+        timestamps = chunk_timestamps(epoch, samplerate, position, min(chunk_size, start + n - position))
+        algorithm.advance(samplerate, timestamps, timestamps)
+
+
+def render_into(algorithm: AudioGenerationAlgorithm, out: np.ndarray, samplerate: int, epoch: float, start: int,
+                chunk_size: int):
+    """
+    Render samples [start, start + len(out)) into out, using the same chunks as bake().
+    :param out: array of shape (n, channels)
+    """
+    n = len(out)
+    for position in range(0, n, chunk_size):
+        m = min(chunk_size, n - position)
+        timestamps = chunk_timestamps(epoch, samplerate, start + position, m)
+        algorithm.generate_audio_into(samplerate, timestamps, timestamps, out[position:position + m].T)
+
+
+def advance_segment(state: bytes, samplerate: int, epoch: float, start: int, n: int, chunk_size: int) -> bytes:
+    """
+    Restore the algorithm from a checkpoint taken at sample start, fast-forward over n samples.
+    Runs in a worker process.
+    :return: checkpoint at sample start + n
+    """
+    algorithm = restore(state)
+    advance(algorithm, samplerate, epoch, start, n, chunk_size)
+    return checkpoint(algorithm)
+
+
+def render_segment(state: bytes, samplerate: int, epoch: float, start: int, n: int, chunk_size: int) -> np.ndarray:
+    """
+    Restore the algorithm from a checkpoint taken at sample start, and render n samples.
+    Runs in a worker process.
+    :return: array of shape (n, channels)
+    """
+    algorithm = restore(state)
+    # float64, like bake(), so conversion to the file format rounds identically
+    out = np.empty((n, algorithm.channel_count()))
+    render_into(algorithm, out, samplerate, epoch, start, chunk_size)
+    return out
+
+
+def bake_parallel(algorithm: AudioGenerationAlgorithm, file: sf.SoundFile, samplerate: int, duration_in_samples: int,
+                  epoch: float, workers: int = None, segment_length: float = 30.0, chunk_size: int = None,
+                  progress=None, is_interrupted=None) -> BakeResult:
+    """
+    Like bake(), but renders segments of segment_length seconds in a process pool.
+
+    The checkpoint at the start of every segment is computed by a dedicated worker process, that
+    fast-forwards the algorithm over the previous segment with algorithm.advance(). The other
+    workers render the segments from these checkpoints. The main process only schedules
+    the work and collects the results, finished segments are encoded on a separate thread,
+    see EncoderThread. Segments use the same chunk boundaries as bake(), so the output is
+    bit-identical to a single-process bake, scripts/check_golden_output.py verifies this.
+    Falls back to bake() when no render worker is requested, or if the algorithm cannot be pickled.
+
+    The fast-forward is sequential, the speedup is limited to render time / advance time,
+    see scripts/benchmark_bake.py.
+
+    :param workers: number of render processes, the fast-forward process runs next to them.
+        Default: number of cpus - 1, so a single-cpu machine bakes in this process
+    """
+    chunk_size = chunk_size or int(samplerate / 10)
+    if workers is None:
+        workers = (os.cpu_count() or 1) - 1
+    # segments start on a chunk boundary
+    segment_in_samples = max(1, int(segment_length * samplerate) // chunk_size) * chunk_size
+
+    if workers < 1:
+        # the fast-forward would only compete with the renderer
+        return bake(algorithm, file, samplerate, duration_in_samples, epoch, chunk_size, progress, is_interrupted)
+
+    try:
+        state = checkpoint(algorithm)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        logger.info(f'algorithm can not be sent to worker processes ({e}), baking in a single process.')
+        return bake(algorithm, file, samplerate, duration_in_samples, epoch, chunk_size, progress, is_interrupted)
+
+    start_time = time.time()
+    samples_processed = 0
+    interrupted = False
+    encoder = EncoderThread(file, queue_size=2)
+    try:
+        # the fast-forward has its own process, so it never waits behind queued segments
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool, \
+                concurrent.futures.ProcessPoolExecutor(1) as fast_forward:
+            pending = collections.deque()
+            scheduled = 0
+            next_state = None   # future of the checkpoint at sample scheduled. None: state is that checkpoint
+            while samples_processed < duration_in_samples:
+                # keep all workers busy, but bound the number of segments held in memory
+                while scheduled < duration_in_samples and len(pending) < workers * 2:
+                    if next_state is not None:
+                        if not next_state.done():
+                            break
+                        state = next_state.result()
+                        next_state = None
+                    n = min(segment_in_samples, duration_in_samples - scheduled)
+                    pending.append(pool.submit(render_segment, state, samplerate, epoch, scheduled, n, chunk_size))
+                    if scheduled + n < duration_in_samples:
+                        next_state = fast_forward.submit(advance_segment, state, samplerate, epoch, scheduled, n,
+                                                         chunk_size)
+                    scheduled += n
+
+                if is_interrupted is not None and is_interrupted():
+                    interrupted = True
+                    for future in pending:
+                        future.cancel()
+                    if next_state is not None:
+                        next_state.cancel()
+                    break
+
+                # wake up for the next finished segment, or the next checkpoint to schedule
+                waiting = list(pending)[:1] + ([next_state] if next_state is not None else [])
+                concurrent.futures.wait(waiting, return_when=concurrent.futures.FIRST_COMPLETED)
+                if not pending or not pending[0].done():
+                    continue
+                data = pending.popleft().result()
+                encoder.write(data)
+                samples_processed += len(data)
+                if progress is not None:
+                    progress(samples_processed)
+    finally:
+        encoder.close()
+
+    return BakeResult(samples_processed, samplerate, time.time() - start_time, peak_rss(), interrupted,
+                      encode_time=encoder.busy_time)
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import logging
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from bake import incremental
+from bake.engine import BakeTimestampMapper
+from bake.incremental import IncrementalBakeResult
+from funscript.collect_funscripts import split_funscript_path
+from qt_ui import settings
+from qt_ui.algorithm_factory import AlgorithmFactory
+from qt_ui.device_wizard.axes import AxisEnum, all_axis
+from qt_ui.device_wizard.enums import DeviceConfiguration, DeviceType, WaveformType
+from qt_ui.models.funscript_kit import FunscriptKitModel
+from qt_ui.models.script_mapping import ScriptMappingModel
+from stim_math.audio_gen.base_classes import AudioGenerationAlgorithm
+from stim_math.audio_gen.params import ThreephaseCalibrationParams, ThreephasePositionTransformParams, VibrationParams
+from stim_math.axis import AbstractMediaSync, AbstractTimestampMapper, create_constant_axis
+
+logger = logging.getLogger('restim.bake_audio')
+
+
+class SettingsAxes:
+    """
+    Stands in for the main window when creating algorithms without a UI.
+
+    AlgorithmFactory falls back to axes owned by the main window tabs for every parameter that
+    is not controlled by a funscript. This class provides the same attributes, as constant axes
+    initialized from the settings the tabs would have loaded.
+    """
+    def __init__(self):
+        self.alpha = create_constant_axis(0.0)
+        self.beta = create_constant_axis(0.0)
+        self.gamma = create_constant_axis(0.0)
+
+        transform_enabled = settings.threephase_transform_enabled.get()
+        transform_type = settings.threephase_transform_combobox_selection.get()
+        self.tab_threephase = SimpleNamespace(
+            calibrate_params=ThreephaseCalibrationParams(
+                neutral=create_constant_axis(settings.threephase_calibration_neutral.get()),
+                right=create_constant_axis(settings.threephase_calibration_right.get()),
+                center=create_constant_axis(settings.threephase_calibration_center.get()),
+            ),
+            transform_params=ThreephasePositionTransformParams(
+                transform_enabled=create_constant_axis(transform_enabled and transform_type == 0),
+                transform_rotation_degrees=create_constant_axis(settings.threephase_transform_rotate.get()),
+                transform_mirror=create_constant_axis(settings.threephase_transform_mirror.get()),
+                transform_top_limit=create_constant_axis(settings.threephase_transform_limit_top.get()),
+                transform_bottom_limit=create_constant_axis(settings.threephase_transform_limit_bottom.get()),
+                transform_left_limit=create_constant_axis(settings.threephase_transform_limit_left.get()),
+                transform_right_limit=create_constant_axis(settings.threephase_transform_limit_right.get()),
+                map_to_edge_enabled=create_constant_axis(transform_enabled and transform_type == 1),
+                map_to_edge_start=create_constant_axis(settings.threephase_map_to_edge_start.get()),
+                map_to_edge_length=create_constant_axis(settings.threephase_map_to_edge_length.get()),
+                map_to_edge_invert=create_constant_axis(settings.threephase_map_to_edge_invert.get()),
+            ),
+        )
+
+        self.tab_volume = SimpleNamespace(
+            axis_api_volume=create_constant_axis(1.0),
+            axis_tau=create_constant_axis(settings.tau_us.get()),
+        )
+
+        self.tab_carrier = SimpleNamespace(
+            axis_carrier=create_constant_axis(settings.mk312_carrier.get()),
+        )
+
+        self.tab_pulse_settings = SimpleNamespace(
+            axis_carrier_frequency=create_constant_axis(settings.pulse_carrier_frequency.get()),
+            axis_pulse_frequency=create_constant_axis(settings.pulse_frequency.get()),
+            axis_pulse_width=create_constant_axis(settings.pulse_width.get()),
+            axis_pulse_interval_random=create_constant_axis(settings.pulse_interval_random.get() / 100),
+            axis_pulse_rise_time=create_constant_axis(settings.pulse_rise_time.get()),
+        )
+
+        self.tab_vibrate = SimpleNamespace(
+            vibration_1=VibrationParams(
+                create_constant_axis(settings.vibration_1_enabled.get()),
+                create_constant_axis(settings.vibration_1_frequency.get()),
+                create_constant_axis(settings.vibration_1_strength.get() / 100),
+                create_constant_axis(settings.vibration_1_left_right_bias.get() / 100),
+                create_constant_axis(settings.vibration_1_high_low_bias.get() / 100),
+                create_constant_axis(settings.vibration_1_random.get() / 100),
+            ),
+            vibration_2=VibrationParams(
+                create_constant_axis(settings.vibration_2_enabled.get()),
+                create_constant_axis(settings.vibration_2_frequency.get()),
+                create_constant_axis(settings.vibration_2_strength.get() / 100),
+                create_constant_axis(settings.vibration_2_left_right_bias.get() / 100),
+                create_constant_axis(settings.vibration_2_high_low_bias.get() / 100),
+                create_constant_axis(settings.vibration_2_random.get() / 100),
+            ),
+        )
+
+
+# settings that change the baked audio, see SettingsAxes and AlgorithmFactory
+audio_settings = [
+    settings.device_config_device_type,
+    settings.device_config_waveform_type,
+    settings.device_config_min_freq,
+    settings.device_config_max_freq,
+    settings.audio_control_rate,
+    settings.threephase_calibration_neutral,
+    settings.threephase_calibration_right,
+    settings.threephase_calibration_center,
+    settings.threephase_transform_combobox_selection,
+    settings.threephase_transform_enabled,
+    settings.threephase_transform_rotate,
+    settings.threephase_transform_mirror,
+    settings.threephase_transform_limit_top,
+    settings.threephase_transform_limit_bottom,
+    settings.threephase_transform_limit_left,
+    settings.threephase_transform_limit_right,
+    settings.threephase_map_to_edge_start,
+    settings.threephase_map_to_edge_length,
+    settings.threephase_map_to_edge_invert,
+    settings.mk312_carrier,
+    settings.pulse_carrier_frequency,
+    settings.pulse_frequency,
+    settings.pulse_width,
+    settings.pulse_interval_random,
+    settings.pulse_rise_time,
+    settings.vibration_1_enabled,
+    settings.vibration_1_frequency,
+    settings.vibration_1_strength,
+    settings.vibration_1_left_right_bias,
+    settings.vibration_1_high_low_bias,
+    settings.vibration_1_random,
+    settings.vibration_2_enabled,
+    settings.vibration_2_frequency,
+    settings.vibration_2_strength,
+    settings.vibration_2_left_right_bias,
+    settings.vibration_2_high_low_bias,
+    settings.vibration_2_random,
+]
+
+
+def settings_fingerprint(kit: FunscriptKitModel, **extra) -> str:
+    """
+    Hash of all settings that influence the baked audio: the settings above, the funscript
+    kit (axis names and limits) and any extra values like the samplerate or waveform override.
+    Unrelated settings like window positions do not change the hash.
+    """
+    values = {setting.key: setting.get() for setting in audio_settings}
+    values['funscript_configuration'] = [
+        (item.axis.name, item.funscript_names, item.limit_min, item.limit_max, item.auto_loading)
+        for item in kit.funscript_conifg()
+    ]
+    values.update(extra)
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def detect_funscripts(path: str, kit: FunscriptKitModel) -> ScriptMappingModel:
+    """
+    Find the funscripts belonging to a media file or funscript, the same way the media tab does,
+    and link them to axes.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    basename = os.path.basename(path)
+    search_paths = [dirname] + settings.additional_search_paths.get()
+
+    script_mapping = ScriptMappingModel()
+    script_mapping.detect_funscripts_from_path(search_paths, basename)
+    script_mapping.auto_link_funscripts(kit)
+    return script_mapping
+
+
+def funscript_duration(script_mapping: ScriptMappingModel) -> float:
+    """
+    Time of the last action of all linked funscripts, in seconds.
+    """
+    duration = 0.0
+    for item in script_mapping.funscript_conifg():
+        if not item.has_broken_script() and len(item.script.x):
+            duration = max(duration, float(np.max(item.script.x)))
+    return duration
+
+
+def funscript_axes(script_mapping: ScriptMappingModel) -> dict[AxisEnum, tuple[np.ndarray, np.ndarray]]:
+    """
+    The funscript data AlgorithmFactory uses for every axis, as (x, y).
+    """
+    axes = {}
+    for axis in all_axis:
+        item = script_mapping.get_config_for_axis(axis)
+        if item is not None and not item.has_broken_script():
+            axes[axis] = (item.script.x, item.script.y)
+    return axes
+
+
+def bake_file_incremental(media: str, output: str, samplerate: int, waveform: str = None, duration: float = None,
+                          progress=None) -> IncrementalBakeResult:
+    """
+    Bake the funscripts of media to output, regenerating only the parts that changed since the last bake.
+    """
+    kit = FunscriptKitModel.load_from_settings()
+    script_mapping = detect_funscripts(media, kit)
+    if duration is None:
+        duration = funscript_duration(script_mapping)
+    linked = []
+    for axis in all_axis:
+        item = script_mapping.get_config_for_axis(axis)
+        if item is not None:
+            linked.append((axis.name, item.file_name))
+    settings_hash = settings_fingerprint(kit, samplerate=samplerate, waveform=waveform, funscripts=linked)
+
+    # the random state and timestamps must be identical to the previous bake
+    np.random.seed(incremental.RANDOM_SEED)
+    mapper = BakeTimestampMapper(incremental.EPOCH)
+    algorithm = create_bake_algorithm(load_device_configuration(waveform), kit, script_mapping, mapper, mapper)
+
+    index = incremental.create_index(settings_hash, funscript_axes(script_mapping), samplerate,
+                                     algorithm.channel_count(), int(samplerate * duration))
+    return incremental.bake_incremental(algorithm, output, index, progress)
+
+
+def load_device_configuration(waveform: str = None) -> DeviceConfiguration:
+    """
+    :param waveform: 'continuous' or 'pulse' to override the configured waveform type.
+    """
+    device = DeviceConfiguration.from_settings()
+    if waveform == 'continuous':
+        device.waveform_type = WaveformType.CONTINUOUS
+    elif waveform == 'pulse':
+        device.waveform_type = WaveformType.PULSE_BASED
+    return device
+
+
+def default_output_filename(path: str, extension: str = '.wav') -> str:
+    """
+    video.mp4 -> video.wav, video.alpha.funscript -> video.wav
+    """
+    if path.lower().endswith('.funscript'):
+        prefix, _, _ = split_funscript_path(path)
+        return os.path.join(os.path.dirname(path), prefix + extension)
+    return os.path.splitext(path)[0] + extension
+
+
+def create_bake_algorithm(device: DeviceConfiguration,
+                          kit: FunscriptKitModel,
+                          script_mapping: ScriptMappingModel,
+                          timestamp_mapper: AbstractTimestampMapper,
+                          media_sync: AbstractMediaSync) -> AudioGenerationAlgorithm:
+    """
+    Create an audio algorithm for baking, without instantiating any widgets.
+    """
+    if device.device_type != DeviceType.AUDIO_THREE_PHASE:
+        raise ValueError('only audio devices can be baked')
+    if device.waveform_type not in (WaveformType.CONTINUOUS, WaveformType.PULSE_BASED):
+        raise ValueError(f'waveform type {device.waveform_type.name} can not be baked without the UI')
+
+    algorithm_factory = AlgorithmFactory(
+        SettingsAxes(),
+        kit,
+        script_mapping,
+        timestamp_mapper,
+        media_sync,
+        load_funscripts=True,
+        create_for_bake=True
+    )
+    return algorithm_factory.create_algorithm(device)
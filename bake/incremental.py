@@ -0,0 +1,271 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+
+import numpy as np
+import soundfile as sf
+
+from bake.engine import BakeResult, advance, open_output_file, peak_rss, render_into
+from qt_ui.device_wizard.axes import AxisEnum
+from stim_math.audio_gen.base_classes import AudioGenerationAlgorithm
+
+logger = logging.getLogger('restim.bake_audio')
+
+INDEX_VERSION = 1
+
+# fixed timestamp of the first sample, so re-rendered segments round exactly like the original bake
+EPOCH = 1000.0
+
+# global random state at the start of every incremental bake
+RANDOM_SEED = 0
+
+# Axes that change the state carried from one segment to the next (carrier phase, pulse timing,
+# random state, vibration phase). A change here invalidates all following segments.
+# Other axes only change the audio of the segment they are in.
+state_axes = {
+    AxisEnum.CARRIER_FREQUENCY,
+    AxisEnum.PULSE_FREQUENCY,
+    AxisEnum.PULSE_WIDTH,
+    AxisEnum.PULSE_INTERVAL_RANDOM,
+    AxisEnum.VIBRATION_1_FREQUENCY,
+    AxisEnum.VIBRATION_2_FREQUENCY,
+}
+
+# Formats where clean segments can be copied from the old output without changing them.
+# Lossy formats (OGG, MP3) would add a generation loss on every re-bake, and MP3 encoder
+# padding shifts the sample positions the index refers to.
+lossless_formats = {'WAV', 'FLAC'}
+
+
+@dataclass
+class BakeIndex:
+    """
+    Sidecar file describing how an output was baked, with a hash of the inputs of every segment.
+    """
+    settings_hash: str
+    samplerate: int
+    channels: int
+    total_samples: int
+    segment_samples: int
+    chunk_size: int
+    epoch: float
+    input_hashes: list[str]     # per segment, all axis data that influences the segment
+    state_hashes: list[str]     # per segment, only axes in state_axes
+
+    @staticmethod
+    def filename_for(output: str) -> str:
+        return output + '.bakeindex.json'
+
+    @staticmethod
+    def load(path: str) -> 'BakeIndex | None':
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.pop('version', None) != INDEX_VERSION:
+                return None
+            return BakeIndex(**data)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f'could not read bake index {path}: {e}')
+            return None
+
+    def save(self, path: str):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, **asdict(self)}, f)
+        os.replace(tmp, path)
+
+    def same_layout(self, other: 'BakeIndex') -> bool:
+        return (self.settings_hash, self.samplerate, self.channels, self.total_samples,
+                self.segment_samples, self.chunk_size, self.epoch) == \
+               (other.settings_hash, other.samplerate, other.channels, other.total_samples,
+                other.segment_samples, other.chunk_size, other.epoch)
+
+    def segment_count(self) -> int:
+        return len(self.input_hashes)
+
+
+def segment_hashes(axes: dict[AxisEnum, tuple[np.ndarray, np.ndarray]], samplerate: int, total_samples: int,
+                   segment_samples: int) -> tuple[list[str], list[str]]:
+    """
+    :param axes: funscript data per axis, (x, y) with x in seconds of media time.
+    :return: (input hashes, state hashes), one per segment. A segment hash covers every action
+        that can influence interpolation inside the segment, including the actions just outside it.
+    """
+    n_segments = -(-total_samples // segment_samples)
+    starts = np.arange(n_segments) * segment_samples / samplerate
+    ends = np.minimum(np.arange(1, n_segments + 1) * segment_samples, total_samples) / samplerate
+
+    inputs = [hashlib.sha1() for _ in range(n_segments)]
+    states = [hashlib.sha1() for _ in range(n_segments)]
+    for axis in sorted(axes, key=lambda a: a.value):
+        x, y = axes[axis]
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        y = np.ascontiguousarray(y, dtype=np.float64)
+        first = np.maximum(np.searchsorted(x, starts, 'right') - 1, 0)
+        last = np.minimum(np.searchsorted(x, ends, 'left') + 1, len(x))
+        for i in range(n_segments):
+            data = axis.name.encode('ascii') + x[first[i]:last[i]].tobytes() + y[first[i]:last[i]].tobytes()
+            inputs[i].update(data)
+            if axis in state_axes:
+                states[i].update(data)
+    return [h.hexdigest() for h in inputs], [h.hexdigest() for h in states]
+
+
+def dirty_segments(old: BakeIndex, new: BakeIndex) -> list[int]:
+    """
+    Segments that must be regenerated. A segment is dirty if:
+    - its inputs changed
+    - the inputs of the previous segment changed; the last pulse or vibration period of a segment
+      can spill into the next one
+    - a state axis changed in any earlier segment, shifting the carrier phase and pulse timing
+    """
+    dirty = []
+    state_changed = False
+    previous_changed = False
+    for i in range(new.segment_count()):
+        changed = old.input_hashes[i] != new.input_hashes[i]
+        if changed or previous_changed or state_changed:
+            dirty.append(i)
+        state_changed |= old.state_hashes[i] != new.state_hashes[i]
+        previous_changed = changed
+    return dirty
+
+
+def create_index(settings_hash: str, axes: dict[AxisEnum, tuple[np.ndarray, np.ndarray]], samplerate: int,
+                 channels: int, total_samples: int, segment_length: float = 10.0, chunk_size: int = None) -> BakeIndex:
+    """
+    :param segment_length: in seconds, rounded to a multiple of the chunk size.
+    """
+    chunk_size = chunk_size or int(samplerate / 10)
+    segment_samples = max(1, int(segment_length * samplerate) // chunk_size) * chunk_size
+    input_hashes, state_hashes = segment_hashes(axes, samplerate, total_samples, segment_samples)
+    return BakeIndex(settings_hash, samplerate, channels, total_samples, segment_samples, chunk_size, EPOCH,
+                     input_hashes, state_hashes)
+
+
+@dataclass
+class IncrementalBakeResult:
+    bake: BakeResult
+    segments_total: int
+    segments_rendered: int
+    full: bool      # True if the output was baked from scratch
+
+    def summary(self) -> str:
+        if self.full:
+            return f'full bake, {self.bake.summary()}'
+        return (f'{self.segments_rendered}/{self.segments_total} segments regenerated '
+                f'in {self.bake.elapsed_time:.1f} seconds')
+
+
+def output_matches(output: str, index: BakeIndex) -> bool:
+    try:
+        info = sf.info(output)
+    except RuntimeError:
+        return False
+    return info.frames == index.total_samples and info.samplerate == index.samplerate and \
+        info.channels == index.channels
+
+
+def bake_incremental(algorithm: AudioGenerationAlgorithm, output: str, index: BakeIndex,
+                     progress=None) -> IncrementalBakeResult:
+    """
+    Bake to output, regenerating only the segments whose inputs changed since the bake described
+    by the sidecar index. Falls back to a full bake if there is no usable index.
+
+    The algorithm must be freshly created, with the global random state seeded the same way as
+    for the previous bake. Clean segments before a dirty segment are fast-forwarded with
+    algorithm.advance(), so every regenerated segment starts with the exact carrier phase and
+    pulse state of a full bake, and the splice is seamless.
+
+    WAV files are patched in place, FLAC files are rewritten, copying clean segments.
+    Lossy formats are always baked completely, see lossless_formats.
+    """
+    start_time = time.time()
+    index_path = BakeIndex.filename_for(output)
+    old = BakeIndex.load(index_path)
+
+    if old is not None and old.same_layout(index) and output_matches(output, old):
+        dirty = dirty_segments(old, index)
+        full = False
+    else:
+        dirty = list(range(index.segment_count()))
+        full = True
+        if os.path.exists(output):
+            logger.info(f'{output}: bake index missing or settings changed, baking everything')
+
+    if not dirty:
+        return IncrementalBakeResult(
+            BakeResult(0, index.samplerate, time.time() - start_time, peak_rss(), False),
+            index.segment_count(), 0, False)
+
+    if not full and sf.info(output).format not in lossless_formats:
+        logger.info(f'{output}: {sf.info(output).format} is a lossy format, '
+                    f'baking everything instead of re-encoding unchanged segments')
+        dirty = list(range(index.segment_count()))
+        full = True
+
+    # the index is invalid while the output is being modified
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    if not full and sf.info(output).format == 'WAV':
+        with sf.SoundFile(output, 'r+') as file:
+            samples = write_segments(algorithm, file, index, dirty, in_place=True, progress=progress)
+    else:
+        base, ext = os.path.splitext(output)
+        partial = base + '.partial' + ext
+        old_file = None if full else sf.SoundFile(output)
+        try:
+            if old_file is None:
+                file = open_output_file(partial, index.samplerate, index.channels)
+            else:
+                file = sf.SoundFile(partial, 'w', samplerate=index.samplerate, channels=index.channels,
+                                    format=old_file.format, subtype=old_file.subtype)
+            with file:
+                samples = write_segments(algorithm, file, index, dirty, old_file=old_file, progress=progress)
+        finally:
+            if old_file is not None:
+                old_file.close()
+        os.replace(partial, output)
+
+    index.save(index_path)
+    result = BakeResult(samples, index.samplerate, time.time() - start_time, peak_rss(), False)
+    return IncrementalBakeResult(result, index.segment_count(), len(dirty), full)
+
+
+def write_segments(algorithm: AudioGenerationAlgorithm, file: sf.SoundFile, index: BakeIndex, dirty: list[int],
+                   in_place: bool = False, old_file: sf.SoundFile = None, progress=None) -> int:
+    """
+    Render the dirty segments into file.
+    :param in_place: patch the dirty segments of an existing file. Otherwise, file is written front to back
+        and clean segments are copied from old_file.
+    :return: number of samples rendered
+    """
+    position = 0    # the algorithm state is at this sample
+    rendered = 0
+    dirty = set(dirty)
+    for segment in range(index.segment_count()):
+        start = segment * index.segment_samples
+        n = min(index.segment_samples, index.total_samples - start)
+        if segment not in dirty:
+            if not in_place:
+                old_file.seek(start)
+                file.write(old_file.read(n))
+            continue
+
+        advance(algorithm, index.samplerate, index.epoch, position, start - position, index.chunk_size)
+        data = np.empty((n, index.channels))
+        render_into(algorithm, data, index.samplerate, index.epoch, start, index.chunk_size)
+        position = start + n
+        if in_place:
+            file.seek(start)
+        file.write(data)
+        rendered += n
+        if progress is not None:
+            progress(rendered)
+    return rendered
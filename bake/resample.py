@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+
+
+# numpy implementation, does not depend on scipy
+class StreamingResampler:
+    """
+    Polyphase resampler for a rational ratio, with a Kaiser-windowed sinc low-pass filter.
+    Audio is processed in chunks of any size, the output is independent of the chunk boundaries.
+
+    Output sample j is taken at input position j * in_rate / out_rate, without delay.
+    """
+    def __init__(self, in_rate: int, out_rate: int, channels: int, taps: int = 32, beta: float = 8.0):
+        g = math.gcd(int(in_rate), int(out_rate))
+        self.up = int(out_rate) // g
+        self.down = int(in_rate) // g
+        self.channels = channels
+        self.taps = taps
+        self.center = taps // 2
+
+        # weights[r, k] is the weight of input q - center + k for an output at position q + r / up
+        cutoff = min(1.0, self.up / self.down)
+        s = np.arange(self.up)[:, None] / self.up + self.center - np.arange(taps)[None, :]
+        half_width = taps / 2
+        window = np.i0(beta * np.sqrt(np.clip(1 - (s / half_width) ** 2, 0, 1))) / np.i0(beta)
+        window[np.abs(s) > half_width] = 0
+        self.weights = cutoff * np.sinc(cutoff * s) * window
+        self.weights /= np.sum(self.weights, axis=1, keepdims=True)
+
+        # input samples, starting at input index buffer_start. Zeros before the start of the stream.
+        self.buffer = np.zeros((self.center, channels))
+        self.buffer_start = -self.center
+        self.samples_in = 0
+        self.samples_out = 0
+
+    def output_length(self, input_length: int) -> int:
+        return -(-input_length * self.up // self.down)
+
+    def process(self, data: np.ndarray) -> np.ndarray:
+        """
+        :param data: array of shape (n, channels)
+        :return: all output samples that can be computed from the input so far, shape (m, channels)
+        """
+        self.buffer = np.concatenate((self.buffer, data))
+        self.samples_in += len(data)
+        # the last input needed by output j is j * down // up - center + taps - 1
+        available = self.samples_in - (self.taps - self.center)
+        last = -(-(available + 1) * self.up // self.down) - 1 if available >= 0 else -1
+        last = min(last, self.output_length(self.samples_in) - 1)
+        return self._compute(last)
+
+    def flush(self) -> np.ndarray:
+        """
+        :return: the remaining output samples, computed with zeros after the end of the input.
+        """
+        self.buffer = np.concatenate((self.buffer, np.zeros((self.taps, self.channels))))
+        return self._compute(self.output_length(self.samples_in) - 1)
+
+    def _compute(self, last: int) -> np.ndarray:
+        j = np.arange(self.samples_out, last + 1)
+        if len(j) == 0:
+            return np.zeros((0, self.channels))
+        position = j * self.down
+        q = position // self.up
+        r = position % self.up
+        index = (q - self.center - self.buffer_start)[:, None] + np.arange(self.taps)
+        out = np.einsum('jtc,jt->jc', self.buffer[index], self.weights[r])
+        self.samples_out = last + 1
+
+        # drop input that is no longer needed
+        first_needed = self.samples_out * self.down // self.up - self.center
+        drop = max(0, first_needed - self.buffer_start)
+        self.buffer = self.buffer[drop:]
+        self.buffer_start += drop
+        return out
@@ -8,6 +8,7 @@ import sounddevice as sd
 from stim_math.audio_gen.base_classes import AudioGenerationAlgorithm
 from qt_ui import settings
 from device.output_device import OutputDevice
+from device.audio.lookahead import LookaheadProducer, LookaheadStats
 
 logger = logging.getLogger('restim.audio')
 
@@ -38,6 +39,12 @@ class ChannelMappingParameters:
     device_channel_map: list[int]
 
 
+@dataclass
+class AudioOutputStats:
+    output_underflows: int              # reported by portaudio
+    lookahead: LookaheadStats | None    # None if lookahead is disabled
+
+
 class AudioStimDevice(OutputDevice):
     def __init__(self, parent):
         OutputDevice.__init__(self)
@@ -52,8 +59,15 @@ class AudioStimDevice(OutputDevice):
         self.algorithm = None
         self.previous_error = []
 
+        self.lookahead = None
+        self.output_underflows = 0
+
     def start(self, host_api_name, audio_device_name, latency, algorithm: AudioGenerationAlgorithm,
-              mapping_parameters: list[ChannelMappingParameters]):
+              mapping_parameters: list[ChannelMappingParameters], lookahead_ms=0):
+        """
+        :param lookahead_ms: if nonzero, render audio ahead of time on a separate thread.
+            Increases latency but makes the output robust against stalls of the python interpreter.
+        """
         device_index = -1
         for device in sd.query_devices():
             if sd.query_hostapis(device['hostapi'])['name'] == host_api_name:
@@ -90,12 +104,20 @@ class AudioStimDevice(OutputDevice):
                 self.algorithm = algorithm
                 self.channel_map = mapping_parameter.device_channel_map
                 self.offset = time.time()
+                self.output_underflows = 0
+                if lookahead_ms > 0:
+                    self.lookahead = LookaheadProducer(algorithm, self.sample_rate,
+                                                       int(self.sample_rate * lookahead_ms / 1000))
+                    self.lookahead.start(self.offset)
                 self.stream.start()
             except sd.PortAudioError as e:
                 logger.error(f"Portaudio says: {e}")
+                self.stop_lookahead()
                 continue
 
             logger.info("Portaudio says: Success!")
+            if self.lookahead is not None:
+                logger.info(f"Audio lookahead enabled: {lookahead_ms}ms")
             return
 
     def start_modify(self, host_api_name, audio_input_device_name, audio_output_device_name, latency, algorithm,
@@ -150,6 +172,24 @@ class AudioStimDevice(OutputDevice):
             self.stream.stop()  # blocks
             self.stream.close()
         self.stream = None
+        self.stop_lookahead()
+
+    def stop_lookahead(self):
+        if self.lookahead is not None:
+            self.lookahead.stop()
+        self.lookahead = None
+
+    def flush_lookahead(self):
+        """
+        Discard audio rendered ahead of time. Changes to the position and volume axes and
+        the media state already flush automatically, see LookaheadProducer.
+        """
+        if self.lookahead is not None:
+            self.lookahead.flush()
+
+    def stats(self) -> AudioOutputStats:
+        lookahead = self.lookahead
+        return AudioOutputStats(self.output_underflows, lookahead.stats() if lookahead is not None else None)
 
     def is_connected_and_running(self) -> bool:
         return self.stream is not None
@@ -159,8 +199,19 @@ class AudioStimDevice(OutputDevice):
             return [ChannelMappingParameters(2, [0, 1])]
         raise RuntimeError('Invalid audio algorithm')
 
+    def output_channels(self, outdata: np.ndarray):
+        """
+        Split the sounddevice output buffer into one column view per algorithm channel,
+        following the channel map. Columns not in the channel map are silenced.
+        """
+        for out_channel in range(outdata.shape[1]):
+            if out_channel not in self.channel_map:
+                outdata[:, out_channel] = 0
+        return [outdata[:, out_channel] for out_channel in self.channel_map]
+
     def callback(self, outdata: np.ndarray, frames: int, patime, status: sd.CallbackFlags):
-        outdata.fill(0.0)
+        if status.output_underflow:
+            self.output_underflows += 1
 
         # generate timeline that is guaranteed to increase at a steady rate.
         # not referenced to any system clock
@@ -191,15 +242,19 @@ class AudioStimDevice(OutputDevice):
             # print(error * 1000, adjustment * 1000, adjustment * 44100 / frames * 100, self.previous_error)
             old_offset = self.offset
             self.offset += adjustment
-            command_timeline = steady_clock + np.linspace(old_offset, self.offset, frames, endpoint=False)
 
-        # generate audio
-        data = np.array(self.algorithm.generate_audio(self.sample_rate, steady_clock, command_timeline)).T
-        for in_channel, out_channel in enumerate(self.channel_map):
-            outdata[:, out_channel] = data[:, in_channel]
+        if self.lookahead is not None:
+            # audio was rendered ahead of time, only copy it
+            self.lookahead.set_offset(self.offset)
+            self.lookahead.read_into(self.output_channels(outdata), frames)
+            return
+
+        command_timeline = steady_clock + np.linspace(old_offset, self.offset, frames, endpoint=False)
+
+        # generate audio straight into the output buffer
+        self.algorithm.generate_audio_into(self.sample_rate, steady_clock, command_timeline,
+                                           self.output_channels(outdata))
 
     def callback_rw(self, indata, outdata, frames, time, status):
-        data = np.array(self.algorithm.modify_audio(np.array(indata))).T
-        for in_channel, out_channel in enumerate(self.channel_map):
-            outdata[:, out_channel] = data[:, in_channel]
+        self.algorithm.modify_audio_into(indata, self.output_channels(outdata))
 
@@ -0,0 +1,353 @@
+import collections
+import io
+import logging
+import pickle
+import threading
+import time
+import types
+from dataclasses import dataclass
+
+import numpy as np
+
+from stim_math.audio_gen.base_classes import AudioGenerationAlgorithm
+from stim_math.audio_gen.ring_buffer import SampleRingBuffer
+from stim_math.axis import AbstractAxis, AbstractMediaSync, AbstractTimestampMapper, latest_version
+from stim_math.axis_bundle import axis_fields
+
+logger = logging.getLogger('restim.audio')
+
+
+@dataclass
+class LookaheadStats:
+    underruns: int          # callbacks that found less audio than required
+    late_blocks: int        # blocks that were finished when the buffer was almost empty
+    fill_level: int         # in samples
+    depth: int              # in samples
+
+
+def watched_axes(algorithm: AudioGenerationAlgorithm) -> list[AbstractAxis]:
+    """
+    The position and volume axes of an algorithm. Live changes to these should be heard
+    without the lookahead latency.
+    """
+    params = getattr(algorithm, 'params', None)
+    axes = []
+    for name in ('position', 'volume'):
+        group = getattr(params, name, None)
+        if group is not None:
+            axes.extend(axis for _, axis in axis_fields(group))
+    return axes
+
+
+class _StatePickler(pickle.Pickler):
+    """
+    Pickles the internal state of an algorithm. Its inputs (params, axes, media, callbacks)
+    are referenced instead of copied, the restored state keeps using the live objects.
+    """
+    shared_types = (AbstractAxis, AbstractMediaSync, AbstractTimestampMapper,
+                    types.FunctionType, types.MethodType, types.BuiltinFunctionType)
+
+    def __init__(self, file, inputs: list):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.input_ids = {id(obj) for obj in inputs if obj is not None}
+        self.shared = []
+
+    def persistent_id(self, obj):
+        if id(obj) in self.input_ids or isinstance(obj, self.shared_types):
+            self.shared.append(obj)
+            return len(self.shared) - 1
+        return None
+
+
+class _StateUnpickler(pickle.Unpickler):
+    def __init__(self, file, shared: list):
+        super().__init__(file)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+
+@dataclass
+class AlgorithmSnapshot:
+    frame: int          # steady clock position of the next sample the algorithm renders
+    data: bytes
+    shared: list
+
+    @staticmethod
+    def take(algorithm: AudioGenerationAlgorithm, frame: int) -> 'AlgorithmSnapshot':
+        f = io.BytesIO()
+        # the media source is not an AbstractMediaSync in the application, it is a QObject
+        pickler = _StatePickler(f, [getattr(algorithm, 'media', None), getattr(algorithm, 'params', None)])
+        pickler.dump(algorithm.__dict__)
+        return AlgorithmSnapshot(frame, f.getvalue(), pickler.shared)
+
+    def restore(self, algorithm: AudioGenerationAlgorithm):
+        state = _StateUnpickler(io.BytesIO(self.data), self.shared).load()
+        algorithm.__dict__.clear()
+        algorithm.__dict__.update(state)
+
+
+class LookaheadProducer:
+    """
+    Renders audio ahead of time on a dedicated thread, so hiccups in the python
+    interpreter do not immediately cause dropouts. The audio callback only copies
+    from the buffer (single producer, single consumer).
+
+    The producer renders the sample at steady clock position k with the timestamp
+    k / samplerate + offset, where offset is the latest clock offset estimated by the consumer.
+
+    When the value of a watched axis changes (position or volume, see watched_axes()), or the media
+    is paused, resumed or seeked, the audio rendered ahead is discarded down to flush_latency, so the
+    change is heard with low latency. Funscript values are rendered at the timestamp the sample is
+    played, they need no flush while the media plays. Changes are coalesced into at most one flush per
+    audio callback, and for one lookahead depth after a flush the producer only renders flush_latency
+    ahead. A live position stream at 50-100 Hz then plays at flush_latency, without re-rendering
+    the full depth on every update. flush() discards all but one callback, for the lowest latency.
+
+    The algorithm is rewound to the first discarded sample: restored from a snapshot of its state
+    taken at most snapshot_interval earlier, and fast-forwarded with advance(). Carrier phase and
+    pulse sequence continue without a jump. Algorithms that can not be pickled are not rewound,
+    their output jumps ahead by the discarded audio on every flush.
+    """
+    def __init__(self, algorithm: AudioGenerationAlgorithm, samplerate: int, depth_in_samples: int,
+                 blocksize: int = 256, log_interval: float = 5.0, watched: list[AbstractAxis] = None,
+                 snapshot_interval: float = 0.02, flush_latency: float = 0.03):
+        """
+        :param watched: axes that flush the lookahead when their value changes. Default: watched_axes(algorithm)
+        :param snapshot_interval: in seconds
+        :param flush_latency: in seconds, audio kept ahead after a change of a watched axis or the media state
+        """
+        self.algorithm = algorithm
+        self.samplerate = samplerate
+        self.depth = max(int(depth_in_samples), blocksize)
+        self.blocksize = blocksize
+        self.log_interval = log_interval
+
+        self.watched = watched_axes(algorithm) if watched is None else list(watched)
+        self._watched_version = latest_version(self.watched)
+        self._watched_values = [axis.last_value() for axis in self.watched]
+        self._media_state = self._media_key()
+        self.flush_latency = min(max(int(samplerate * flush_latency), blocksize), self.depth)
+        self._flush_pending = False
+        self._last_flush_frame = None           # consumed_frames at the last automatic flush
+        self._shallow_until = 0                 # consumed_frames until which the producer renders flush_latency ahead
+
+        self.snapshot_interval = int(samplerate * snapshot_interval)
+        self.snapshots = collections.deque()    # AlgorithmSnapshot, oldest first
+        self.can_rewind = True
+        self.rewind_to = None                   # set by flush, steady clock position to rewind the algorithm to
+
+        self.buffer = SampleRingBuffer(self.depth + blocksize, algorithm.channel_count())
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+        self.offset = time.time()       # system time of steady clock 0
+        self.produced_frames = 0        # steady clock position of the next rendered sample
+        self.consumed_frames = 0        # steady clock position of the next sample played
+        self.last_read_size = 0         # size of the most recent callback
+        self.generation = 0             # incremented on flush, discards blocks being rendered
+
+        self.underruns = 0
+        self.late_blocks = 0
+        self._logged_underruns = 0
+        self._logged_late_blocks = 0
+        self._last_log_time = time.time()
+
+    def start(self, offset: float):
+        self.offset = offset
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='restim audio lookahead', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        logger.info(f'audio lookahead stopped. {self.underruns} underruns, {self.late_blocks} late blocks')
+
+    def stats(self) -> LookaheadStats:
+        with self.condition:
+            return LookaheadStats(self.underruns, self.late_blocks, self.buffer.fill_level, self.depth)
+
+    def set_offset(self, offset: float):
+        self.offset = offset
+
+    def flush(self):
+        """
+        Discard audio rendered ahead, so changes to volume or position are heard
+        with minimal latency. One callback worth of audio is kept to avoid an underrun.
+        Called automatically when a watched axis or the media state changes.
+        """
+        with self.condition:
+            self._flush()
+
+    def _flush(self, keep: int = 0):
+        """
+        :param keep: in samples, at least one callback is kept
+        """
+        # keep audio rounded up to the blocks it was rendered in, so the re-rendered audio
+        # uses the same blocks and is identical to what would have been played without the change
+        keep = max(keep, self.last_read_size)
+        keep_until = min(self.consumed_frames + keep, self.produced_frames)
+        keep_until += (self.produced_frames - keep_until) % self.blocksize
+        self.buffer.truncate(keep_until - self.consumed_frames)
+        self.produced_frames = self.consumed_frames + self.buffer.fill_level
+        self.rewind_to = self.produced_frames
+        self.generation += 1
+        self.condition.notify_all()
+
+    def _media_key(self):
+        # changes on play, pause, seek and resync. While the media plays, funscript axes are rendered
+        # at the media timestamp of the sample, so they need no flush
+        media = getattr(self.algorithm, 'media', None)
+        if media is None:
+            return None
+        map_timestamp = getattr(media, 'map_timestamp', None)
+        return media.is_playing(), map_timestamp(0.0) if map_timestamp is not None else None
+
+    def _media_changed(self) -> bool:
+        key = self._media_key()
+        if key == self._media_state:
+            return False
+        self._media_state = key
+        return True
+
+    def _watched_axes_changed(self) -> bool:
+        version = latest_version(self.watched)
+        if version == self._watched_version:
+            return False
+        self._watched_version = version
+        # add() with the same value, like the periodic inactivity volume update, does not flush
+        values = [axis.last_value() for axis in self.watched]
+        if values == self._watched_values:
+            return False
+        self._watched_values = values
+        return True
+
+    def _flush_if_changed(self):
+        # evaluate both, to remember the latest state
+        media_changed = self._media_changed()
+        if self._watched_axes_changed() or media_changed:
+            self._flush_pending = True
+        # a flush discards what the previous flush rendered, at most one per callback
+        if self._flush_pending and self.consumed_frames != self._last_flush_frame:
+            self._flush(self.flush_latency)
+            self._flush_pending = False
+            self._last_flush_frame = self.consumed_frames
+            self._shallow_until = self.consumed_frames + self.depth
+
+    def _fill_target(self) -> int:
+        if self.consumed_frames < self._shallow_until:
+            # changes are likely to follow, do not render what the next flush discards
+            return max(self.flush_latency, self.last_read_size)
+        return self.depth
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    self._flush_if_changed()
+                    if self.stopped or self.buffer.fill_level < self._fill_target():
+                        break
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                generation = self.generation
+                start = self.produced_frames
+                offset = self.offset
+                rewind_to, self.rewind_to = self.rewind_to, None
+
+            if rewind_to is not None:
+                self.rewind(rewind_to, offset)
+            self.take_snapshot_if_needed(start)
+
+            steady_clock = (start + np.arange(self.blocksize)) / self.samplerate
+            channels = self.algorithm.generate_audio(self.samplerate, steady_clock, steady_clock + offset)
+
+            with self.condition:
+                if generation != self.generation:
+                    continue    # flushed while rendering
+                if self.buffer.fill_level < self.last_read_size:
+                    self.late_blocks += 1
+                self.buffer.write(*channels)
+                self.produced_frames += self.blocksize
+
+            self.log_if_needed()
+
+    def read_into(self, out, frames: int):
+        """
+        Called from the audio callback. Copy buffered audio into out, fill with silence on underrun.
+        :param out: sequence of writable arrays, one per channel
+        """
+        with self.condition:
+            n = min(frames, self.buffer.fill_level)
+            self.buffer.read(n, out=[channel[:n] for channel in out])
+            self.consumed_frames += frames
+            self.last_read_size = frames
+            if n < frames:
+                self.underruns += 1
+                # the audio we missed is no longer useful
+                self.buffer.clear()
+                self.produced_frames = self.consumed_frames
+                self.rewind_to = None
+                self.generation += 1
+            self.condition.notify_all()
+
+        for channel in out:
+            channel[n:] = 0
+
+    def take_snapshot_if_needed(self, frame: int):
+        """
+        Called by the producer thread before rendering the sample at frame.
+        """
+        if not self.can_rewind:
+            return
+        if self.snapshots and frame - self.snapshots[-1].frame < self.snapshot_interval:
+            return
+        try:
+            self.snapshots.append(AlgorithmSnapshot.take(self.algorithm, frame))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            logger.warning(f'audio lookahead: can not snapshot {type(self.algorithm).__name__} ({e}), '
+                           f'flushing will skip ahead in the carrier phase and pulse sequence')
+            self.can_rewind = False
+            self.snapshots.clear()
+            return
+        # keep the newest snapshot at or before the oldest sample that can still be rewound to
+        consumed = self.consumed_frames
+        while len(self.snapshots) > 1 and self.snapshots[1].frame <= consumed:
+            self.snapshots.popleft()
+
+    def rewind(self, frame: int, offset: float):
+        """
+        Called by the producer thread after a flush. Restore the algorithm to the state
+        it had when rendering the sample at frame.
+        """
+        while self.snapshots and self.snapshots[-1].frame > frame:
+            self.snapshots.pop()
+        if not self.snapshots:
+            return
+        snapshot = self.snapshots[-1]
+        snapshot.restore(self.algorithm)
+        position = snapshot.frame
+        while position < frame:
+            n = min(self.blocksize, frame - position)
+            steady_clock = (position + np.arange(n)) / self.samplerate
+            self.algorithm.advance(self.samplerate, steady_clock, steady_clock + offset)
+            position += n
+
+    def log_if_needed(self):
+        now = time.time()
+        if now - self._last_log_time < self.log_interval:
+            return
+        self._last_log_time = now
+        if (self.underruns, self.late_blocks) != (self._logged_underruns, self._logged_late_blocks):
+            logger.warning(f'audio lookahead: {self.underruns - self._logged_underruns} underruns, '
+                           f'{self.late_blocks - self._logged_late_blocks} late blocks '
+                           f'in the last {self.log_interval:.0f}s')
+            self._logged_underruns = self.underruns
+            self._logged_late_blocks = self.late_blocks
@@ -4,8 +4,8 @@ import numpy as np
 
 from stim_math.audio_gen.base_classes import RemoteGenerationAlgorithm
 from stim_math.audio_gen.params import SafetyParamsFOC, FOCStimParams, FourphaseFOCStimParams
-from stim_math.audio_gen.various import FourPhaseIntensity
 from stim_math.axis import AbstractMediaSync
+from stim_math.axis_bundle import AxisBundle
 from device.focstim.constants_pb2 import AxisType
 from stim_math import limits
 
@@ -16,7 +16,11 @@ class FOCStimFourphaseAlgorithm(RemoteGenerationAlgorithm):
         self.media = media
         self.params = params
         self.safety_limits = safety_limits
-        self.intensity_params = FourPhaseIntensity(params.position)
+        self.axes = AxisBundle(params, [
+            'volume.api', 'carrier_frequency', 'position.a', 'position.b', 'position.c', 'position.d',
+            'pulse_frequency', 'pulse_width', 'pulse_rise_time', 'pulse_interval_random',
+            'calibrate.a', 'calibrate.b', 'calibrate.c', 'calibrate.d', 'calibrate.center_reduction',
+        ])
 
         epsilon = 0.0001
         assert safety_limits.waveform_amplitude_amps >= (limits.WaveformAmpltiudeFOC.min - epsilon)
@@ -34,10 +38,13 @@ class FOCStimFourphaseAlgorithm(RemoteGenerationAlgorithm):
             return np.clip(p, 0, 1)
 
         t = time.time()
+        (api_volume, carrier_frequency, a, b, c, d, pulse_frequency, pulse_width, pulse_rise_time,
+         pulse_interval_random, calibration_a, calibration_b, calibration_c, calibration_d,
+         calibration_center_reduction) = self.axes.interpolate(t).item()
 
         volume = \
             np.clip(self.params.volume.master.last_value(), 0, 1) * \
-            np.clip(self.params.volume.api.interpolate(t), 0, 1) * \
+            np.clip(api_volume, 0, 1) * \
             np.clip(self.params.volume.inactivity.last_value(), 0, 1) * \
             np.clip(self.params.volume.external.last_value(), 0, 1)
 
@@ -49,12 +56,11 @@ class FOCStimFourphaseAlgorithm(RemoteGenerationAlgorithm):
                                     self.safety_limits.maximum_carrier_frequency)
         tau = self.params.tau.last_value() * 1e-6
 
-        carrier_frequency = self.params.carrier_frequency.interpolate(t)
         carrier_frequency = np.clip(carrier_frequency, minimum_frequency, maximum_frequency)
         derating = self.frequency_derating_factor(maximum_frequency, carrier_frequency, tau)
         volume *= np.clip(derating, 0, 1)
 
-        a, b, c, d = self.intensity_params.get_position(t)
+        a, b, c, d = np.clip(a, 0, 1), np.clip(b, 0, 1), np.clip(c, 0, 1), np.clip(d, 0, 1)
 
         if self.sensor_node:
             params = {'volume': volume, 'e1': a, 'e2': b, 'e3': c, 'e4': d}
@@ -76,15 +82,15 @@ class FOCStimFourphaseAlgorithm(RemoteGenerationAlgorithm):
             AxisType.AXIS_ELECTRODE_4_POWER: d,
             AxisType.AXIS_WAVEFORM_AMPLITUDE_AMPS: volume * self.safety_limits.waveform_amplitude_amps,
             AxisType.AXIS_CARRIER_FREQUENCY_HZ: carrier_frequency,
-            AxisType.AXIS_PULSE_FREQUENCY_HZ: self.params.pulse_frequency.interpolate(t),
-            AxisType.AXIS_PULSE_WIDTH_IN_CYCLES: self.params.pulse_width.interpolate(t),
-            AxisType.AXIS_PULSE_RISE_TIME_CYCLES: self.params.pulse_rise_time.interpolate(t),
-            AxisType.AXIS_PULSE_INTERVAL_RANDOM_PERCENT: self.params.pulse_interval_random.interpolate(t),
-            AxisType.AXIS_CALIBRATION_4_A: self.params.calibrate.a.interpolate(t),
-            AxisType.AXIS_CALIBRATION_4_B: self.params.calibrate.b.interpolate(t),
-            AxisType.AXIS_CALIBRATION_4_C: self.params.calibrate.c.interpolate(t),
-            AxisType.AXIS_CALIBRATION_4_D: self.params.calibrate.d.interpolate(t),
-            AxisType.AXIS_CALIBRATION_4_REDUCTION_IN_CENTER: self.params.calibrate.center_reduction.interpolate(t),
+            AxisType.AXIS_PULSE_FREQUENCY_HZ: pulse_frequency,
+            AxisType.AXIS_PULSE_WIDTH_IN_CYCLES: pulse_width,
+            AxisType.AXIS_PULSE_RISE_TIME_CYCLES: pulse_rise_time,
+            AxisType.AXIS_PULSE_INTERVAL_RANDOM_PERCENT: pulse_interval_random,
+            AxisType.AXIS_CALIBRATION_4_A: calibration_a,
+            AxisType.AXIS_CALIBRATION_4_B: calibration_b,
+            AxisType.AXIS_CALIBRATION_4_C: calibration_c,
+            AxisType.AXIS_CALIBRATION_4_D: calibration_d,
+            AxisType.AXIS_CALIBRATION_4_REDUCTION_IN_CENTER: calibration_center_reduction,
         }
 
     def frequency_derating_factor(self, max_frequency, frequency, tau):
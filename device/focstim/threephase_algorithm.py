@@ -6,6 +6,7 @@ from stim_math.audio_gen.base_classes import RemoteGenerationAlgorithm
 from stim_math.audio_gen.params import FOCStimParams, SafetyParamsFOC
 from stim_math.audio_gen.various import ThreePhasePosition
 from stim_math.axis import AbstractMediaSync
+from stim_math.axis_bundle import AxisBundle
 from device.focstim.constants_pb2 import AxisType
 from stim_math import limits
 
@@ -17,6 +18,11 @@ class FOCStimThreephaseAlgorithm(RemoteGenerationAlgorithm):
         self.params = params
         self.safety_limits = safety_limits
         self.position_params = ThreePhasePosition(params.position, params.transform)
+        self.axes = AxisBundle(params, [
+            'volume.api', 'carrier_frequency', 'position.alpha', 'position.beta',
+            'pulse_frequency', 'pulse_width', 'pulse_rise_time', 'pulse_interval_random',
+            'calibrate.center', 'calibrate.neutral', 'calibrate.right',
+        ])
 
         epsilon = 0.0001
         assert safety_limits.waveform_amplitude_amps >= (limits.WaveformAmpltiudeFOC.min - epsilon)
@@ -29,10 +35,13 @@ class FOCStimThreephaseAlgorithm(RemoteGenerationAlgorithm):
 
     def parameter_dict(self) -> dict:
         t = time.time()
+        (api_volume, carrier_frequency, alpha, beta, pulse_frequency, pulse_width, pulse_rise_time,
+         pulse_interval_random, calibration_center, calibration_neutral, calibration_right) = \
+            self.axes.interpolate(t).item()
 
         volume = \
             np.clip(self.params.volume.master.last_value(), 0, 1) * \
-            np.clip(self.params.volume.api.interpolate(t), 0, 1) * \
+            np.clip(api_volume, 0, 1) * \
             np.clip(self.params.volume.inactivity.last_value(), 0, 1) * \
             np.clip(self.params.volume.external.last_value(), 0, 1)
 
@@ -44,14 +53,10 @@ class FOCStimThreephaseAlgorithm(RemoteGenerationAlgorithm):
                                     self.safety_limits.maximum_carrier_frequency)
         tau = self.params.tau.last_value() * 1e-6
 
-        carrier_frequency = self.params.carrier_frequency.interpolate(t)
         carrier_frequency = np.clip(carrier_frequency, minimum_frequency, maximum_frequency)
         derating = self.frequency_derating_factor(maximum_frequency, carrier_frequency, tau)
         volume *= np.clip(derating, 0, 1)
 
-        alpha = self.position_params.position_params.alpha.interpolate(t)
-        beta = self.position_params.position_params.beta.interpolate(t)
-
         if self.sensor_node:
             d = {'volume': volume, 'alpha': alpha, 'beta': beta}
             self.sensor_node.process(d)
@@ -70,13 +75,13 @@ class FOCStimThreephaseAlgorithm(RemoteGenerationAlgorithm):
             AxisType.AXIS_POSITION_BETA: beta,
             AxisType.AXIS_WAVEFORM_AMPLITUDE_AMPS: volume * self.safety_limits.waveform_amplitude_amps,
             AxisType.AXIS_CARRIER_FREQUENCY_HZ: carrier_frequency,
-            AxisType.AXIS_PULSE_FREQUENCY_HZ: self.params.pulse_frequency.interpolate(t),
-            AxisType.AXIS_PULSE_WIDTH_IN_CYCLES: self.params.pulse_width.interpolate(t),
-            AxisType.AXIS_PULSE_RISE_TIME_CYCLES: self.params.pulse_rise_time.interpolate(t),
-            AxisType.AXIS_PULSE_INTERVAL_RANDOM_PERCENT: self.params.pulse_interval_random.interpolate(t),
-            AxisType.AXIS_CALIBRATION_3_CENTER: self.params.calibrate.center.interpolate(t),
-            AxisType.AXIS_CALIBRATION_3_UP: self.params.calibrate.neutral.interpolate(t),
-            AxisType.AXIS_CALIBRATION_3_LEFT: self.params.calibrate.right.interpolate(t),
+            AxisType.AXIS_PULSE_FREQUENCY_HZ: pulse_frequency,
+            AxisType.AXIS_PULSE_WIDTH_IN_CYCLES: pulse_width,
+            AxisType.AXIS_PULSE_RISE_TIME_CYCLES: pulse_rise_time,
+            AxisType.AXIS_PULSE_INTERVAL_RANDOM_PERCENT: pulse_interval_random,
+            AxisType.AXIS_CALIBRATION_3_CENTER: calibration_center,
+            AxisType.AXIS_CALIBRATION_3_UP: calibration_neutral,
+            AxisType.AXIS_CALIBRATION_3_LEFT: calibration_right,
         }
 
     def frequency_derating_factor(self, max_frequency, frequency, tau):
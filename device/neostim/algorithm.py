@@ -5,7 +5,6 @@ from PySide6.QtCore import QObject, QTimer
 
 import numpy as np
 
-import stim_math
 from device.neostim.neostim_device import NeoStimPTGenerator, AttributeId, Encoding, RestimPulseParameters
 from device.neostim.neostim_device import NeoStim
 
@@ -13,7 +12,7 @@ import device.neostim.threephase
 from device.neostim import limits
 
 from stim_math.audio_gen.params import NeoStimParams, NeoStimDebugParams
-from stim_math.audio_gen.various import ThreePhasePosition
+from stim_math.audio_gen.various import ThreePhasePosition, ThreePhaseCalibration
 from stim_math.axis import AbstractMediaSync
 
 
@@ -23,6 +22,7 @@ class NeoStimAlgorithm(QObject, NeoStimPTGenerator):
         self.media = media
         self.params = params
         self.position_params = ThreePhasePosition(params.position, params.transform)
+        self.calibration = ThreePhaseCalibration(params.calibrate)
 
         self.params = params
         self.device: NeoStim = None
@@ -74,12 +74,8 @@ class NeoStimAlgorithm(QObject, NeoStimPTGenerator):
             volume *= 0
 
         alpha, beta = self.position_params.get_position(t)
-        calibration_neutral = self.params.calibrate.neutral.last_value()
-        calibration_right = self.params.calibrate.right.last_value()
-        calibration_center = self.params.calibrate.center.last_value()
-
-        center_calib = stim_math.threephase.ThreePhaseCenterCalibration(calibration_center)
-        volume *= center_calib.get_scale(alpha, beta)
+        self.calibration.update()
+        volume *= self.calibration.get_center_scale(alpha, beta)
 
         pulse_freq = self.params.pulse_frequency.interpolate(t)
         pulse_freq = np.clip(pulse_freq, limits.PulseFrequency.min, limits.PulseFrequency.max)
@@ -95,7 +91,7 @@ class NeoStimAlgorithm(QObject, NeoStimPTGenerator):
         self.pulse_planner.set_debug_options(debug)
         a_strength, b_strength, ab_strength, ac_strength, bc_strength = self.pulse_planner.compute_bounds(
             alpha, beta, volume,
-            calibration_neutral, calibration_right, calibration_center
+            self.calibration,
         )
 
         params = RestimPulseParameters(
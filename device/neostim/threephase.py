@@ -3,7 +3,7 @@ import numpy as np
 from stim_math import threephase
 from stim_math.audio_gen.params import NeoStimDebugParams
 from stim_math.transforms import n_vec, l_vec, r_vec
-from stim_math.threephase import ThreePhaseCenterCalibration
+from stim_math.audio_gen.various import ThreePhaseCalibration
 from dataclasses import dataclass
 
 
@@ -17,15 +17,22 @@ def get_bounds(position_alpha, position_beta, calibration_neutral, calibration_l
     :param calibration_left:
     :return: (a, b, c) in 0...1
     """
+    hw = threephase.ThreePhaseHardwareCalibration(calibration_neutral, calibration_left)
+    # TODO: something with scaling constant?
+    calib = hw.generate_transform_in_ab()
+    return get_bounds_from_transform(position_alpha, position_beta, calib)
+
+
+def get_bounds_from_transform(position_alpha, position_beta, calib):
+    """
+    Like get_bounds(), but with the hardware calibration already converted to a transform in ab.
+    """
     r = np.linalg.norm((position_alpha, position_beta))
     a = position_alpha / max(1, r)
     b = position_beta / max(1, r)
     r = min(1, r)
     mat = np.array([[2 - r + a, b],
                     [b, 2 - r - a]]) * 0.5
-    hw = threephase.ThreePhaseHardwareCalibration(calibration_neutral, calibration_left)
-    # TODO: something with scaling constant?
-    calib = hw.generate_transform_in_ab()
     # TODO: quite inefficient. Exact solution must exist?
     theta = np.linspace(0, np.pi * 2, 100)
     carrier = np.array([np.cos(theta), np.sin(theta)])
@@ -89,15 +96,19 @@ class ThreePhasePlanner:
     def __init__(self):
         self.seq = 0
         self.debug: NeoStimDebugParams = None
+        self.bounds = None
+        self.bounds_calibration_version = None
 
     def set_debug_options(self, debug: NeoStimDebugParams):
         self.debug = debug
 
-    def compute_bounds(self, position_alpha, position_beta, volume,
-                       calibration_neutral, calibration_left, calibration_center):
-        # compute bounds (calibration)
-        bound_neutral, bound_left, bound_right = get_bounds(0, 0, calibration_neutral, calibration_left)
-        s = ThreePhaseCenterCalibration(calibration_center).get_scale(position_alpha, position_alpha)
+    def compute_bounds(self, position_alpha, position_beta, volume, calibration: ThreePhaseCalibration):
+        # compute bounds (calibration), only depends on the calibration so recompute when it changes
+        if self.bounds_calibration_version != calibration.version:
+            self.bounds = get_bounds_from_transform(0, 0, calibration.transform_in_ab)
+            self.bounds_calibration_version = calibration.version
+        bound_neutral, bound_left, bound_right = self.bounds
+        s = calibration.get_center_scale(position_alpha, position_alpha)
         bound_neutral *= s * volume
         bound_left *= s * volume
         bound_right *= s * volume
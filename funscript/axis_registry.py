@@ -0,0 +1,63 @@
+import logging
+import threading
+import weakref
+
+import numpy as np
+
+from funscript.funscript import Funscript
+from stim_math.axis import AbstractTimestampMapper, WriteProtectedAxis, create_precomputed_axis
+
+logger = logging.getLogger('restim.axis_registry')
+
+
+class AxisRegistry:
+    """
+    Funscripts scaled to the limits of an axis, shared between all axes created from the same
+    funscript content and limits. Restarting, switching devices or reloading settings creates
+    new algorithms, these reuse the arrays of the axes that are still alive, like the ones
+    of the visualization.
+
+    The arrays are read-only. The values are float32, the timestamps are the float64 timestamps
+    of the funscript: float32 can not represent milliseconds after about 2 hours.
+
+    The registry only keeps weak references, an array is freed when the last axis using it is.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timestamps = weakref.WeakValueDictionary()   # hash -> x
+        self._values = weakref.WeakValueDictionary()       # (hash, limit_min, limit_max) -> y
+
+    def get(self, funscript: Funscript, limit_min: float, limit_max: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: (x, y), y = clip(funscript.y, 0, 1) scaled to [limit_min, limit_max]
+        """
+        content_hash = funscript.content_hash()
+        key = (content_hash, float(limit_min), float(limit_max))
+        with self._lock:
+            x = self._timestamps.get(content_hash)
+            if x is None:
+                x = funscript.x.view()
+                x.flags.writeable = False
+                self._timestamps[content_hash] = x
+
+            y = self._values.get(key)
+            if y is None:
+                logger.debug(f'scaling funscript {content_hash} to [{limit_min}, {limit_max}]')
+                y = (np.clip(funscript.y, 0, 1) * (limit_max - limit_min) + limit_min).astype(np.float32)
+                y.flags.writeable = False
+                self._values[key] = y
+        return x, y
+
+    def create_axis(self, funscript: Funscript, limit_min: float, limit_max: float,
+                    timestamp_mapper: AbstractTimestampMapper) -> WriteProtectedAxis:
+        x, y = self.get(funscript, limit_min, limit_max)
+        return create_precomputed_axis(x, y, timestamp_mapper)
+
+    def __len__(self):
+        """
+        number of scaled funscripts in use
+        """
+        return len(self._values)
+
+
+axis_registry = AxisRegistry()
@@ -30,6 +30,18 @@ class Funscript:
     def __init__(self, x, y):
         self.x = np.array(x)
         self.y = np.array(y)
+        self.sha1 = None    # hash of the file, if loaded from a file
+
+    def content_hash(self) -> str:
+        """
+        sha1 of the file, or of the actions if the funscript was not loaded from a file.
+        """
+        if self.sha1 is not None:
+            return self.sha1
+        sha1 = hashlib.sha1()
+        sha1.update(np.ascontiguousarray(self.x, dtype=np.float64).tobytes())
+        sha1.update(np.ascontiguousarray(self.y, dtype=np.float64).tobytes())
+        return sha1.hexdigest()
 
     @staticmethod
     def from_file(filename_or_path):
@@ -58,6 +70,7 @@ class Funscript:
         end = time.time()
         logger.info(f'imported {path} in {end-start} seconds')
         funscript = Funscript(x, y)
+        funscript.sha1 = hash
         funscript_cache[hash] = funscript
         return funscript
 
@@ -1,5 +1,4 @@
 from __future__ import annotations  # multiple return values
-import numpy as np
 
 from device.focstim.fourphase_algorithm import FOCStimFourphaseAlgorithm
 from device.neostim.algorithm import NeoStimAlgorithm
@@ -10,10 +9,12 @@ from stim_math.audio_gen.pulse_based import DefaultThreePhasePulseBasedAlgorithm
 from stim_math.audio_gen.continuous import ThreePhaseAlgorithm
 from stim_math.audio_gen.params import *
 
+from funscript.axis_registry import axis_registry
 from qt_ui.models.funscript_kit import FunscriptKitModel
 from qt_ui.models.script_mapping import ScriptMappingModel
 from qt_ui.device_wizard.axes import AxisEnum
 from stim_math.axis import create_precomputed_axis, AbstractTimestampMapper, create_constant_axis, AbstractMediaSync
+import qt_ui.settings
 
 
 class AlgorithmFactory:
@@ -76,7 +77,8 @@ class AlgorithmFactory:
             safety_limits=SafetyParams(
                 device.min_frequency,
                 device.max_frequency,
-            )
+            ),
+            control_rate=qt_ui.settings.audio_control_rate.get(),
         )
         return algorithm
 
@@ -421,10 +423,6 @@ class AlgorithmFactory:
         funscript_item = self.script_mapping.get_config_for_axis(axis)
         if funscript_item:
             limit_min, limit_max = self.kit.limits_for_axis(axis)
-            # TODO: not very memory efficient if multiple algorithms reference the same script.
-            # but worst-case it only wastes a few MB or so...
-            return create_precomputed_axis(funscript_item.script.x,
-                                           np.clip(funscript_item.script.y, 0, 1) * (limit_max - limit_min) + limit_min,
-                                           self.timestamp_mapper)
+            return axis_registry.create_axis(funscript_item.script, limit_min, limit_max, self.timestamp_mapper)
         else:
             return None
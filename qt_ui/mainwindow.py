@@ -8,7 +8,8 @@ from PySide6.QtCore import QTimer
 from PySide6.QtGui import QIcon
 from PySide6.QtHttpServer import QHttpServerRequest
 from PySide6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QSizePolicy, QFrame, QStyleFactory, QVBoxLayout, QHBoxLayout, QLCDNumber
+    QApplication, QMainWindow, QWidget, QSizePolicy, QFrame, QStyleFactory, QVBoxLayout, QHBoxLayout, QLCDNumber,
+    QLabel
 )
 import logging
 
@@ -87,9 +88,16 @@ class Window(QMainWindow, Ui_MainWindow):
         self.device_volume_display.display(0)
         self.last_device_volume = None
 
+        self.audio_stats_label = QLabel(self)
+        self.audio_stats_label.setToolTip("Audio output dropouts")
+        self.audio_stats_timer = QTimer(self)
+        self.audio_stats_timer.timeout.connect(self.refresh_audio_stats)
+        self.audio_stats_timer.start(1000)
+
         self.frame = QWidget()
         frame_layout = QVBoxLayout(self.toolBar)
         frame_layout.addWidget(spacer)
+        frame_layout.addWidget(self.audio_stats_label)
         frame_layout.addWidget(self.device_volume_display)
         frame_layout.addWidget(self.battery_bar)
         self.frame.setLayout(frame_layout)
@@ -420,13 +428,14 @@ class Window(QMainWindow, Ui_MainWindow):
 
         visible = {self.tab_threephase, self.tab_volume, self.tab_vibrate, self.tab_details}
 
-        all_widgets = {self.device_volume_display, self.battery_bar, self.foc_device_stats}
+        all_widgets = {self.device_volume_display, self.battery_bar, self.foc_device_stats, self.audio_stats_label}
         visible_widgets = set()
 
         config = DeviceConfiguration.from_settings()
 
         # determine tab visibility
         if config.device_type == DeviceType.AUDIO_THREE_PHASE:
+            visible_widgets |= {self.audio_stats_label}
             if config.waveform_type == WaveformType.CONTINUOUS:
                 visible |= {self.tab_carrier}
             if config.waveform_type == WaveformType.PULSE_BASED:
@@ -524,10 +533,11 @@ class Window(QMainWindow, Ui_MainWindow):
                 latency = float(latency)
             except ValueError:
                 pass
+            lookahead_ms = qt_ui.settings.audio_lookahead_ms.get()
 
             output_device = AudioStimDevice(None)
             mapping_parameters = output_device.auto_detect_channel_mapping_parameters(algorithm)
-            output_device.start(api_name, output_device_name, latency, algorithm, mapping_parameters)
+            output_device.start(api_name, output_device_name, latency, algorithm, mapping_parameters, lookahead_ms)
             if output_device.is_connected_and_running():
                 self.output_device = output_device
                 self.playstate = PlayState.PLAYING
@@ -587,6 +597,16 @@ class Window(QMainWindow, Ui_MainWindow):
         self.tab_volume.set_play_state(self.playstate)
         self.refresh_play_button_icon()
 
+    def refresh_audio_stats(self):
+        if not isinstance(self.output_device, AudioStimDevice):
+            self.audio_stats_label.setText("")
+            return
+        stats = self.output_device.stats()
+        text = f"xrun: {stats.output_underflows}"
+        if stats.lookahead is not None:
+            text += f"\nunderrun: {stats.lookahead.underruns}\nlate: {stats.lookahead.late_blocks}"
+        self.audio_stats_label.setText(text)
+
     def autostart_timeout(self):
         print('autostart timeout')
         if self.playstate == PlayState.WAITING_ON_LOAD:
@@ -158,6 +158,7 @@ class PreferencesDialog(QDialog, Ui_PreferencesDialog):
         self.repopulate_audio_devices()
 
         self.audio_latency.setCurrentText(qt_ui.settings.audio_latency.get())
+        self.audio_lookahead_ms.setValue(qt_ui.settings.audio_lookahead_ms.get())
 
         # focstim settings
         self.repopulate_serial_devices()
@@ -327,6 +328,7 @@ class PreferencesDialog(QDialog, Ui_PreferencesDialog):
         qt_ui.settings.audio_api.set(self.audio_api.currentText())
         qt_ui.settings.audio_output_device.set(self.audio_output_device.currentText())
         qt_ui.settings.audio_latency.set(self.audio_latency.currentText())
+        qt_ui.settings.audio_lookahead_ms.set(self.audio_lookahead_ms.value())
 
         # focstim
         qt_ui.settings.focstim_serial_port.set(str(self.focstim_port.currentData()))
@@ -293,15 +293,27 @@ class Ui_PreferencesDialog(object):
 
         self.formLayout_3.setWidget(2, QFormLayout.ItemRole.FieldRole, self.audio_latency)
 
+        self.label_36 = QLabel(self.groupBox)
+        self.label_36.setObjectName(u"label_36")
+
+        self.formLayout_3.setWidget(3, QFormLayout.ItemRole.LabelRole, self.label_36)
+
+        self.audio_lookahead_ms = QSpinBox(self.groupBox)
+        self.audio_lookahead_ms.setObjectName(u"audio_lookahead_ms")
+        self.audio_lookahead_ms.setMaximum(1000)
+        self.audio_lookahead_ms.setSingleStep(10)
+
+        self.formLayout_3.setWidget(3, QFormLayout.ItemRole.FieldRole, self.audio_lookahead_ms)
+
         self.label_27 = QLabel(self.groupBox)
         self.label_27.setObjectName(u"label_27")
 
-        self.formLayout_3.setWidget(3, QFormLayout.ItemRole.LabelRole, self.label_27)
+        self.formLayout_3.setWidget(4, QFormLayout.ItemRole.LabelRole, self.label_27)
 
         self.audio_info = QLabel(self.groupBox)
         self.audio_info.setObjectName(u"audio_info")
 
-        self.formLayout_3.setWidget(3, QFormLayout.ItemRole.FieldRole, self.audio_info)
+        self.formLayout_3.setWidget(4, QFormLayout.ItemRole.FieldRole, self.audio_info)
 
 
         self.verticalLayout_3.addWidget(self.groupBox)
@@ -751,7 +763,8 @@ class Ui_PreferencesDialog(object):
         QWidget.setTabOrder(self.gb_buttplug_wsdm, self.buttplug_wsdm_address)
         QWidget.setTabOrder(self.buttplug_wsdm_address, self.buttplug_wsdm_auto_expand)
         QWidget.setTabOrder(self.buttplug_wsdm_auto_expand, self.audio_latency)
-        QWidget.setTabOrder(self.audio_latency, self.tabWidget)
+        QWidget.setTabOrder(self.audio_latency, self.audio_lookahead_ms)
+        QWidget.setTabOrder(self.audio_lookahead_ms, self.tabWidget)
         QWidget.setTabOrder(self.tabWidget, self.gb_udp_server)
         QWidget.setTabOrder(self.gb_udp_server, self.audio_api)
         QWidget.setTabOrder(self.audio_api, self.display_latency_ms)
@@ -839,6 +852,12 @@ class Ui_PreferencesDialog(object):
         self.audio_latency.setItemText(11, QCoreApplication.translate("PreferencesDialog", u"0.18", None))
         self.audio_latency.setItemText(12, QCoreApplication.translate("PreferencesDialog", u"0.20", None))
 
+        self.label_36.setText(QCoreApplication.translate("PreferencesDialog", u"Lookahead", None))
+#if QT_CONFIG(tooltip)
+        self.audio_lookahead_ms.setToolTip(QCoreApplication.translate("PreferencesDialog", u"Render audio ahead of time on a separate thread. Prevents dropouts at the cost of extra latency.", None))
+#endif // QT_CONFIG(tooltip)
+        self.audio_lookahead_ms.setSpecialValueText(QCoreApplication.translate("PreferencesDialog", u"off", None))
+        self.audio_lookahead_ms.setSuffix(QCoreApplication.translate("PreferencesDialog", u" ms", None))
         self.label_27.setText(QCoreApplication.translate("PreferencesDialog", u"Info", None))
         self.audio_info.setText(QCoreApplication.translate("PreferencesDialog", u"TextLabel", None))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab_audio), QCoreApplication.translate("PreferencesDialog", u"Audio", None))
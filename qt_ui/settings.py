@@ -2,9 +2,24 @@ from PySide6.QtCore import QSettings
 import os
 
 
+# restim.ini in the working directory, unless overridden with set_settings_path()
+settings_path = None
+
+
+def set_settings_path(path):
+    """
+    Read and write settings from another ini file. Call before any setting is read,
+    values already read are cached.
+    """
+    global settings_path
+    settings_path = path
+
+
 def get_settings_instance():
-    cwd = os.getcwd()
-    path = os.path.join(cwd, 'restim.ini')
+    path = settings_path
+    if path is None:
+        cwd = os.getcwd()
+        path = os.path.join(cwd, 'restim.ini')
     return QSettings(path, QSettings.IniFormat)
 
 
@@ -122,6 +137,8 @@ media_sync_time_offset_ms = Setting('media_sync/time_offset_ms', 0, int)
 audio_api = Setting("audio/api-name", "", str)
 audio_output_device = Setting("audio/device-name", "", str)
 audio_latency = Setting("audio/latency", 'high', str)
+audio_lookahead_ms = Setting("audio/lookahead_ms", 0, int)
+audio_control_rate = Setting("audio/control_rate", 0, int)
 
 additional_search_paths = Setting('additional_search_paths', [], list)
 
@@ -1,11 +1,12 @@
 from __future__ import unicode_literals
 import numpy as np
 
-from stim_math import threephase, trig
-from stim_math.audio_gen.params import ThreephaseCalibrationParams, ThreephasePositionTransformParams
-from stim_math.axis import AbstractAxis
-from stim_math.threephase_coordinate_transform import ThreePhaseCoordinateTransform, \
-    ThreePhaseCoordinateTransformMapToEdge
+from stim_math import threephase
+from stim_math.audio_gen.params import ThreephaseCalibrationParams, ThreephasePositionTransformParams, \
+    ThreephasePositionParams
+from stim_math.audio_gen.various import ThreePhasePosition
+from stim_math.axis import AbstractAxis, latest_version
+from stim_math.axis_bundle import axis_fields
 
 from PySide6 import QtCore, QtWidgets
 
@@ -24,11 +25,14 @@ class WaveformDetailsWidget(QtWidgets.QWidget, Ui_WaveformDetails):
         self.beta = None
         self.calibrate = None
         self.transform = None
+        self.position = None
 
         self.timer = QtCore.QTimer(self)
         self.timer.timeout.connect(self.refresh)
         self.timer.start(int(1000 / 10.0))
 
+        self.axes = []
+        self.last_version = None
         self.last_params = (None, None)
 
     def set_axis(self, alpha_axis: AbstractAxis, beta_axis: AbstractAxis,
@@ -38,6 +42,9 @@ class WaveformDetailsWidget(QtWidgets.QWidget, Ui_WaveformDetails):
         self.beta = beta_axis
         self.calibrate = calibrate
         self.transform = transform
+        self.position = ThreePhasePosition(ThreephasePositionParams(alpha_axis, beta_axis), transform)
+        self.axes = [alpha_axis, beta_axis] + [axis for _, axis in axis_fields(transform)]
+        self.last_version = None
 
     def refresh(self):
         if self.alpha is None:
@@ -49,32 +56,13 @@ class WaveformDetailsWidget(QtWidgets.QWidget, Ui_WaveformDetails):
             self.timer.setInterval(1000 // 5)
             return
 
-        alpha = self.alpha.last_value()
-        beta = self.beta.last_value()
-
-        if self.transform.transform_enabled.last_value():
-            transform = ThreePhaseCoordinateTransform(
-                self.transform.transform_rotation_degrees.last_value(),
-                self.transform.transform_mirror.last_value(),
-                self.transform.transform_top_limit.last_value(),
-                self.transform.transform_bottom_limit.last_value(),
-                self.transform.transform_left_limit.last_value(),
-                self.transform.transform_right_limit.last_value(),
-            )
-            [alpha], [beta] = transform.transform([alpha], [beta])
-            norm = np.clip(trig.norm(alpha, beta), 1.0, None)
-            alpha /= norm
-            beta /= norm
-        if self.transform.map_to_edge_enabled.last_value():
-            transform = ThreePhaseCoordinateTransformMapToEdge(
-                self.transform.map_to_edge_start.last_value(),
-                self.transform.map_to_edge_length.last_value(),
-                self.transform.map_to_edge_invert.last_value(),
-            )
-            alpha, beta = transform.transform(alpha, beta)
-            norm = np.clip(trig.norm(alpha, beta), 1.0, None)
-            alpha /= norm
-            beta /= norm
+        # the labels only depend on the last value of the axes
+        version = latest_version(self.axes)
+        if version == self.last_version:
+            return
+        self.last_version = version
+
+        alpha, beta = self.position.transform_position(self.alpha.last_value(), self.beta.last_value())
 
         if self.last_params == (alpha, beta):
             return
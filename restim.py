@@ -1,4 +1,7 @@
 if __name__ == '__main__':
+    import multiprocessing
     import sys
+    # bake worker processes in frozen builds
+    multiprocessing.freeze_support()
     from qt_ui import mainwindow
     sys.exit(mainwindow.run())
@@ -0,0 +1,235 @@
+"""
+Bake audio from the command line, without a display.
+
+usage: python restim_bake.py video.mp4 [-o video.wav] [--config restim.ini] [--waveform pulse]
+       python restim_bake.py video.mp4 -o video.mp3@44100 -o video.flac@48000
+       python restim_bake.py library/ [more/ ...] [--jobs 4] [--manifest manifest.json]
+
+Funscripts are detected and linked to axes the same way as in the media tab,
+all other parameters are read from restim.ini.
+
+Given directories or several files, every media file with funscripts is baked next to the media.
+Files whose funscripts and settings did not change since the last run are skipped.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+
+class ProgressPrinter:
+    def __init__(self, samplerate: int, duration_in_samples: int, interval: float = 0.5):
+        self.samplerate = samplerate
+        self.duration_in_samples = duration_in_samples
+        self.interval = interval
+        self.start_time = time.time()
+        self.last_print_time = 0
+        self.end = '\r' if sys.stdout.isatty() else '\n'
+
+    def __call__(self, samples: int):
+        now = time.time()
+        if now - self.last_print_time < self.interval and samples < self.duration_in_samples:
+            return
+        self.last_print_time = now
+        elapsed = now - self.start_time
+        print(f'{samples / self.samplerate:8.1f}/{self.duration_in_samples / self.samplerate:.1f} s '
+              f'({samples / self.duration_in_samples:4.0%}), {samples / self.samplerate / max(elapsed, 1e-9):.0f}x realtime',
+              end=self.end, flush=True)
+
+    def finish(self):
+        if self.end == '\r':
+            print()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Bake restim audio from a media file or funscript.')
+    parser.add_argument('input', nargs='+',
+                        help='media file or funscript. Funscripts next to it are linked automatically. '
+                             'Directories are searched for media files to bake in batch.')
+    parser.add_argument('-o', '--output', action='append',
+                        help='output audio file, the format follows the extension. Default: <input>.wav. '
+                             'Repeat to write several files in one pass, file@rate sets the samplerate of a file')
+    parser.add_argument('-f', '--format', default='wav', help='output format in batch mode (wav, flac, ogg, mp3)')
+    parser.add_argument('-c', '--config', help='settings file to use instead of restim.ini in the working directory')
+    parser.add_argument('-w', '--waveform', choices=['continuous', 'pulse'],
+                        help='waveform type, overrides the device configuration')
+    parser.add_argument('-r', '--samplerate', type=int, default=44100, help='default samplerate of the outputs')
+    parser.add_argument('-d', '--duration', type=float,
+                        help='in seconds. Default: until the last action of the funscripts')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='number of processes: one fast-forwards the waveform state, the others render. '
+                             'Default: number of cpus. 1 to bake in this process')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only regenerate the parts of an existing output whose funscripts changed. '
+                             'Keeps an index next to the output. Lossy formats (ogg, mp3) are always baked completely')
+    parser.add_argument('--jobs', type=int, help='batch mode: number of files baked in parallel. Default: number of cpus')
+    parser.add_argument('--manifest', default='restim_bake_manifest.json',
+                        help='batch mode: record of baked files, used to skip files that are up to date')
+    parser.add_argument('--force', action='store_true', help='batch mode: bake files even if they are up to date')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(levelname)s %(name)s: %(message)s')
+
+    from qt_ui import settings
+    if args.config:
+        if not os.path.isfile(args.config):
+            parser.error(f'config file not found: {args.config}')
+        settings.set_settings_path(os.path.abspath(args.config))
+
+    if len(args.input) > 1 or os.path.isdir(args.input[0]):
+        if args.output or args.duration is not None:
+            parser.error('--output and --duration can not be used in batch mode')
+        return main_batch(args)
+    args.input = args.input[0]
+
+    from bake.engine import BakeTimestampMapper, bake, bake_parallel, open_output_file
+    from bake.headless import bake_file_incremental, create_bake_algorithm, default_output_filename, \
+        detect_funscripts, funscript_duration, load_device_configuration
+    from qt_ui.models.funscript_kit import FunscriptKitModel
+
+    if not os.path.exists(args.input):
+        parser.error(f'file not found: {args.input}')
+
+    device = load_device_configuration(args.waveform)
+
+    kit = FunscriptKitModel.load_from_settings()
+    script_mapping = detect_funscripts(args.input, kit)
+    for item in script_mapping.funscript_conifg():
+        print(f'{item.file_name}: {item.data(1)}')
+
+    duration = args.duration if args.duration is not None else funscript_duration(script_mapping)
+    if duration <= 0:
+        parser.error('no funscripts found, specify --duration')
+
+    try:
+        targets = [parse_output_target(output, args.samplerate)
+                   for output in args.output or [default_output_filename(args.input)]]
+    except ValueError as e:
+        parser.error(str(e))
+    if len(targets) > 1:
+        if args.incremental:
+            parser.error('--incremental can not be used with several outputs')
+        return main_multi(args, device, kit, script_mapping, duration, targets)
+
+    output = targets[0].filename
+    if args.incremental:
+        print(f'baking {duration:.1f} seconds of {device.waveform_type.name.lower()} audio to {output}, '
+              f'regenerating only what changed')
+        try:
+            result = bake_file_incremental(args.input, output, targets[0].samplerate, args.waveform, duration)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f'done: {result.summary()}')
+        return 0
+
+    epoch = time.time() + 100
+    mapper = BakeTimestampMapper(epoch)
+    try:
+        algorithm = create_bake_algorithm(device, kit, script_mapping, mapper, mapper)
+    except ValueError as e:
+        parser.error(str(e))
+
+    samplerate = targets[0].samplerate
+    duration_in_samples = int(samplerate * duration)
+    print(f'baking {duration:.1f} seconds of {device.waveform_type.name.lower()} audio to {output}')
+
+    try:
+        file = open_output_file(output, samplerate, algorithm.channel_count())
+    except (TypeError, ValueError, RuntimeError) as e:
+        print(f'could not open output file: {e}', file=sys.stderr)
+        return 1
+
+    progress = ProgressPrinter(samplerate, duration_in_samples)
+    try:
+        if args.workers == 1:
+            result = bake(algorithm, file, samplerate, duration_in_samples, epoch, progress=progress)
+        else:
+            result = bake_parallel(algorithm, file, samplerate, duration_in_samples, epoch,
+                                   workers=args.workers - 1 if args.workers else None, progress=progress)
+    except KeyboardInterrupt:
+        progress.finish()
+        print('interrupted', file=sys.stderr)
+        return 130
+    finally:
+        file.close()
+
+    progress.finish()
+    print(f'done: {result.summary()}')
+    return 0
+
+
+def parse_output_target(text: str, default_samplerate: int):
+    """
+    video.flac@48000 -> OutputTarget('video.flac', 48000)
+    """
+    from bake.engine import OutputTarget
+
+    filename, sep, rate = text.rpartition('@')
+    if not sep or not rate.isdigit():
+        return OutputTarget(text, default_samplerate)
+    if int(rate) <= 0:
+        raise ValueError(f'invalid samplerate: {text}')
+    return OutputTarget(filename, int(rate))
+
+
+def main_multi(args, device, kit, script_mapping, duration: float, targets) -> int:
+    """
+    Synthesize once, at the highest samplerate, and write every target.
+    """
+    from bake.engine import BakeTimestampMapper, bake_multi
+    from bake.headless import create_bake_algorithm
+
+    epoch = time.time() + 100
+    mapper = BakeTimestampMapper(epoch)
+    try:
+        algorithm = create_bake_algorithm(device, kit, script_mapping, mapper, mapper)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    samplerate = max(target.samplerate for target in targets)
+    print(f'baking {duration:.1f} seconds of {device.waveform_type.name.lower()} audio to '
+          f'{", ".join(f"{target.filename} ({target.samplerate} Hz)" for target in targets)}')
+
+    progress = ProgressPrinter(samplerate, int(samplerate * duration))
+    try:
+        results = bake_multi(algorithm, targets, duration, epoch, progress=progress)
+    except KeyboardInterrupt:
+        progress.finish()
+        print('interrupted', file=sys.stderr)
+        return 130
+    except (TypeError, ValueError, RuntimeError) as e:
+        progress.finish()
+        print(f'could not write output file: {e}', file=sys.stderr)
+        return 1
+
+    progress.finish()
+    for target, result in zip(targets, results):
+        print(f'{target.filename}: {result.summary()}')
+    return 0
+
+
+def main_batch(args) -> int:
+    from bake.batch import run_batch
+
+    for path in args.input:
+        if not os.path.exists(path):
+            print(f'file not found: {path}', file=sys.stderr)
+            return 2
+
+    summary = run_batch(args.input, os.path.abspath(args.manifest), concurrency=args.jobs,
+                        samplerate=args.samplerate, waveform=args.waveform, extension='.' + args.format.lstrip('.'),
+                        config_path=os.path.abspath(args.config) if args.config else None, force=args.force,
+                        incremental=args.incremental,
+                        report=lambda line: print(line, flush=True))
+    print(f'done: {summary.summary()}')
+    return 1 if summary.failed else 0
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
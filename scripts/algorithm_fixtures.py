@@ -0,0 +1,213 @@
+"""
+Deterministic algorithms driven by synthetic funscripts, for the benchmark and regression scripts.
+
+Axes that are usually controlled by funscripts (position, volume, carrier and pulse parameters)
+are precomputed axes with pseudo-random actions, everything else is constant.
+The timestamp mapper loops the funscripts, so any timestamp maps to valid media time.
+"""
+import numpy as np
+
+from stim_math.audio_gen.params import ThreephasePositionParams, ThreephasePositionTransformParams, \
+    ThreephaseCalibrationParams, VibrationParams, VolumeParams, SafetyParams, SafetyParamsFOC, \
+    ThreephaseContinuousAlgorithmParams, ThreephasePulsebasedAlgorithmParams, ThreephaseABTestAlgorithmParams, \
+    FOCStimParams, FourphaseFOCStimParams, FourphaseIntensityParams, FourphaseCalibrationParams
+from stim_math.axis import AbstractTimestampMapper, DummyMediaSync, create_constant_axis, create_precomputed_axis
+
+# timestamp of the first sample
+EPOCH = 1000.0
+
+# length of the synthetic funscripts, in seconds
+DURATION = 600.0
+
+
+class LoopingTimestampMapper(AbstractTimestampMapper):
+    def __init__(self, epoch: float = EPOCH, duration: float = DURATION):
+        self.epoch = epoch
+        self.duration = duration
+
+    def map_timestamp(self, timestamp):
+        return (timestamp - self.epoch) % self.duration
+
+
+def synthetic_funscript(seed: int, duration: float = DURATION, interval: float = 0.2) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Random actions with a jittered interval, like a hand-made funscript.
+    :return: (x, y), x in seconds, y in [0, 1]
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration / interval) + 1
+    x = np.cumsum(rng.uniform(0.5, 1.5, n) * interval)
+    x = np.concatenate(([0.0], x[x < duration], [duration]))
+    y = rng.uniform(0, 1, len(x))
+    return x, y
+
+
+class FixtureAxes:
+    """
+    Creates the axes for one algorithm. Every funscript axis gets its own seed, derived from the
+    fixture seed and the order in which the axes are created.
+    """
+    def __init__(self, seed: int = 0):
+        self.seed = seed
+        self.count = 0
+        self.timestamp_mapper = LoopingTimestampMapper()
+
+    def funscript(self, limit_min: float, limit_max: float):
+        self.count += 1
+        x, y = synthetic_funscript(self.seed * 1000 + self.count)
+        return create_precomputed_axis(x, y * (limit_max - limit_min) + limit_min, self.timestamp_mapper)
+
+    @staticmethod
+    def constant(value):
+        return create_constant_axis(value)
+
+    def position(self):
+        return ThreephasePositionParams(self.funscript(-1, 1), self.funscript(-1, 1))
+
+    def transform(self):
+        c = self.constant
+        return ThreephasePositionTransformParams(
+            c(True), c(15.0), c(False), c(1.0), c(-0.9), c(-1.0), c(0.9),
+            c(False), c(0.0), c(200.0), c(False))
+
+    def calibrate(self):
+        c = self.constant
+        return ThreephaseCalibrationParams(c(1.5), c(-0.7), c(-0.6))
+
+    def vibration(self, frequency: float, strength: float):
+        c = self.constant
+        return VibrationParams(c(True), c(frequency), c(strength), c(0.2), c(-0.1), c(0.1))
+
+    def volume(self):
+        c = self.constant
+        return VolumeParams(self.funscript(0.5, 1.0), c(1.0), c(1.0), c(1.0))
+
+
+def create_continuous(seed: int = 0):
+    from stim_math.audio_gen.continuous import ThreePhaseAlgorithm
+    axes = FixtureAxes(seed)
+    return ThreePhaseAlgorithm(
+        DummyMediaSync(),
+        ThreephaseContinuousAlgorithmParams(
+            position=axes.position(),
+            transform=axes.transform(),
+            calibrate=axes.calibrate(),
+            vibration_1=axes.vibration(10.0, 0.3),
+            vibration_2=axes.vibration(1.5, 0.2),
+            volume=axes.volume(),
+            carrier_frequency=axes.funscript(500, 1000),
+        ),
+        SafetyParams(500, 1000),
+    )
+
+
+def create_pulse_based(seed: int = 0):
+    from stim_math.audio_gen.pulse_based import DefaultThreePhasePulseBasedAlgorithm
+    axes = FixtureAxes(seed)
+    return DefaultThreePhasePulseBasedAlgorithm(
+        DummyMediaSync(),
+        ThreephasePulsebasedAlgorithmParams(
+            position=axes.position(),
+            transform=axes.transform(),
+            calibrate=axes.calibrate(),
+            vibration_1=axes.vibration(10.0, 0.3),
+            vibration_2=axes.vibration(1.5, 0.2),
+            volume=axes.volume(),
+            carrier_frequency=axes.funscript(500, 1000),
+            pulse_frequency=axes.funscript(20, 150),
+            pulse_width=axes.funscript(4, 10),
+            pulse_interval_random=axes.constant(0.1),
+            pulse_rise_time=axes.funscript(2, 5),
+        ),
+        SafetyParams(500, 1000),
+    )
+
+
+def create_ab_test(seed: int = 0):
+    from stim_math.audio_gen.pulse_based import ABTestThreePhasePulseBasedAlgorithm
+    axes = FixtureAxes(seed)
+    c = axes.constant
+    return ABTestThreePhasePulseBasedAlgorithm(
+        DummyMediaSync(),
+        ThreephaseABTestAlgorithmParams(
+            position=axes.position(),
+            transform=axes.transform(),
+            calibrate=axes.calibrate(),
+            vibration_1=axes.vibration(10.0, 0.3),
+            vibration_2=axes.vibration(1.5, 0.2),
+            volume=axes.volume(),
+            a_volume=c(1.0),
+            a_train_duration=c(0.5),
+            a_carrier_frequency=c(700.0),
+            a_pulse_frequency=c(50.0),
+            a_pulse_width=c(6.0),
+            a_pulse_interval_random=c(0.1),
+            a_pulse_rise_time=c(3.0),
+            b_volume=c(0.8),
+            b_train_duration=c(0.3),
+            b_carrier_frequency=c(900.0),
+            b_pulse_frequency=c(120.0),
+            b_pulse_width=c(5.0),
+            b_pulse_interval_random=c(0.0),
+            b_pulse_rise_time=c(2.0),
+        ),
+        SafetyParams(500, 1000),
+        waveform_change_callback=lambda is_a: None,
+    )
+
+
+def create_focstim_threephase(seed: int = 0):
+    # requires protobuf
+    from device.focstim.threephase_algorithm import FOCStimThreephaseAlgorithm
+    axes = FixtureAxes(seed)
+    return FOCStimThreephaseAlgorithm(
+        DummyMediaSync(),
+        FOCStimParams(
+            position=axes.position(),
+            transform=axes.transform(),
+            calibrate=axes.calibrate(),
+            volume=axes.volume(),
+            carrier_frequency=axes.funscript(500, 1000),
+            pulse_frequency=axes.funscript(20, 150),
+            pulse_width=axes.funscript(4, 10),
+            pulse_interval_random=axes.constant(0.1),
+            pulse_rise_time=axes.funscript(2, 5),
+            tau=axes.constant(355.0),
+        ),
+        SafetyParamsFOC(500, 1000, 0.12),
+    )
+
+
+def create_focstim_fourphase(seed: int = 0):
+    # requires protobuf
+    from device.focstim.fourphase_algorithm import FOCStimFourphaseAlgorithm
+    axes = FixtureAxes(seed)
+    c = axes.constant
+    return FOCStimFourphaseAlgorithm(
+        DummyMediaSync(),
+        FourphaseFOCStimParams(
+            position=FourphaseIntensityParams(
+                axes.funscript(0, 1), axes.funscript(0, 1), axes.funscript(0, 1), axes.funscript(0, 1)),
+            calibrate=FourphaseCalibrationParams(c(0.0), c(0.0), c(0.0), c(0.0), c(0.7)),
+            volume=axes.volume(),
+            carrier_frequency=axes.funscript(500, 1000),
+            pulse_frequency=axes.funscript(20, 150),
+            pulse_width=axes.funscript(4, 10),
+            pulse_interval_random=axes.constant(0.1),
+            pulse_rise_time=axes.funscript(2, 5),
+            tau=axes.constant(355.0),
+        ),
+        SafetyParamsFOC(500, 1000, 0.12),
+    )
+
+
+audio_algorithms = {
+    'continuous': create_continuous,
+    'pulse_based': create_pulse_based,
+    'ab_test': create_ab_test,
+}
+
+remote_algorithms = {
+    'focstim_threephase': create_focstim_threephase,
+    'focstim_fourphase': create_focstim_fourphase,
+}
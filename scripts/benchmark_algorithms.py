@@ -0,0 +1,227 @@
+"""
+Throughput benchmark of the audio generation algorithms and the parameter_dict() of the remote
+(FOC-Stim) algorithms, driven by synthetic funscripts, see algorithm_fixtures.py.
+
+For every algorithm, block size and samplerate it reports:
+- ns/sample and realtime factor
+- p50 and p99 time per block, and the p99 as a fraction of the block duration
+- memory allocated per block: the peak traced by tracemalloc, measured in a separate pass
+
+run from the repository root:
+    python -m scripts.benchmark_algorithms -o benchmark.json
+    python -m scripts.benchmark_algorithms -o new.json --compare benchmark.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from scripts import algorithm_fixtures
+from scripts.algorithm_fixtures import EPOCH
+
+RESULTS_VERSION = 1
+
+
+def block_timestamps(samplerate: int, blocksize: int, block: int) -> np.ndarray:
+    return EPOCH + (np.arange(blocksize) + block * blocksize) / samplerate
+
+
+def benchmark_audio(name: str, blocksize: int, samplerate: int, duration: float, allocation_blocks: int) -> dict:
+    np.random.seed(0)
+    algorithm = algorithm_fixtures.audio_algorithms[name]()
+    n_blocks = max(10, int(duration * samplerate / blocksize))
+    warmup = max(2, n_blocks // 20)
+
+    times = np.empty(n_blocks)
+    for block in range(warmup + n_blocks):
+        t = block_timestamps(samplerate, blocksize, block)
+        start = time.perf_counter_ns()
+        algorithm.generate_audio(samplerate, t, t)
+        if block >= warmup:
+            times[block - warmup] = time.perf_counter_ns() - start
+
+    # tracemalloc slows down allocations, measure it separately from the timing
+    allocations = np.empty(allocation_blocks)
+    tracemalloc.start()
+    try:
+        for i in range(allocation_blocks):
+            t = block_timestamps(samplerate, blocksize, warmup + n_blocks + i)
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            algorithm.generate_audio(samplerate, t, t)
+            _, peak = tracemalloc.get_traced_memory()
+            allocations[i] = peak - baseline
+    finally:
+        tracemalloc.stop()
+
+    total = np.sum(times)
+    samples = n_blocks * blocksize
+    block_duration_ns = blocksize / samplerate * 1e9
+    return {
+        'kind': 'audio',
+        'algorithm': name,
+        'blocksize': blocksize,
+        'samplerate': samplerate,
+        'blocks': n_blocks,
+        'ns_per_sample': total / samples,
+        'realtime_factor': samples / samplerate / (total * 1e-9),
+        'block_p50_us': np.percentile(times, 50) / 1e3,
+        'block_p99_us': np.percentile(times, 99) / 1e3,
+        'block_p99_load': np.percentile(times, 99) / block_duration_ns,
+        'allocated_bytes_per_block': float(np.median(allocations)),
+    }
+
+
+def benchmark_remote(name: str, calls: int) -> dict:
+    np.random.seed(0)
+    algorithm = algorithm_fixtures.remote_algorithms[name]()
+    for _ in range(max(10, calls // 20)):
+        algorithm.parameter_dict()
+
+    times = np.empty(calls)
+    for i in range(calls):
+        start = time.perf_counter_ns()
+        algorithm.parameter_dict()
+        times[i] = time.perf_counter_ns() - start
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        algorithm.parameter_dict()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'kind': 'remote',
+        'algorithm': name,
+        'calls': calls,
+        'ns_per_call': float(np.mean(times)),
+        'call_p50_us': np.percentile(times, 50) / 1e3,
+        'call_p99_us': np.percentile(times, 99) / 1e3,
+        'allocated_bytes_per_call': peak - baseline,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def case_key(result: dict) -> tuple:
+    return result['kind'], result['algorithm'], result.get('blocksize'), result.get('samplerate')
+
+
+def case_name(result: dict) -> str:
+    if result['kind'] == 'audio':
+        return f'{result["algorithm"]:<12} {result["blocksize"]:5} @ {result["samplerate"]:6}'
+    return f'{result["algorithm"]:<27}'
+
+
+def print_result(result: dict):
+    if result['kind'] == 'audio':
+        print(f'{case_name(result)}: {result["ns_per_sample"]:8.1f} ns/sample, '
+              f'{result["realtime_factor"]:7.1f}x realtime, '
+              f'p99 {result["block_p99_us"]:8.1f} us ({result["block_p99_load"]:5.1%} of block), '
+              f'{result["allocated_bytes_per_block"] / 1024:7.1f} KiB/block', flush=True)
+    else:
+        print(f'{case_name(result)}: {result["ns_per_call"]:8.0f} ns/call, '
+              f'p99 {result["call_p99_us"]:8.1f} us, '
+              f'{result["allocated_bytes_per_call"] / 1024:7.1f} KiB/call', flush=True)
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> int:
+    """
+    Print the change of every case relative to an earlier run.
+    :return: the number of cases that got slower by more than threshold
+    """
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {case_key(result): result for result in json.load(f)['results']}
+
+    print(f'\ncompared to {baseline_path}:')
+    regressions = 0
+    for result in results:
+        old = baseline.get(case_key(result))
+        if old is None:
+            continue
+        metric = 'ns_per_sample' if result['kind'] == 'audio' else 'ns_per_call'
+        ratio = result[metric] / old[metric]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions += 1
+            flag = '  REGRESSION'
+        print(f'{case_name(result)}: {old[metric]:8.1f} -> {result[metric]:8.1f} {metric} ({ratio - 1:+6.1%}){flag}')
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the audio generation algorithms.')
+    parser.add_argument('-a', '--algorithms', nargs='+',
+                        choices=list(algorithm_fixtures.audio_algorithms) + list(algorithm_fixtures.remote_algorithms),
+                        help='default: all')
+    parser.add_argument('-b', '--blocksizes', type=int, nargs='+', default=[64, 256, 1024, 4096])
+    parser.add_argument('-r', '--samplerates', type=int, nargs='+', default=[44100, 48000, 96000])
+    parser.add_argument('-d', '--duration', type=float, default=5.0,
+                        help='seconds of audio generated per case')
+    parser.add_argument('--allocation-blocks', type=int, default=20,
+                        help='number of blocks traced to measure allocations')
+    parser.add_argument('--calls', type=int, default=20000, help='number of parameter_dict() calls per remote algorithm')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='with --compare, relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    names = args.algorithms or list(algorithm_fixtures.audio_algorithms) + list(algorithm_fixtures.remote_algorithms)
+    results = []
+    skipped = []
+    for name in names:
+        if name in algorithm_fixtures.audio_algorithms:
+            for samplerate in args.samplerates:
+                for blocksize in args.blocksizes:
+                    result = benchmark_audio(name, blocksize, samplerate, args.duration, args.allocation_blocks)
+                    print_result(result)
+                    results.append(result)
+        else:
+            try:
+                result = benchmark_remote(name, args.calls)
+            except ImportError as e:
+                print(f'{name}: skipped, {e}', flush=True)
+                skipped.append(name)
+                continue
+            print_result(result)
+            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': RESULTS_VERSION,
+                'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'processor': platform.processor() or platform.machine(),
+                'duration': args.duration,
+                'skipped': skipped,
+                'results': results,
+            }, f, indent=2)
+        print(f'results written to {args.output}')
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Scaling benchmark of the parallel bake engine (bake.engine.bake_parallel), driven by the
+synthetic funscripts of algorithm_fixtures.py.
+
+For every algorithm it reports:
+- the time to render one segment, and to fast-forward over it with advance(). The fast-forward
+  is sequential, render / fast-forward is the highest speedup bake_parallel() can reach
+- the wall time of bake() and of bake_parallel() with every number of workers, the speedup,
+  and whether the output is identical to bake()
+
+The speedup is only meaningful for worker counts up to the number of cpus - 1, the fast-forward
+runs in one more process.
+
+run from the repository root:
+    python -m scripts.benchmark_bake
+    python -m scripts.benchmark_bake -a pulse_based -w 1 2 4 8 16 -d 600
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from bake.engine import advance, bake, bake_parallel, checkpoint, open_output_file, render_into
+from scripts import algorithm_fixtures
+from scripts.algorithm_fixtures import EPOCH
+
+SAMPLERATE = 44100
+CHUNK_SIZE = 4410
+
+
+def create_algorithm(name: str):
+    np.random.seed(0)
+    return algorithm_fixtures.audio_algorithms[name]()
+
+
+def segment_costs(name: str, segment_length: float) -> tuple[float, float]:
+    """
+    :return: (render time, fast-forward time) of the first segment, in seconds
+    """
+    n = int(segment_length * SAMPLERATE)
+    algorithm = create_algorithm(name)
+    start = time.perf_counter()
+    advance(algorithm, SAMPLERATE, EPOCH, 0, n, CHUNK_SIZE)
+    advance_time = time.perf_counter() - start
+
+    algorithm = create_algorithm(name)
+    out = np.empty((n, algorithm.channel_count()))
+    start = time.perf_counter()
+    render_into(algorithm, out, SAMPLERATE, EPOCH, 0, CHUNK_SIZE)
+    return time.perf_counter() - start, advance_time
+
+
+def timed_bake(name: str, filename: str, duration: float, workers: int | None, segment_length: float) -> float:
+    algorithm = create_algorithm(name)
+    start = time.perf_counter()
+    with open_output_file(filename, SAMPLERATE, algorithm.channel_count()) as file:
+        if workers is None:
+            bake(algorithm, file, SAMPLERATE, int(duration * SAMPLERATE), EPOCH, CHUNK_SIZE)
+        else:
+            bake_parallel(algorithm, file, SAMPLERATE, int(duration * SAMPLERATE), EPOCH, workers,
+                          segment_length, CHUNK_SIZE)
+    return time.perf_counter() - start
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the scaling of the parallel bake engine.')
+    parser.add_argument('-a', '--algorithms', nargs='+', choices=list(algorithm_fixtures.audio_algorithms),
+                        help='default: all')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('-d', '--duration', type=float, default=300.0, help='seconds of audio baked per run')
+    parser.add_argument('-s', '--segment-length', type=float, default=30.0, help='in seconds')
+    args = parser.parse_args(argv)
+
+    print(f'{os.cpu_count()} cpus, {args.duration:.0f} s of audio, {args.segment_length:.0f} s segments', flush=True)
+    failed = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.algorithms or algorithm_fixtures.audio_algorithms:
+            try:
+                checkpoint(create_algorithm(name))
+            except (TypeError, AttributeError) as e:
+                print(f'{name}: skipped, can not be baked in parallel ({e})', flush=True)
+                continue
+
+            render_time, advance_time = segment_costs(name, args.segment_length)
+            print(f'\n{name}: segment render {render_time:.3f} s, fast-forward {advance_time:.3f} s, '
+                  f'speedup limit {render_time / advance_time:.1f}x', flush=True)
+
+            reference = os.path.join(directory, f'{name}.wav')
+            single_time = timed_bake(name, reference, args.duration, None, args.segment_length)
+            print(f'    {"bake()":>12}: {single_time:7.2f} s', flush=True)
+            expected, _ = sf.read(reference, dtype='int16')
+
+            for workers in args.workers:
+                filename = os.path.join(directory, f'{name}_{workers}.wav')
+                elapsed = timed_bake(name, filename, args.duration, workers, args.segment_length)
+                actual, _ = sf.read(filename, dtype='int16')
+                identical = np.array_equal(actual, expected)
+                failed += not identical
+                print(f'    {workers:4} workers: {elapsed:7.2f} s, {single_time / elapsed:5.2f}x'
+                      f'{"" if identical else ", OUTPUT DIFFERS"}', flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,271 @@
+"""
+Golden-output regression check for the waveform generators.
+
+Every case renders a fixed input (seeded random state, synthetic funscripts from algorithm_fixtures.py,
+an irregular block schedule) and compares the result with a reference stored in scripts/golden_output/.
+Use it to verify that performance work did not change the signal.
+
+The FOC-Stim cases need protobuf, they are skipped if it is not installed.
+
+run from the repository root:
+    python -m scripts.check_golden_output                       # compare all cases
+    python -m scripts.check_golden_output --update pulse_based  # store new references, after review!
+or as a script:
+    python scripts/check_golden_output.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+from dataclasses import dataclass
+from unittest import mock
+
+import numpy as np
+
+if __name__ == '__main__' and not __package__:
+    # run as a script, make the repository root importable
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts import algorithm_fixtures
+from scripts.algorithm_fixtures import EPOCH
+
+REFERENCE_DIR = os.path.join(os.path.dirname(__file__), 'golden_output')
+
+SAMPLERATE = 44100
+DURATION = 1.0
+# irregular block sizes, to catch errors at block boundaries
+BLOCK_SCHEDULE = [512, 37, 1024, 128, 1, 300, 2048]
+
+
+def render_audio(name: str) -> dict[str, np.ndarray]:
+    np.random.seed(0)
+    algorithm = algorithm_fixtures.audio_algorithms[name]()
+    total = int(DURATION * SAMPLERATE)
+    channels = []
+    position = 0
+    block = 0
+    while position < total:
+        n = min(BLOCK_SCHEDULE[block % len(BLOCK_SCHEDULE)], total - position)
+        t = EPOCH + (np.arange(n) + position) / SAMPLERATE
+        channels.append(np.vstack(algorithm.generate_audio(SAMPLERATE, t, t)))
+        position += n
+        block += 1
+    return {'audio': np.hstack(channels).astype(np.float32)}
+
+
+def render_remote(name: str) -> dict[str, np.ndarray]:
+    np.random.seed(0)
+    algorithm = algorithm_fixtures.remote_algorithms[name]()
+    timestamps = EPOCH + np.arange(600) / 60     # 10 seconds at the FOC-Stim update rate
+    values = {}
+    for t in timestamps:
+        with mock.patch('time.time', return_value=t):
+            d = algorithm.parameter_dict()
+        for key, value in d.items():
+            values.setdefault(str(key), []).append(float(value))
+    return {key: np.array(value) for key, value in values.items()}
+
+
+def render_signal_generator() -> dict[str, np.ndarray]:
+    from stim_math.threephase import ThreePhaseSignalGenerator
+    rng = np.random.default_rng(0)
+    n = 30000   # larger than 2 chunks, to cover the chunked path
+    theta = np.cumsum(rng.uniform(0.05, 0.15, n))
+    alpha = rng.uniform(-1.2, 1.2, n)
+    beta = rng.uniform(-1.2, 1.2, n)
+    L, R = ThreePhaseSignalGenerator.generate(theta, alpha, beta)
+    return {'L': L, 'R': R}
+
+
+def render_calibration() -> dict[str, np.ndarray]:
+    from stim_math.audio_gen.params import ThreephaseCalibrationParams
+    from stim_math.audio_gen.various import ThreePhaseCalibration
+    from stim_math.axis import create_constant_axis
+    rng = np.random.default_rng(0)
+    L = rng.uniform(-1, 1, 1000).astype(np.float32)
+    R = rng.uniform(-1, 1, 1000).astype(np.float32)
+    alpha = rng.uniform(-1, 1, 1000)
+    beta = rng.uniform(-1, 1, 1000)
+    result = {}
+    for i, (neutral, right, center) in enumerate([(0, 0, 0), (1.5, -0.7, -0.6), (-3, 2, 4), (6, 6, -10)]):
+        calibration = ThreePhaseCalibration(ThreephaseCalibrationParams(
+            create_constant_axis(neutral), create_constant_axis(right), create_constant_axis(center)))
+        calibration.update()
+        out_L, out_R = calibration.apply_transform(L, R)
+        result[f'L{i}'] = out_L
+        result[f'R{i}'] = out_R
+        result[f'center_scale{i}'] = calibration.get_center_scale(alpha, beta)
+    return result
+
+
+def render_position_transform() -> dict[str, np.ndarray]:
+    from stim_math.audio_gen.various import CompiledPositionTransform
+    rng = np.random.default_rng(0)
+    alpha = rng.uniform(-1.2, 1.2, 1000)
+    beta = rng.uniform(-1.2, 1.2, 1000)
+    result = {}
+    for i, transform in enumerate([
+        CompiledPositionTransform(True, 15.0, False, 1.0, -0.9, -1.0, 0.9, False, 0.0, 200.0, False),
+        CompiledPositionTransform(True, -40.0, True, 0.8, -1.0, -0.7, 1.0, True, 30.0, 200.0, True),
+    ]):
+        result[f'alpha{i}'], result[f'beta{i}'] = transform.apply(alpha.copy(), beta.copy())
+        # a scalar combined with an array must give the same result as the scalar path for every sample
+        for name, a, b in [('scalar_beta', alpha.copy(), 0.3), ('scalar_alpha', -0.4, beta.copy())]:
+            expected = np.array([transform.apply(float(x), float(y))
+                                 for x, y in zip(*np.broadcast_arrays(a, b))]).T
+            out = np.array(transform.apply(a, b))
+            if not np.allclose(out, expected, atol=1e-12, rtol=0):
+                raise AssertionError(f'position transform {i}: {name} differs from the scalar path')
+            result[f'{name}{i}'] = out
+    return result
+
+
+def pulse_train_parameters() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pulse lengths, widths and rise times, including the edge cases: pulses of 1 and 2 samples,
+    half-sine pulses, no rise time.
+    """
+    rng = np.random.default_rng(0)
+    n = 2000
+    n_samples = rng.integers(1, 400, n)
+    n_samples[:20] = rng.integers(1, 3, 20)
+    carrier_cycles = rng.uniform(3, 100, n)
+    rise_time = rng.uniform(0, 100, n)
+    rise_time[::37] = 0
+    rise_time[::41] = carrier_cycles[::41] / 2
+    return n_samples, carrier_cycles, rise_time
+
+
+def render_pulse_train() -> dict[str, np.ndarray]:
+    from stim_math.pulse import create_pulse_train_with_ramp_time
+    return {'envelope': create_pulse_train_with_ramp_time(*pulse_train_parameters())}
+
+
+def render_bake_parallel() -> dict[str, np.ndarray]:
+    """
+    bake_parallel() must be bit-identical to bake(): segments rendered from a checkpoint
+    continue exactly where the previous segment stopped.
+    :return: max difference between the two bakes of every algorithm, zero
+    """
+    import soundfile as sf
+    from bake.engine import bake, bake_parallel
+    duration_in_samples = 5 * SAMPLERATE
+    result = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ['continuous', 'pulse_based']:
+            output = []
+            for workers in [None, 2]:
+                np.random.seed(0)
+                algorithm = algorithm_fixtures.audio_algorithms[name]()
+                filename = os.path.join(directory, f'{name}_{workers}.wav')
+                # float64 files, so no difference is hidden by rounding to the file format
+                with sf.SoundFile(filename, mode='w', samplerate=SAMPLERATE, channels=algorithm.channel_count(),
+                                  subtype='DOUBLE') as file:
+                    if workers is None:
+                        bake(algorithm, file, SAMPLERATE, duration_in_samples, EPOCH)
+                    else:
+                        bake_parallel(algorithm, file, SAMPLERATE, duration_in_samples, EPOCH, workers,
+                                      segment_length=1.3)
+                output.append(sf.read(filename)[0])
+            difference = np.max(np.abs(output[1] - output[0]))
+            if difference != 0:
+                raise AssertionError(f'{name}: bake_parallel() differs from bake() by up to {difference:.3g}')
+            result[name] = np.array(difference)
+    return result
+
+
+@dataclass
+class Case:
+    render: callable
+    atol: float
+    rtol: float = 0.0
+
+
+# Tolerances allow for reordered float32 arithmetic, not for changed pulse timing or phase.
+cases = {
+    'continuous': Case(lambda: render_audio('continuous'), atol=1e-5),
+    'pulse_based': Case(lambda: render_audio('pulse_based'), atol=1e-5),
+    'ab_test': Case(lambda: render_audio('ab_test'), atol=1e-5),
+    'focstim_threephase': Case(lambda: render_remote('focstim_threephase'), atol=1e-9, rtol=1e-9),
+    'focstim_fourphase': Case(lambda: render_remote('focstim_fourphase'), atol=1e-9, rtol=1e-9),
+    'signal_generator': Case(render_signal_generator, atol=1e-6),
+    'calibration': Case(render_calibration, atol=1e-6, rtol=1e-6),
+    'position_transform': Case(render_position_transform, atol=1e-9),
+    # reference: the per-pulse np.interp implementation the train replaced
+    'pulse_train': Case(render_pulse_train, atol=1e-12),
+    'bake_parallel': Case(render_bake_parallel, atol=0.0),
+}
+
+
+def reference_path(name: str) -> str:
+    return os.path.join(REFERENCE_DIR, name + '.npz')
+
+
+def compare(name: str, case: Case, result: dict[str, np.ndarray]) -> list[str]:
+    """
+    :return: description of every difference, empty if the result matches the reference
+    """
+    with np.load(reference_path(name)) as reference:
+        reference = dict(reference)
+    errors = []
+    if set(reference) != set(result):
+        errors.append(f'arrays differ: reference {sorted(reference)}, result {sorted(result)}')
+    for key in sorted(set(reference) & set(result)):
+        expected, actual = reference[key], result[key]
+        if expected.shape != actual.shape:
+            errors.append(f'{key}: shape {actual.shape}, expected {expected.shape}')
+            continue
+        mismatch = ~np.isclose(actual, expected, atol=case.atol, rtol=case.rtol)
+        if np.any(mismatch):
+            first = np.unravel_index(np.argmax(mismatch), mismatch.shape)
+            errors.append(f'{key}: {np.count_nonzero(mismatch)} values differ, '
+                          f'max error {np.max(np.abs(actual - expected)):.3g}, first at index {first}')
+    return errors
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Compare waveform generator output with stored references.')
+    parser.add_argument('cases', nargs='*', help=f'default: all. One of {", ".join(cases)}')
+    parser.add_argument('--update', action='store_true', help='overwrite the references with the current output')
+    args = parser.parse_args(argv)
+    for name in args.cases:
+        if name not in cases:
+            parser.error(f'unknown case: {name}')
+
+    failed = 0
+    for name in args.cases or cases:
+        case = cases[name]
+        try:
+            result = case.render()
+        except ImportError as e:
+            print(f'{name}: skipped, {e}')
+            continue
+        except AssertionError as e:
+            # consistency checks done while rendering
+            failed += 1
+            print(f'{name}: FAILED')
+            print(f'    {e}')
+            continue
+
+        if args.update:
+            os.makedirs(REFERENCE_DIR, exist_ok=True)
+            np.savez_compressed(reference_path(name), **result)
+            print(f'{name}: reference updated')
+        elif not os.path.exists(reference_path(name)):
+            print(f'{name}: no reference, run with --update')
+            failed += 1
+        else:
+            errors = compare(name, case, result)
+            if errors:
+                failed += 1
+                print(f'{name}: FAILED')
+                for error in errors:
+                    print(f'    {error}')
+            else:
+                print(f'{name}: ok')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
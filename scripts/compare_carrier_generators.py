@@ -0,0 +1,55 @@
+"""
+Compare the accuracy and throughput of the carrier generators:
+AngleGenerator + cos/sin (CarrierMode.TRIG) vs PhasorGenerator (CarrierMode.PHASOR)
+
+run from the repository root: python -m scripts.compare_carrier_generators
+"""
+import timeit
+
+import numpy as np
+
+from stim_math.sine_generator import AngleGenerator, PhasorGenerator
+from stim_math.threephase import ThreePhaseSignalGenerator
+
+
+def generate_trig(generator, n, frequency, samplerate):
+    return ThreePhaseSignalGenerator.carrier(generator.generate(n, frequency, samplerate))
+
+
+def accuracy(duration_in_s=600, samplerate=44100, blocksize=512):
+    """
+    Generate a long carrier with a frequency change every block and report the
+    worst-case difference between both generators.
+    """
+    rng = np.random.default_rng(0)
+    trig = AngleGenerator()
+    phasor = PhasorGenerator()
+    max_error = 0
+    max_magnitude_error = 0
+    frequency = 800
+    for i in range(int(duration_in_s * samplerate / blocksize)):
+        frequency = np.clip(frequency + rng.normal(0, 2), 500, 1000)
+        x1, y1 = generate_trig(trig, blocksize, frequency, samplerate)
+        x2, y2 = phasor.generate(blocksize, frequency, samplerate)
+        max_error = max(max_error, np.max(np.abs(x1 - x2)), np.max(np.abs(y1 - y2)))
+        max_magnitude_error = max(max_magnitude_error, abs(abs(phasor.phasor) - 1))
+    print(f'{duration_in_s} s of audio with frequency change every block ({blocksize} samples):')
+    print(f'  max abs difference trig vs phasor: {max_error:.2e}')
+    print(f'  max phasor magnitude error:        {max_magnitude_error:.2e}')
+
+
+def throughput(samplerate=44100):
+    for blocksize in (64, 256, 1024, 4096):
+        trig = AngleGenerator()
+        phasor = PhasorGenerator()
+        number = max(1, 2_000_000 // blocksize)
+        t_trig = timeit.timeit(lambda: generate_trig(trig, blocksize, 800, samplerate), number=number)
+        t_phasor = timeit.timeit(lambda: phasor.generate(blocksize, 800, samplerate), number=number)
+        samples = number * blocksize
+        print(f'blocksize {blocksize:5}: trig {t_trig / samples * 1e9:6.1f} ns/sample, '
+              f'phasor {t_phasor / samples * 1e9:6.1f} ns/sample ({t_trig / t_phasor:.2f}x)')
+
+
+if __name__ == '__main__':
+    accuracy()
+    throughput()
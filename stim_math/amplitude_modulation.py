@@ -1,45 +1,161 @@
+import math
+
 import numpy as np
 
-from stim_math.limits import ModulationBias
+from stim_math.limits import ModulationBias, clamp
+
+
+def sine_envelope(theta, strength, l_r, h_l):
+    high_time = np.clip(h_l, 0, 1)
+    low_time = np.clip(-h_l, 0, 1)
+    rise_time = (1 - high_time - low_time) * (1 - l_r) / 2
+    fall_time = (1 - high_time - low_time) * (1 + l_r) / 2
+
+    t_startrise = low_time
+    t_endrise = t_startrise + rise_time
+    t_startdrop = t_endrise + high_time
+    t_enddrop = t_startdrop + fall_time
+
+    remap = np.array([
+        [2 * np.pi * t_startrise, 0],
+        [2 * np.pi * t_endrise, np.pi],
+        [2 * np.pi * t_startdrop, np.pi],
+        [2 * np.pi * t_enddrop, 2 * np.pi],
+    ])
+    theta = np.interp(theta % (np.pi * 2), remap[:, 0], remap[:, 1])
+    a = 1 - strength / 2
+    b = -strength / 2
+    return a + b * np.cos(theta)
+
+
+def sine_envelope_scalar(theta: float, strength: float, l_r: float, h_l: float) -> float:
+    """
+    sine_envelope() for a single angle, in pure python to avoid numpy call overhead.
+    """
+    high_time = clamp(h_l, 0, 1)
+    low_time = clamp(-h_l, 0, 1)
+    rise_time = (1 - high_time - low_time) * (1 - l_r) / 2
+    fall_time = (1 - high_time - low_time) * (1 + l_r) / 2
+
+    t_startrise = low_time
+    t_endrise = t_startrise + rise_time
+    t_startdrop = t_endrise + high_time
+    t_enddrop = t_startdrop + fall_time
+
+    xp = (2 * math.pi * t_startrise, 2 * math.pi * t_endrise, 2 * math.pi * t_startdrop, 2 * math.pi * t_enddrop)
+    fp = (0, math.pi, math.pi, 2 * math.pi)
+    x = theta % (math.pi * 2)
+    if x <= xp[0]:
+        theta = fp[0]
+    elif x >= xp[3]:
+        theta = fp[3]
+    else:
+        i = 0 if x < xp[1] else (1 if x < xp[2] else 2)
+        theta = fp[i] + (x - xp[i]) * (fp[i + 1] - fp[i]) / (xp[i + 1] - xp[i])
+    a = 1 - strength / 2
+    b = -strength / 2
+    return a + b * math.cos(theta)
+
+
+class ModulationWavetable:
+    """
+    One period of the modulation envelope, sampled at a fixed number of points.
+    Lookup is linear interpolation, max error around 1e-5.
+    """
+    size = 1024
+
+    def __init__(self, strength, l_r, h_l):
+        theta = np.linspace(0, 2 * np.pi, self.size + 1)
+        self.table = sine_envelope(theta, strength, l_r, h_l)
+        self.slope = np.diff(self.table)
+
+    def lookup(self, theta: np.ndarray):
+        position = np.floor(theta * (self.size / (2 * np.pi)))
+        fraction = theta * (self.size / (2 * np.pi)) - position
+        index = position.astype(np.intp)
+        index %= self.size
+        return self.table[index] + self.slope[index] * fraction
+
+
+class ModulationWavetableSlot:
+    """
+    The envelope parameters of the previous evaluation of one vibration, and their wavetable.
+
+    The wavetable is used when the parameters repeat from the previous evaluation. Parameters
+    driven by funscripts change on every block, building a table that is never reused would be
+    slower than evaluating the envelope directly. The choice only depends on the previous
+    evaluation of the same vibration, so an algorithm restored from a checkpoint and
+    fast-forwarded with advance() renders the same samples as one that never stopped.
+    """
+    def __init__(self):
+        self.key = None     # (strength, l_r, h_l)
+        self._table = None
+
+    def update(self, strength: float, l_r: float, h_l: float) -> bool:
+        """
+        Remember the parameters of this evaluation.
+        :return: True if they are the same as in the previous evaluation
+        """
+        key = (strength, l_r, h_l)
+        if key == self.key:
+            return True
+        self.key = key
+        self._table = None
+        return False
+
+    def table(self) -> ModulationWavetable:
+        if self._table is None:
+            self._table = ModulationWavetable(*self.key)
+        return self._table
+
+    def __getstate__(self):
+        # the table is rebuilt from the key, keep checkpoints small
+        return {'key': self.key}
+
+    def __setstate__(self, state):
+        self.key = state['key']
+        self._table = None
+
+
+def envelope_parameters(modulation, left_right_bias, high_low_bias):
+    """
+    :return: (strength, l_r, h_l) clipped to safety limits
+    """
+    strength = clamp(modulation, 0.0, 1.0)
+    l_r = clamp(clamp(left_right_bias, -1, 1), ModulationBias.min, ModulationBias.max)
+    h_l = clamp(clamp(high_low_bias, -1, 1), ModulationBias.min, ModulationBias.max)
+    return strength, l_r, h_l
 
 
 class SineModulation:
     def __init__(self, theta, modulation, left_right_bias, high_low_bias):
         self.theta = theta
         self.modulation = modulation
-        self.left_right_bias = np.clip(left_right_bias, -1, 1)
-        self.high_low_bias = np.clip(high_low_bias, -1, 1)
+        self.left_right_bias = clamp(left_right_bias, -1, 1)
+        self.high_low_bias = clamp(high_low_bias, -1, 1)
 
     def modulate(self, L, R):
         e = self.envelope()
         return L * e, R * e
 
-    def get_modulation_signal(self):
-        return self.envelope()
-
-    def envelope(self):
-        # clip to safety limits
-        strength = np.clip(self.modulation, 0.0, 1.0)
-        l_r = np.clip(self.left_right_bias, ModulationBias.min, ModulationBias.max)
-        h_l = np.clip(self.high_low_bias, ModulationBias.min, ModulationBias.max)
-
-        high_time = np.clip(h_l, 0, 1)
-        low_time = np.clip(-h_l, 0, 1)
-        rise_time = (1 - high_time - low_time) * (1 - l_r) / 2
-        fall_time = (1 - high_time - low_time) * (1 + l_r) / 2
-
-        t_startrise = low_time
-        t_endrise = t_startrise + rise_time
-        t_startdrop = t_endrise + high_time
-        t_enddrop = t_startdrop + fall_time
-
-        remap = np.array([
-            [2 * np.pi * t_startrise, 0],
-            [2 * np.pi * t_endrise, np.pi],
-            [2 * np.pi * t_startdrop, np.pi],
-            [2 * np.pi * t_enddrop, 2 * np.pi],
-        ])
-        theta = np.interp(self.theta % (np.pi * 2), remap[:, 0], remap[:, 1])
-        a = 1 - strength / 2
-        b = -strength / 2
-        return a + b * np.cos(theta)
\ No newline at end of file
+    def get_modulation_signal(self, wavetable: ModulationWavetableSlot = None):
+        return self.envelope(wavetable)
+
+    def envelope(self, wavetable: ModulationWavetableSlot = None):
+        """
+        :param wavetable: remembers the parameters between calls, the envelope is looked up
+            in a table when they repeat
+        """
+        strength, l_r, h_l = envelope_parameters(self.modulation, self.left_right_bias, self.high_low_bias)
+
+        if isinstance(strength, np.ndarray) or isinstance(l_r, np.ndarray) or isinstance(h_l, np.ndarray):
+            return sine_envelope(self.theta, strength, l_r, h_l)
+
+        repeated = wavetable is not None and wavetable.update(float(strength), float(l_r), float(h_l))
+
+        if not isinstance(self.theta, np.ndarray):
+            return sine_envelope_scalar(self.theta, strength, l_r, h_l)
+
+        if repeated:
+            return wavetable.table().lookup(self.theta)
+        return sine_envelope(self.theta, strength, l_r, h_l)
@@ -25,6 +25,24 @@ class AudioGenerationAlgorithm(ABC):
         """
         pass
 
+    def generate_audio_into(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray, out):
+        """
+        Like generate_audio(), but writes the audio channels into caller-supplied arrays.
+        Override to avoid intermediate copies.
+        :param out: sequence of writable arrays, one per audio channel, each of len(steady_clock).
+            May be non-contiguous views, like the columns of the sounddevice output buffer.
+        """
+        for channel, data in zip(out, self.generate_audio(samplerate, steady_clock, system_time_estimate)):
+            channel[:] = data
+
+    def advance(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
+        """
+        Update the internal state (carrier phase, pulse sequencing, etc.) exactly as
+        generate_audio() would, without producing audio. Used to fast-forward an algorithm.
+        Override if this can be done cheaper than generating the audio.
+        """
+        self.generate_audio(samplerate, steady_clock, system_time_estimate)
+
 
 class AudioModifyAlgorithm(ABC):
     @abstractmethod
@@ -45,6 +63,16 @@ class AudioModifyAlgorithm(ABC):
         """
         pass
 
+    def modify_audio_into(self, in_data: np.array, out):
+        """
+        Like modify_audio(), but writes the audio channels into caller-supplied arrays.
+        Override to avoid intermediate copies.
+        :param in_data: Audio channel data (np.array of float)
+        :param out: sequence of writable arrays, one per audio channel. May be non-contiguous views.
+        """
+        for channel, data in zip(out, self.modify_audio(in_data)):
+            channel[:] = data
+
 
 class RemoteGenerationAlgorithm(ABC):
     @abstractmethod
@@ -4,9 +4,10 @@ import numpy as np
 
 from stim_math import threephase
 from stim_math.audio_gen.base_classes import AudioGenerationAlgorithm
-from stim_math.audio_gen.various import VibrationAlgorithm, ThreePhasePosition
+from stim_math.audio_gen.various import VibrationAlgorithm, ThreePhasePosition, ThreePhaseCalibration
+from stim_math.audio_gen.control_rate import ControlRateSampler
 from stim_math.axis import AbstractMediaSync
-from stim_math.sine_generator import AngleGenerator
+from stim_math.sine_generator import AngleGenerator, PhasorGenerator, CarrierMode
 
 from stim_math.audio_gen.params import *
 
@@ -17,23 +18,68 @@ class MultiPhaseAlgorithm(AudioGenerationAlgorithm, ABC):
 
 
 class ThreePhaseAlgorithm(AudioGenerationAlgorithm):
-    def __init__(self, media: AbstractMediaSync, params: ThreephaseContinuousAlgorithmParams, safety_limits: SafetyParams):
+    def __init__(self, media: AbstractMediaSync, params: ThreephaseContinuousAlgorithmParams, safety_limits: SafetyParams,
+                 carrier_mode: CarrierMode = CarrierMode.TRIG, control_rate: float = 0):
+        """
+        :param control_rate: rate (Hz) at which volume and position are evaluated before
+            upsampling to audio rate. 0 to evaluate them for every sample.
+        """
         super().__init__()
         self.media = media
         self.params = params
         self.vibration = VibrationAlgorithm(params.vibration_1, params.vibration_2)
         self.position = ThreePhasePosition(params.position, params.transform)
+        self.calibration = ThreePhaseCalibration(params.calibrate)
         self.safety_limits = safety_limits
 
+        self.carrier_mode = carrier_mode
         self.carrier_angle = AngleGenerator()
+        self.carrier_phasor = PhasorGenerator()
+
+        self.control = ControlRateSampler(control_rate) if control_rate else None
 
     def channel_count(self) -> int:
         return 2
 
     def generate_audio(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
+        L, R, volume = self.generate_unscaled(samplerate, steady_clock, system_time_estimate)
+        L *= volume
+        R *= volume
+        return L, R
+
+    def generate_audio_into(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray, out):
+        L, R, volume = self.generate_unscaled(samplerate, steady_clock, system_time_estimate)
+        np.multiply(L, volume, out=out[0])
+        np.multiply(R, volume, out=out[1])
+
+    def advance(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
+        n = len(steady_clock)
+        self.vibration.advance(system_time_estimate[0], samplerate, n)
+
+        frequency = self.params.carrier_frequency.interpolate(system_time_estimate[0])
+        frequency = np.clip(frequency,
+                            self.safety_limits.minimum_carrier_frequency,
+                            self.safety_limits.maximum_carrier_frequency)
+        if self.carrier_mode == CarrierMode.PHASOR:
+            self.carrier_phasor.advance(n, frequency, samplerate)
+        else:
+            self.carrier_angle.advance(n, frequency, samplerate)
+
+    def generate_unscaled(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
+        """
+        :return: L, R and the volume that must be applied to both channels.
+        """
+        if self.control is not None:
+            self.control.begin_block(samplerate, system_time_estimate)
+            api_volume = self.control.evaluate(self.params.volume.api.interpolate)
+            alpha, beta = self.control.evaluate(self.position.get_position)
+        else:
+            api_volume = self.params.volume.api.interpolate(system_time_estimate)
+            alpha, beta = self.position.get_position(system_time_estimate)
+
         volume = \
             np.clip(self.params.volume.master.last_value(), 0, 1) * \
-            np.clip(self.params.volume.api.interpolate(system_time_estimate), 0, 1) * \
+            np.clip(api_volume, 0, 1) * \
             np.clip(self.params.volume.inactivity.last_value(), 0, 1) * \
             np.clip(self.params.volume.external.last_value(), 0, 1)
         volume *= self.vibration.generate_vibration_signal(system_time_estimate[0], samplerate, len(steady_clock))
@@ -44,22 +90,20 @@ class ThreePhaseAlgorithm(AudioGenerationAlgorithm):
         frequency = np.clip(frequency,
                             self.safety_limits.minimum_carrier_frequency,
                             self.safety_limits.maximum_carrier_frequency)
-        theta_carrier = self.carrier_angle.generate(len(steady_clock), frequency, samplerate)
 
-        alpha, beta = self.position.get_position(system_time_estimate)
+        self.calibration.update()
 
         # center scaling
-        center_calib = threephase.ThreePhaseCenterCalibration(self.params.calibrate.center.last_value())
-        volume *= center_calib.get_scale(alpha, beta)
-
-        # hardware calibration
-        hw = threephase.ThreePhaseHardwareCalibration(self.params.calibrate.neutral.last_value(),
-                                                      self.params.calibrate.right.last_value())
+        volume *= self.calibration.get_center_scale(alpha, beta)
 
         tp = threephase.ThreePhaseSignalGenerator()
-        L, R = tp.generate(theta_carrier, alpha, beta)
-        L, R = hw.apply_transform(L, R)
+        if self.carrier_mode == CarrierMode.PHASOR:
+            carrier_x, carrier_y = self.carrier_phasor.generate(len(steady_clock), frequency, samplerate)
+            L, R = tp.generate_from_carrier(carrier_x, carrier_y, alpha, beta)
+        else:
+            theta_carrier = self.carrier_angle.generate(len(steady_clock), frequency, samplerate)
+            L, R = tp.generate(theta_carrier, alpha, beta)
 
-        L *= volume
-        R *= volume
-        return L, R
+        # hardware calibration
+        L, R = self.calibration.apply_transform(L, R)
+        return L, R, volume
@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class ControlRateSampler:
+    """
+    Evaluates slowly changing parameters at a reduced control rate and linearly
+    upsamples them to audio rate.
+
+    Axes are driven by t-code or funscripts, and change at a few hundred Hz at most.
+    Evaluating them for every audio sample is wasteful. Instead, evaluate them at
+    every n'th sample (and the last sample of the block) and interpolate in between.
+
+    If a parameter jumps by more than max_step between two control points,
+    the block probably spans a discontinuity and the exact per-sample value is used instead.
+
+    Usage: call begin_block() once per audio block, then evaluate() for every parameter.
+    """
+    def __init__(self, control_rate=2000.0, max_step=0.05):
+        self.control_rate = control_rate
+        self.max_step = max_step
+
+        self.timestamps = None
+        self.control_timestamps = None
+        self._knot_index = None
+        self._ramp = None
+        self._tail_ramp = None  # padded to stride samples
+        self._layout = None     # (n_samples, stride) the knot indices were computed for
+
+        self.fallbacks = 0      # number of evaluations that fell back to exact evaluation
+
+    def begin_block(self, samplerate, timestamps: np.ndarray):
+        self.timestamps = timestamps
+        n = len(timestamps)
+        stride = int(samplerate // self.control_rate)
+        if stride <= 1 or n <= stride + 1:
+            # block too short to benefit
+            self.control_timestamps = None
+            return
+
+        if self._layout != (n, stride):
+            # knots every stride samples, plus the last sample of the block
+            self._layout = (n, stride)
+            self._knot_index = np.arange(0, n, stride)
+            tail = (n - 1) % stride
+            if tail:
+                self._knot_index = np.append(self._knot_index, n - 1)
+            self._ramp = np.arange(stride) / stride
+            self._tail_ramp = np.arange(stride) / max(tail, 1)
+        self.control_timestamps = timestamps[self._knot_index]
+
+    def evaluate(self, func):
+        """
+        :param func: function of a timestamp array, returning an array or tuple of arrays.
+            Constant parameters may return scalars.
+        :return: the output of func, evaluated (approximately) at every timestamp of the block.
+        """
+        if self.control_timestamps is None:
+            return func(self.timestamps)
+
+        values = func(self.control_timestamps)
+        is_tuple = isinstance(values, tuple)
+        if not is_tuple:
+            values = (values, )
+
+        varying = [i for i, v in enumerate(values) if np.ndim(v)]
+        if varying:
+            knots = np.array([values[i] for i in varying])
+            steps = knots[:, 1:] - knots[:, :-1]
+            if steps.max() > self.max_step or steps.min() < -self.max_step:
+                self.fallbacks += 1
+                return func(self.timestamps)
+            values = list(values)
+            for i, v in zip(varying, self.upsample(knots, steps)):
+                values[i] = v
+
+        return tuple(values) if is_tuple else values[0]
+
+    def upsample(self, knots, steps):
+        """
+        :param knots: array of shape (k, n_knots), values at the control timestamps
+        :param steps: difference between consecutive knots
+        :return: array of shape (k, n_samples), linearly interpolated
+        """
+        n, stride = self._layout
+        m = (n - 1) // stride   # number of full segments
+        # one row per segment, the last row holds the remaining samples
+        out = np.empty((knots.shape[0], m + 1, stride))
+        out[:, :m] = steps[:, :m, None] * self._ramp + knots[:, :m, None]
+        if steps.shape[1] > m:
+            out[:, m] = steps[:, m, None] * self._tail_ramp + knots[:, m, None]
+        else:
+            out[:, m, 0] = knots[:, m]
+        return out.reshape(knots.shape[0], -1)[:, :n]
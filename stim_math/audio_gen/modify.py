@@ -1,19 +1,24 @@
-from stim_math import threephase
 from stim_math.audio_gen.base_classes import AudioModifyAlgorithm
 from stim_math.audio_gen.params import ThreephaseCalibrationParams
+from stim_math.audio_gen.various import ThreePhaseCalibration
 
 
 class ThreePhaseModifyAlgorithm(AudioModifyAlgorithm):
     def __init__(self, calibrate: ThreephaseCalibrationParams):
         super().__init__()
         self.calibrate = calibrate
+        self.calibration = ThreePhaseCalibration(calibrate)
 
     def channel_count(self) -> int:
         return 2
 
     def modify_audio(self, in_data):
         L, R = in_data.T
-        hw = threephase.ThreePhaseHardwareCalibration(self.calibrate.neutral.last_value(),
-                                                      self.calibrate.right.last_value())
-        L, R = hw.apply_transform(L, R)
+        self.calibration.update()
+        L, R = self.calibration.apply_transform(L, R)
         return L, R
+
+    def modify_audio_into(self, in_data, out):
+        L, R = in_data.T
+        self.calibration.update()
+        self.calibration.apply_transform_into(L, R, out[0], out[1])
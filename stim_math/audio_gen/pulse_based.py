@@ -3,10 +3,10 @@ from dataclasses import dataclass
 import numpy as np
 
 import stim_math.pulse
-import stim_math.threephase
 from stim_math.audio_gen.base_classes import AudioGenerationAlgorithm
+from stim_math.audio_gen.ring_buffer import SampleRingBuffer, RingBufferStats
 from stim_math import threephase
-from stim_math.audio_gen.various import ThreePhasePosition, VibrationAlgorithm
+from stim_math.audio_gen.various import ThreePhasePosition, VibrationAlgorithm, ThreePhaseCalibration
 from stim_math.audio_gen.params import ThreephasePulsebasedAlgorithmParams, ThreephaseCalibrationParams, SafetyParams, ThreephaseABTestAlgorithmParams
 from stim_math.axis import AbstractMediaSync
 from stim_math import limits
@@ -32,13 +32,46 @@ class PulseInfo:
     def total_length_in_samples(self, samplerate):
         return self.pulse_length_in_samples(samplerate) + self.pause_length_in_samples(samplerate)
 
+    def to_record(self, samplerate):
+        return (
+            self.polarity,
+            self.start_angle,
+            self.carrier_frequency,
+            self.pulse_width_in_carrier_cycles,
+            self.rise_time_in_carrier_cycles,
+            self.position[0],
+            self.position[1],
+            self.volume,
+            self.pulse_length_in_samples(samplerate),
+            self.pause_length_in_samples(samplerate),
+        )
+
+
+# structured array representation of PulseInfo, with lengths resolved to samples.
+pulse_dtype = np.dtype([
+    ('polarity', np.float64),
+    ('start_angle', np.float64),
+    ('carrier_frequency', np.float64),
+    ('pulse_width_in_carrier_cycles', np.float64),
+    ('rise_time_in_carrier_cycles', np.float64),
+    ('alpha', np.float64),
+    ('beta', np.float64),
+    ('volume', np.float64),
+    ('pulse_length', np.int64),
+    ('pause_length', np.int64),
+])
+
 
 class ThreePhasePulseBasedAlgorithmBase(AudioGenerationAlgorithm):
     def __init__(self, media: AbstractMediaSync, calibration: ThreephaseCalibrationParams):
         super(ThreePhasePulseBasedAlgorithmBase, self).__init__()
-        self._sample_buffer = np.zeros((2, 0), dtype=np.float32)
+        self._sample_buffer = None
+        # set by advance(): a pulse that continues into the next block, and the number of its samples
+        # already consumed. Rendered by the next generate_audio(), so advance() never renders audio.
+        self._pending_pulse = None
+        self._pending_consumed = 0
         self.media = media
-        self.calibration = calibration
+        self.calibration = ThreePhaseCalibration(calibration)
 
     def channel_count(self) -> int:
         return 2
@@ -46,56 +79,153 @@ class ThreePhasePulseBasedAlgorithmBase(AudioGenerationAlgorithm):
     def next_pulse_data(self, samplerate, at_time: float, at_command_time: float) -> PulseInfo:
         raise NotImplementedError()
 
-    def generate_audio(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
-        while self._sample_buffer.shape[1] < len(steady_clock):
-            i = self._sample_buffer.shape[1]
-            next_pulse = self.next_pulse_data(samplerate, steady_clock[i], system_time_estimate[i])
-            self.add_next_pulse_to_audio_buffer(samplerate, next_pulse)
+    def next_pulse_timing(self, samplerate, at_time: float, at_command_time: float) -> PulseInfo:
+        """
+        Like next_pulse_data(), but only the fields that determine the length of the pulse
+        are required to be valid. Call complete_pulse() or skip_pulse() afterwards.
+        Override together with complete_pulse() and skip_pulse() to speed up advance().
+        """
+        return self.next_pulse_data(samplerate, at_time, at_command_time)
+
+    def complete_pulse(self, samplerate, at_command_time: float, pulse: PulseInfo) -> PulseInfo:
+        """
+        Fill in the remaining fields of a pulse returned by next_pulse_timing().
+        """
+        return pulse
 
-        n = len(steady_clock)
-        L, R = self._sample_buffer[:, :n]
-        self._sample_buffer = self._sample_buffer[:, n:]
+    def skip_pulse(self, samplerate, at_command_time: float, pulse: PulseInfo):
+        """
+        Update the state for a pulse returned by next_pulse_timing() that will never be rendered.
+        """
+        pass
+
+    def buffer_stats(self) -> RingBufferStats | None:
+        if self._sample_buffer is None:
+            return None
+        return self._sample_buffer.stats()
+
+    def generate_audio(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
+        self.fill_sample_buffer(samplerate, steady_clock, system_time_estimate)
+        L, R = self._sample_buffer.read(len(steady_clock))
         return L, R
 
-    def add_next_pulse_to_audio_buffer(self, samplerate, pulse: PulseInfo):
-        pulse_envelope = stim_math.pulse.create_pulse_with_ramp_time(
-            pulse.pulse_length_in_samples(samplerate),
-            pulse.pulse_width_in_carrier_cycles,
-            pulse.rise_time_in_carrier_cycles)
+    def generate_audio_into(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray, out):
+        self.fill_sample_buffer(samplerate, steady_clock, system_time_estimate)
+        self._sample_buffer.read(len(steady_clock), out=out)
 
-        if not self.media.is_playing():
-            # TODO: make more efficient
-            pulse_envelope *= 0
+    def advance(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
+        self.ensure_sample_buffer(samplerate)
 
-        pause = stim_math.pulse.create_pause(pulse.pause_length_in_samples(samplerate))
+        # pulses that are consumed entirely by this block do not have to be computed or rendered,
+        # only the pulse that continues into the next block is completed, and rendered later.
+        n = len(steady_clock)
+        if self._pending_pulse is not None:
+            planned = self._pending_remaining()
+            if planned > n:
+                self._pending_consumed += n
+                return
+            self._pending_pulse = None
+        else:
+            planned = self._sample_buffer.fill_level
+            if planned >= n:
+                self._sample_buffer.discard(n)
+                return
+            self._sample_buffer.clear()
+
+        while planned < n:
+            pulse = self.next_pulse_timing(samplerate, steady_clock[planned], system_time_estimate[planned])
+            length = pulse.total_length_in_samples(samplerate)
+            if planned + length > n:
+                pulse = self.complete_pulse(samplerate, system_time_estimate[planned], pulse)
+                self._pending_pulse = np.array([pulse.to_record(samplerate)], dtype=pulse_dtype)
+                self._pending_consumed = n - planned
+            else:
+                self.skip_pulse(samplerate, system_time_estimate[planned], pulse)
+            planned += length
+
+    def _pending_remaining(self) -> int:
+        pulse = self._pending_pulse[0]
+        return int(pulse['pulse_length'] + pulse['pause_length']) - self._pending_consumed
+
+    def _render_pending_pulse(self, samplerate):
+        if self._pending_pulse is None:
+            return
+        self.render_pulses(samplerate, self._pending_pulse)
+        self._sample_buffer.discard(self._pending_consumed)
+        self._pending_pulse = None
+
+    def ensure_sample_buffer(self, samplerate):
+        if self._sample_buffer is None:
+            # room for the longest pulse + pause (1 Hz pulse frequency with max randomization)
+            # and a large audio block, so the buffer practically never grows.
+            self._sample_buffer = SampleRingBuffer(int(samplerate * 3), self.channel_count())
+
+    def fill_sample_buffer(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray):
+        self.ensure_sample_buffer(samplerate)
+        self._render_pending_pulse(samplerate)
+        pulses = self.plan_pulses(samplerate, steady_clock, system_time_estimate)
+        self.render_pulses(samplerate, pulses)
+
+    def plan_pulses(self, samplerate, steady_clock: np.ndarray, system_time_estimate: np.ndarray) -> np.ndarray:
+        """
+        Determine all pulses required to fill the sample buffer up to len(steady_clock) samples.
+        :return: structured array of dtype pulse_dtype
+        """
+        records = []
+        planned = self._sample_buffer.fill_level
+        while planned < len(steady_clock):
+            pulse = self.next_pulse_data(samplerate, steady_clock[planned], system_time_estimate[planned])
+            records.append(pulse.to_record(samplerate))
+            planned += pulse.total_length_in_samples(samplerate)
+        return np.array(records, dtype=pulse_dtype)
+
+    def render_pulses(self, samplerate, pulses: np.ndarray):
+        """
+        Render all planned pulses in one vectorized pass and append them to the sample buffer.
+        """
+        if len(pulses) == 0:
+            return
+
+        pulse_lengths = pulses['pulse_length']
+        total_lengths = pulse_lengths + pulses['pause_length']
+
+        pulse_envelope = stim_math.pulse.create_pulse_train_with_ramp_time(
+            pulse_lengths,
+            pulses['pulse_width_in_carrier_cycles'],
+            pulses['rise_time_in_carrier_cycles'])
+
+        # concatenated phase ramps, each pulse goes from start_angle to
+        # start_angle +- (2 * pi * pulse_width) inclusive
+        pulse_starts = np.cumsum(pulse_lengths) - pulse_lengths
+        local_index = np.arange(len(pulse_envelope)) - np.repeat(pulse_starts, pulse_lengths)
+        step = 2 * np.pi * pulses['pulse_width_in_carrier_cycles'] / np.maximum(pulse_lengths - 1, 1) * pulses['polarity']
+        theta = np.repeat(pulses['start_angle'], pulse_lengths) + local_index * np.repeat(step, pulse_lengths)
 
-        theta = pulse.start_angle + np.linspace(0, 2 * np.pi * pulse.pulse_width_in_carrier_cycles,
-                                                len(pulse_envelope)) * pulse.polarity
         L, R = threephase.ThreePhaseSignalGenerator.generate(
-            theta, np.full_like(theta, pulse.position[0]), np.full_like(theta, pulse.position[1]))
+            theta, np.repeat(pulses['alpha'], pulse_lengths), np.repeat(pulses['beta'], pulse_lengths))
 
-        # L[:] = 1
-        # R[:] = 1
-        # pulse_envelope[:] = 1
+        self.calibration.update()
 
         # center scaling
-        center_calib = stim_math.threephase.ThreePhaseCenterCalibration(self.calibration.center.last_value())
-        pulse_envelope *= center_calib.get_scale(pulse.position[0], pulse.position[1])
+        gain = self.calibration.get_center_scale(pulses['alpha'], pulses['beta']) * pulses['volume']
+
+        if not self.media.is_playing():
+            gain *= 0
 
         # hardware calibration
-        hw = threephase.ThreePhaseHardwareCalibration(self.calibration.neutral.last_value(),
-                                                      self.calibration.right.last_value())
-        L, R = hw.apply_transform(L, R)
+        L, R = self.calibration.apply_transform(L, R)
 
-        pulse_envelope *= pulse.volume
+        pulse_envelope *= np.repeat(gain, pulse_lengths)
         L *= pulse_envelope
         R *= pulse_envelope
 
-        new_data = np.vstack((
-            np.hstack((L, pause)),
-            np.hstack((R, pause)),
-        ))
-        self._sample_buffer = np.hstack((self._sample_buffer, new_data))
+        # scatter the pulses into a block of silence
+        block = np.zeros((2, np.sum(total_lengths)), dtype=np.float32)
+        offsets = np.cumsum(total_lengths) - total_lengths
+        destination = local_index + np.repeat(offsets, pulse_lengths)
+        block[0, destination] = L
+        block[1, destination] = R
+        self._sample_buffer.write(block[0], block[1])
 
 
 class DefaultThreePhasePulseBasedAlgorithm(ThreePhasePulseBasedAlgorithmBase):
@@ -110,44 +240,52 @@ class DefaultThreePhasePulseBasedAlgorithm(ThreePhasePulseBasedAlgorithmBase):
         self.last_pulse_start_angle = 0
 
     def next_pulse_data(self, samplerate, at_time: float, system_time_estimate: float) -> PulseInfo:
-        self.seq += 1
+        pulse = self.next_pulse_timing(samplerate, at_time, system_time_estimate)
+        return self.complete_pulse(samplerate, system_time_estimate, pulse)
 
-        volume = \
-            np.clip(self.params.volume.master.last_value(), 0, 1) * \
-            np.clip(self.params.volume.api.interpolate(system_time_estimate), 0, 1) * \
-            np.clip(self.params.volume.inactivity.last_value(), 0, 1) * \
-            np.clip(self.params.volume.external.last_value(), 0, 1)
+    def next_pulse_timing(self, samplerate, at_time: float, system_time_estimate: float) -> PulseInfo:
+        self.seq += 1
 
         pulse_carrier_freq = self.params.carrier_frequency.interpolate(system_time_estimate)
-        pulse_carrier_freq = np.clip(pulse_carrier_freq,
-                                     self.safety_limits.minimum_carrier_frequency,
-                                     self.safety_limits.maximum_carrier_frequency)
+        pulse_carrier_freq = limits.clamp(pulse_carrier_freq,
+                                          self.safety_limits.minimum_carrier_frequency,
+                                          self.safety_limits.maximum_carrier_frequency)
         pulse_width = self.params.pulse_width.interpolate(system_time_estimate)
-        pulse_width = np.clip(pulse_width, limits.PulseWidth.min, limits.PulseWidth.max)
+        pulse_width = limits.clamp(pulse_width, limits.PulseWidth.min, limits.PulseWidth.max)
         pulse_freq = self.params.pulse_frequency.interpolate(system_time_estimate)
-        pulse_freq = np.clip(pulse_freq, limits.PulseFrequency.min, limits.PulseFrequency.max)
-        pulse_rise_time = self.params.pulse_rise_time.interpolate(system_time_estimate)
-        pulse_rise_time = np.clip(pulse_rise_time, limits.PulseRiseTime.min, limits.PulseRiseTime.max)
+        pulse_freq = limits.clamp(pulse_freq, limits.PulseFrequency.min, limits.PulseFrequency.max)
 
-        pause_duration = np.clip(1 / pulse_freq - pulse_width / pulse_carrier_freq, 0, None)
+        pause_duration = max(1 / pulse_freq - pulse_width / pulse_carrier_freq, 0)
 
         random = self.params.pulse_interval_random.interpolate(system_time_estimate)
         pause_duration = pause_duration * np.random.uniform(1 - random, 1 + random)
 
-        alpha, beta = self.position_params.get_position(system_time_estimate)
-
-        pulse = PulseInfo(
+        return PulseInfo(
             self.polarity(),
             self.phase_offset(),
             pulse_carrier_freq,
             pulse_width,
-            pulse_rise_time,
-            (alpha, beta),
+            0,
+            (0, 0),
             pause_duration,
-            volume,
+            0,
         )
-        pulse = self.apply_vibration(system_time_estimate, samplerate, pulse)
-        return pulse
+
+    def complete_pulse(self, samplerate, system_time_estimate: float, pulse: PulseInfo) -> PulseInfo:
+        pulse.volume = \
+            limits.clamp(self.params.volume.master.last_value(), 0, 1) * \
+            limits.clamp(self.params.volume.api.interpolate(system_time_estimate), 0, 1) * \
+            limits.clamp(self.params.volume.inactivity.last_value(), 0, 1) * \
+            limits.clamp(self.params.volume.external.last_value(), 0, 1)
+
+        pulse_rise_time = self.params.pulse_rise_time.interpolate(system_time_estimate)
+        pulse.rise_time_in_carrier_cycles = limits.clamp(pulse_rise_time, limits.PulseRiseTime.min, limits.PulseRiseTime.max)
+
+        pulse.position = self.position_params.get_position(system_time_estimate)
+        return self.apply_vibration(system_time_estimate, samplerate, pulse)
+
+    def skip_pulse(self, samplerate, system_time_estimate: float, pulse: PulseInfo):
+        self.vibration.advance(system_time_estimate, samplerate, pulse.total_length_in_samples(samplerate))
 
     def apply_vibration(self, at_command_time, samplerate, pulse: PulseInfo) -> PulseInfo:
         pulse.volume *= self.vibration.generate_vibration_float(at_command_time, samplerate, pulse.total_length_in_samples(samplerate))
@@ -197,24 +335,24 @@ class ABTestThreePhasePulseBasedAlgorithm(ThreePhasePulseBasedAlgorithmBase):
                 self.callback(True)
 
         volume = \
-            np.clip(self.params.volume.master.last_value(), 0, 1) * \
-            np.clip(self.params.volume.api.interpolate(system_time_estimate), 0, 1) * \
-            np.clip(self.params.volume.inactivity.last_value(), 0, 1) * \
-            np.clip(self.ab_volume(system_time_estimate), 0, 1) * \
-            np.clip(self.params.volume.external.last_value(), 0, 1)
+            limits.clamp(self.params.volume.master.last_value(), 0, 1) * \
+            limits.clamp(self.params.volume.api.interpolate(system_time_estimate), 0, 1) * \
+            limits.clamp(self.params.volume.inactivity.last_value(), 0, 1) * \
+            limits.clamp(self.ab_volume(system_time_estimate), 0, 1) * \
+            limits.clamp(self.params.volume.external.last_value(), 0, 1)
 
         pulse_carrier_freq = self.carrier_frequency(system_time_estimate)
-        pulse_carrier_freq = np.clip(pulse_carrier_freq,
-                                     self.safety_limits.minimum_carrier_frequency,
-                                     self.safety_limits.maximum_carrier_frequency)
+        pulse_carrier_freq = limits.clamp(pulse_carrier_freq,
+                                          self.safety_limits.minimum_carrier_frequency,
+                                          self.safety_limits.maximum_carrier_frequency)
         pulse_width = self.pulse_width(system_time_estimate)
-        pulse_width = np.clip(pulse_width, limits.PulseWidth.min, limits.PulseWidth.max)
+        pulse_width = limits.clamp(pulse_width, limits.PulseWidth.min, limits.PulseWidth.max)
         pulse_freq = self.pulse_frequency(system_time_estimate)
-        pulse_freq = np.clip(pulse_freq, limits.PulseFrequency.min, limits.PulseFrequency.max)
+        pulse_freq = limits.clamp(pulse_freq, limits.PulseFrequency.min, limits.PulseFrequency.max)
         pulse_rise_time = self.pulse_rise_time(system_time_estimate)
-        pulse_rise_time = np.clip(pulse_rise_time, limits.PulseRiseTime.min, limits.PulseRiseTime.max)
+        pulse_rise_time = limits.clamp(pulse_rise_time, limits.PulseRiseTime.min, limits.PulseRiseTime.max)
 
-        pause_duration = np.clip(1 / pulse_freq - pulse_width / pulse_carrier_freq, 0, None)
+        pause_duration = max(1 / pulse_freq - pulse_width / pulse_carrier_freq, 0)
 
         random = self.pulse_interval_random(system_time_estimate)
         pause_duration = pause_duration * np.random.uniform(1 - random, 1 + random)
@@ -0,0 +1,162 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class RingBufferStats:
+    capacity: int           # samples per channel
+    fill_level: int         # samples currently buffered
+    peak_fill_level: int    # highest fill level since the last reset
+    reallocations: int      # number of times the buffer had to grow
+
+    @property
+    def headroom(self) -> int:
+        return self.capacity - self.peak_fill_level
+
+
+class SampleRingBuffer:
+    """
+    Fixed-capacity multichannel float32 ring buffer.
+
+    Samples are written into preallocated storage and read out without reallocating.
+    If a write does not fit, the storage is grown (doubled). This should only happen
+    with extreme settings, and is counted in the stats.
+    """
+    def __init__(self, capacity: int, channels: int = 2):
+        self._data = np.zeros((channels, max(1, int(capacity))), dtype=np.float32)
+        self._head = 0  # read position
+        self._size = 0  # number of buffered samples
+        self._peak_size = 0
+        self._reallocations = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._data.shape[1]
+
+    @property
+    def channels(self) -> int:
+        return self._data.shape[0]
+
+    @property
+    def fill_level(self) -> int:
+        return self._size
+
+    def __len__(self):
+        return self._size
+
+    def stats(self) -> RingBufferStats:
+        return RingBufferStats(self.capacity, self._size, self._peak_size, self._reallocations)
+
+    def reset_stats(self):
+        self._peak_size = self._size
+        self._reallocations = 0
+
+    def __getstate__(self):
+        # only the buffered samples, checkpoints are taken often and the capacity is mostly empty
+        state = self.__dict__.copy()
+        data = np.empty((self.channels, self._size), dtype=np.float32)
+        self._copy_out(data, self._size)
+        state['_data'] = data
+        state['_capacity'] = self.capacity
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        capacity = state.pop('_capacity')
+        buffered = state['_data']
+        state['_data'] = np.zeros((buffered.shape[0], capacity), dtype=np.float32)
+        state['_data'][:, :buffered.shape[1]] = buffered
+        state['_head'] = 0
+        self.__dict__.update(state)
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+    def truncate(self, n: int):
+        """
+        Keep only the oldest n samples, discard the rest.
+        """
+        self._size = min(self._size, n)
+
+    def reserve(self, n: int):
+        """
+        Ensure there is room for n more samples.
+        """
+        required = self._size + n
+        if required <= self.capacity:
+            return
+        new_capacity = self.capacity
+        while new_capacity < required:
+            new_capacity *= 2
+        data = np.zeros((self.channels, new_capacity), dtype=np.float32)
+        self._copy_out(data, self._size)
+        self._data = data
+        self._head = 0
+        self._reallocations += 1
+
+    def _segments(self, start: int, n: int):
+        # split a (possibly wrapping) range into at most two contiguous segments
+        start = start % self.capacity
+        first = min(n, self.capacity - start)
+        return (start, first), (0, n - first)
+
+    def _copy_out(self, out, n: int):
+        (a, a_len), (b, b_len) = self._segments(self._head, n)
+        for dst, src in zip(out, self._data):
+            dst[:a_len] = src[a:a + a_len]
+            if b_len:
+                dst[a_len:a_len + b_len] = src[b:b + b_len]
+
+    def _written(self, n: int):
+        self._size += n
+        self._peak_size = max(self._peak_size, self._size)
+
+    def write(self, *channel_data):
+        """
+        Append one array per channel. All arrays must have the same length.
+        """
+        assert len(channel_data) == self.channels
+        n = len(channel_data[0])
+        self.reserve(n)
+        (a, a_len), (b, b_len) = self._segments(self._head + self._size, n)
+        for row, samples in zip(self._data, channel_data):
+            row[a:a + a_len] = samples[:a_len]
+            if b_len:
+                row[b:b + b_len] = samples[a_len:]
+        self._written(n)
+
+    def write_silence(self, n: int):
+        """
+        Append n samples of silence on all channels.
+        """
+        self.reserve(n)
+        (a, a_len), (b, b_len) = self._segments(self._head + self._size, n)
+        self._data[:, a:a + a_len] = 0
+        if b_len:
+            self._data[:, b:b + b_len] = 0
+        self._written(n)
+
+    def discard(self, n: int):
+        """
+        Remove n samples from the buffer without copying them.
+        """
+        assert n <= self._size
+        self._head = (self._head + n) % self.capacity
+        self._size -= n
+
+    def read(self, n: int, out=None):
+        """
+        Remove n samples from the buffer.
+        :param out: optional array of shape (channels, n), or sequence of one array per channel,
+            to copy the samples into
+        :return: out, or a new array of shape (channels, n)
+        """
+        assert n <= self._size
+        if out is None:
+            out = np.empty((self.channels, n), dtype=np.float32)
+        self._copy_out(out, n)
+        self._head = (self._head + n) % self.capacity
+        self._size -= n
+        return out
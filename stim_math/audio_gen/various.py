@@ -1,20 +1,27 @@
+import math
+
 import numpy as np
 
-from stim_math import limits, amplitude_modulation, trig
+from stim_math import limits, amplitude_modulation
+from stim_math.axis import latest_version
+from stim_math.axis_bundle import axis_fields
+from stim_math.threephase import ThreePhaseHardwareCalibration, ThreePhaseCenterCalibration
 from stim_math.sine_generator import AngleGeneratorWithVaryingIPI
 from stim_math.threephase_coordinate_transform import ThreePhaseCoordinateTransform, \
     ThreePhaseCoordinateTransformMapToEdge
 
 from stim_math.audio_gen.params import VibrationParams, ThreephasePositionParams, ThreephasePositionTransformParams, \
-    FourphaseIntensityParams
+    FourphaseIntensityParams, ThreephaseCalibrationParams
 
 
 class VibrationAlgorithm:
     def __init__(self, vib_1: VibrationParams, vib_2: VibrationParams):
         self.vib_1 = vib_1
         self.vibration_1_angle = AngleGeneratorWithVaryingIPI()
+        self.vibration_1_wavetable = amplitude_modulation.ModulationWavetableSlot()
         self.vib_2 = vib_2
         self.vibration_2_angle = AngleGeneratorWithVaryingIPI()
+        self.vibration_2_wavetable = amplitude_modulation.ModulationWavetableSlot()
 
     def generate_vibration_signal(self, command_timeline, samplerate, n_samples: int):
         volume = 1
@@ -22,25 +29,64 @@ class VibrationAlgorithm:
         volume *= self._calculate_modulation(
             command_timeline,
             samplerate, n_samples,
-            self.vib_1, self.vibration_1_angle,
+            self.vib_1, self.vibration_1_angle, self.vibration_1_wavetable,
         )
 
         volume *= self._calculate_modulation(
             command_timeline,
             samplerate, n_samples,
-            self.vib_2, self.vibration_2_angle,
+            self.vib_2, self.vibration_2_angle, self.vibration_2_wavetable,
         )
 
         return volume
 
     def generate_vibration_float(self, command_timeline, samplerate, n_samples):
-        volume = self.generate_vibration_signal(command_timeline, samplerate, n_samples)
-        try:
-            return volume[0]
-        except TypeError:
-            return volume
+        """
+        Vibration at the start of the next n_samples. Advances the vibration phase by n_samples,
+        but only evaluates the first sample.
+        """
+        volume = 1.0
+
+        volume *= self._calculate_modulation(
+            command_timeline,
+            samplerate, n_samples,
+            self.vib_1, self.vibration_1_angle, self.vibration_1_wavetable,
+            scalar=True,
+        )
 
-    def _calculate_modulation(self, command_timeline, samplerate, n_samples, params: VibrationParams, angle_generator):
+        volume *= self._calculate_modulation(
+            command_timeline,
+            samplerate, n_samples,
+            self.vib_2, self.vibration_2_angle, self.vibration_2_wavetable,
+            scalar=True,
+        )
+
+        return volume
+
+    def advance(self, command_timeline, samplerate, n_samples):
+        """
+        Advance the vibration phase by n_samples, like generate_vibration_float()
+        but without evaluating the vibration.
+        """
+        for params, angle_generator, wavetable in ((self.vib_1, self.vibration_1_angle, self.vibration_1_wavetable),
+                                                   (self.vib_2, self.vibration_2_angle, self.vibration_2_wavetable)):
+            modulation_frequency = params.frequency.interpolate(command_timeline)
+            if not params.enabled.last_value() or modulation_frequency == 0:
+                continue
+            modulation_frequency = limits.clamp(modulation_frequency,
+                                                limits.ModulationFrequency.min,
+                                                limits.ModulationFrequency.max)
+            angle_generator.skip(n_samples, modulation_frequency, samplerate)
+            # the wavetable choice of the next evaluation depends on these parameters
+            strength, l_r, h_l = amplitude_modulation.envelope_parameters(
+                params.strength.interpolate(command_timeline),
+                params.left_right_bias.interpolate(command_timeline),
+                params.high_low_bias.interpolate(command_timeline),
+            )
+            wavetable.update(float(strength), float(l_r), float(h_l))
+
+    def _calculate_modulation(self, command_timeline, samplerate, n_samples, params: VibrationParams, angle_generator,
+                              wavetable: amplitude_modulation.ModulationWavetableSlot, scalar=False):
         is_enabled = params.enabled.last_value()
         modulation_frequency = params.frequency.interpolate(command_timeline)
         modulation_strength = params.strength.interpolate(command_timeline)
@@ -51,68 +97,232 @@ class VibrationAlgorithm:
         if not is_enabled or modulation_frequency == 0:
             return 1
 
-        modulation_frequency = np.clip(modulation_frequency,
-                                       limits.ModulationFrequency.min,
-                                       limits.ModulationFrequency.max)
-        theta = angle_generator.generate(n_samples, modulation_frequency, samplerate, modulation_random)
+        modulation_frequency = limits.clamp(modulation_frequency,
+                                            limits.ModulationFrequency.min,
+                                            limits.ModulationFrequency.max)
+        if scalar:
+            theta = angle_generator.advance(n_samples, modulation_frequency, samplerate, modulation_random)
+        else:
+            theta = angle_generator.generate(n_samples, modulation_frequency, samplerate, modulation_random)
         modulation = amplitude_modulation.SineModulation(
             theta,
             modulation_strength,
             modulation_left_right_bias,
             modulation_high_low_bias,
         )
-        return modulation.get_modulation_signal()
+        return modulation.get_modulation_signal(wavetable)
+
+
+class CompiledPositionTransform:
+    """
+    The position transform (normalize, affine transform, normalize, map to edge)
+    for one set of transform parameters. The matrices are computed once.
+
+    apply() works in-place on float64 arrays, and does not allocate temporaries
+    if called repeatedly with the same array length. Other inputs, like a scalar
+    combined with an array, are copied first.
+    """
+    def __init__(self, transform_enabled, rotation, mirror, top, bottom, left, right,
+                 map_to_edge_enabled, map_to_edge_start, map_to_edge_length, map_to_edge_invert):
+        self.affine = None
+        if transform_enabled:
+            m = ThreePhaseCoordinateTransform(rotation, mirror, top, bottom, left, right).matrix
+            self.affine = tuple(float(x) for x in m[:2].flat)
+
+        self.map_to_edge = None
+        if map_to_edge_enabled:
+            transform = ThreePhaseCoordinateTransformMapToEdge(map_to_edge_start, map_to_edge_length, map_to_edge_invert)
+            # angle in radians as a linear function of alpha
+            half_range = 0.5 * (transform.end - transform.start)
+            self.map_to_edge = (float(-np.deg2rad(transform.start + half_range)), float(np.deg2rad(half_range)))
+
+        self._scratch = (np.empty(0), np.empty(0))
+
+    def apply(self, alpha, beta):
+        if np.ndim(alpha) == 0 and np.ndim(beta) == 0:
+            return self._apply_scalar(float(alpha), float(beta))
+
+        shape = np.broadcast_shapes(np.shape(alpha), np.shape(beta))
+        alpha = self._writeable_input(alpha, shape)
+        beta = self._writeable_input(beta, shape)
+        if np.may_share_memory(alpha, beta):
+            beta = beta.copy()
+        if len(self._scratch[0]) != alpha.size:
+            self._scratch = (np.empty(alpha.size), np.empty(alpha.size))
+        s1, s2 = (s.reshape(alpha.shape) for s in self._scratch)
+
+        self._normalize(alpha, beta, s1, s2)
+        if self.affine is not None:
+            a11, a12, a13, a21, a22, a23 = self.affine
+            np.multiply(beta, a12, out=s1)
+            s1 += a13
+            np.multiply(alpha, a21, out=s2)
+            alpha *= a11
+            alpha += s1
+            beta *= a22
+            beta += s2
+            beta += a23
+            self._normalize(alpha, beta, s1, s2)
+        if self.map_to_edge is not None:
+            # result is on the unit circle, no need to normalize
+            offset, scale = self.map_to_edge
+            np.multiply(alpha, scale, out=s1)
+            s1 += offset
+            np.cos(s1, out=alpha)
+            np.sin(s1, out=beta)
+        return alpha, beta
+
+    @staticmethod
+    def _writeable_input(x, shape):
+        """
+        x if it can be modified in-place, otherwise a float64 copy with the given shape.
+        Broadcast views are never modified, all their elements share memory.
+        """
+        if isinstance(x, np.ndarray) and x.dtype == np.float64 and x.shape == shape and x.flags.writeable \
+                and (x.size <= 1 or 0 not in x.strides):
+            return x
+        return np.array(np.broadcast_to(x, shape), dtype=np.float64)
+
+    @staticmethod
+    def _normalize(alpha, beta, norm, scratch):
+        # np.hypot is slow, compute the norm manually
+        np.multiply(alpha, alpha, out=norm)
+        np.multiply(beta, beta, out=scratch)
+        norm += scratch
+        np.sqrt(norm, out=norm)
+        np.maximum(norm, 1.0, out=norm)
+        alpha /= norm
+        beta /= norm
+
+    def _apply_scalar(self, alpha: float, beta: float):
+        norm = max(math.hypot(alpha, beta), 1.0)
+        alpha, beta = alpha / norm, beta / norm
+        if self.affine is not None:
+            a11, a12, a13, a21, a22, a23 = self.affine
+            alpha, beta = a11 * alpha + a12 * beta + a13, a21 * alpha + a22 * beta + a23
+            norm = max(math.hypot(alpha, beta), 1.0)
+            alpha, beta = alpha / norm, beta / norm
+        if self.map_to_edge is not None:
+            offset, scale = self.map_to_edge
+            angle = offset + scale * alpha
+            alpha, beta = math.cos(angle), math.sin(angle)
+        return alpha, beta
 
 
 class ThreePhasePosition:
     def __init__(self, position: ThreephasePositionParams, transform: ThreephasePositionTransformParams):
         self.position_params = position
         self.transform_params = transform
+        self._transform_axes = [axis for _, axis in axis_fields(transform)]
+        self._version = None
+        self._key = None
+        self._compiled: CompiledPositionTransform = None
 
     def get_position(self, command_timeline):
         alpha = self.position_params.alpha.interpolate(command_timeline)
         beta = self.position_params.beta.interpolate(command_timeline)
         return self.transform_position(alpha, beta)
 
+    def compiled_transform(self) -> CompiledPositionTransform:
+        """
+        The transform for the current value of the transform axes.
+        Only recomputed when one of the values changes.
+        """
+        version = latest_version(self._transform_axes)
+        if version == self._version:
+            return self._compiled
+        self._version = version
+
+        params = self.transform_params
+        key = (
+            params.transform_enabled.last_value(),
+            params.transform_rotation_degrees.last_value(),
+            params.transform_mirror.last_value(),
+            params.transform_top_limit.last_value(),
+            params.transform_bottom_limit.last_value(),
+            params.transform_left_limit.last_value(),
+            params.transform_right_limit.last_value(),
+            params.map_to_edge_enabled.last_value(),
+            params.map_to_edge_start.last_value(),
+            params.map_to_edge_length.last_value(),
+            params.map_to_edge_invert.last_value(),
+        )
+        if key != self._key:
+            self._key = key
+            self._compiled = CompiledPositionTransform(*key)
+        return self._compiled
+
     def transform_position(self, alpha, beta):
+        """
+        Normalize (alpha, beta) to be within the unit circle, then apply the
+        coordinate transform and map-to-edge transform, if enabled.
+        Arrays are modified in-place.
+        """
+        return self.compiled_transform().apply(alpha, beta)
 
-        # normalize (alpha, beta) to be within the unit circle.
-        norm = np.clip(trig.norm(alpha, beta), 1.0, None)
-        alpha /= norm
-        beta /= norm
 
-        # # mobius transform...
-        # z = alpha + beta * 1j
-        # a = self.params.focus_alpha.last_value() + self.params.focus_beta.last_value() * 1j
-        # z = (z - a) / (1 - np.conj(a) * z)
-        # alpha = z.real
-        # beta = z.imag
-
-        if self.transform_params.transform_enabled.last_value():
-            transform = ThreePhaseCoordinateTransform(
-                self.transform_params.transform_rotation_degrees.last_value(),
-                self.transform_params.transform_mirror.last_value(),
-                self.transform_params.transform_top_limit.last_value(),
-                self.transform_params.transform_bottom_limit.last_value(),
-                self.transform_params.transform_left_limit.last_value(),
-                self.transform_params.transform_right_limit.last_value(),
-            )
-            alpha, beta = transform.transform(alpha, beta)
-            norm = np.clip(trig.norm(alpha, beta), 1.0, None)
-            alpha /= norm
-            beta /= norm
-        if self.transform_params.map_to_edge_enabled.last_value():
-            transform = ThreePhaseCoordinateTransformMapToEdge(
-                self.transform_params.map_to_edge_start.last_value(),
-                self.transform_params.map_to_edge_length.last_value(),
-                self.transform_params.map_to_edge_invert.last_value(),
-            )
-            alpha, beta = transform.transform(alpha, beta)
-            norm = np.clip(trig.norm(alpha, beta), 1.0, None)
-            alpha /= norm
-            beta /= norm
+class ThreePhaseCalibration:
+    """
+    Hardware and center calibration driven by the calibration axes.
+
+    The corrective matrix is only recomputed when the value of one of the
+    calibration axes changes. Call update() before use.
+    """
+    def __init__(self, calibrate: ThreephaseCalibrationParams):
+        self.calibrate_params = calibrate
+        self.version = 0    # incremented every time the calibration changes
+        self._axes = [axis for _, axis in axis_fields(calibrate)]
+        self._axes_version = None
+        self._key = None
+
+        self.hardware: ThreePhaseHardwareCalibration = None
+        self.center: ThreePhaseCenterCalibration = None
+        self.transform_in_ab = None
+        self._m11 = self._m12 = self._m21 = self._m22 = None
+        self._scratch = np.empty(0, dtype=np.float32)
+
+    def update(self):
+        axes_version = latest_version(self._axes)
+        if axes_version == self._axes_version:
+            return
+        self._axes_version = axes_version
+
+        key = (self.calibrate_params.neutral.last_value(),
+               self.calibrate_params.right.last_value(),
+               self.calibrate_params.center.last_value())
+        if key == self._key:
+            return
+        self._key = key
+        neutral, right, center = key
+        self.hardware = ThreePhaseHardwareCalibration(neutral, right)
+        self.center = ThreePhaseCenterCalibration(center)
+        self.transform_in_ab = self.hardware.generate_transform_in_ab()
+        m = self.hardware.corrective_matrix()
+        # python floats, so float32 audio is not promoted to float64
+        self._m11, self._m12, self._m21, self._m22 = (float(x) for x in m.flat)
+        self.version += 1
+
+    def apply_transform(self, L, R):
+        return self._m11 * L + self._m12 * R, self._m21 * L + self._m22 * R
+
+    def apply_transform_into(self, L, R, out_L, out_R):
+        """
+        Like apply_transform(), but writes the result into out_L and out_R.
+        The outputs must not overlap with the inputs.
+        """
+        if len(self._scratch) < len(L):
+            self._scratch = np.empty(len(L), dtype=np.float32)
+        scratch = self._scratch[:len(L)]
+        np.multiply(L, self._m11, out=out_L)
+        np.multiply(R, self._m12, out=scratch)
+        out_L += scratch
+        np.multiply(L, self._m21, out=out_R)
+        np.multiply(R, self._m22, out=scratch)
+        out_R += scratch
+
+    def get_center_scale(self, alpha, beta):
+        return self.center.get_scale(alpha, beta)
 
-        return alpha, beta
 
 class FourPhaseIntensity:
     def __init__(self, position: FourphaseIntensityParams):
@@ -1,10 +1,27 @@
 from abc import ABC, abstractmethod
+import itertools
 import time
 import numpy as np
 import collections.abc
 
 
+# shared by all axes, so a version is never reused by another axis
+_versions = itertools.count(1)
+
+
+def next_version() -> int:
+    return next(_versions)
+
+
 class AbstractAxis(ABC):
+    """
+    version is bumped on every add() that may change the axis, to a value larger than any
+    version handed out before. Consumers that derive something from last_value() can remember
+    latest_version() of their axes, and skip the work if it did not change.
+    The interpolated value of an axis can still change over time without add().
+    """
+    version = 0
+
     @abstractmethod
     def interpolate(self, timestamp):
         pass
@@ -56,18 +73,37 @@ class Timeline:
 # series of X, Y values, intended for realtime updates.
 # Old data is regularly removed
 class ShortMemoryTimeline:
-    def __init__(self, init_value, dtype=None, trim_min_size=10, trim_min_age=5, cleanup_interval=100):
-        self.data = np.array([[0, init_value]], dtype=dtype)
+    """
+    The points live in preallocated arrays, between the head and tail index.
+    Adding truncates future points and appends in place, old points are trimmed by moving
+    the head. The live points are only moved when the tail reaches the end of the arrays,
+    so add() is amortized O(1).
+
+    Moved points are copied into new arrays, so a view returned by x() or y()
+    is never modified except for the future points at its end.
+    """
+    def __init__(self, init_value, dtype=None, trim_min_size=10, trim_min_age=5, cleanup_interval=100,
+                 capacity=64):
+        dtype = dtype or np.float64
+        self._x = np.empty(capacity, dtype=dtype)
+        self._y = np.empty(capacity, dtype=dtype)
+        self._x[0] = 0
+        self._y[0] = init_value
+        self.head = 0
+        self.tail = 1
         self.trim_min_size = trim_min_size
         self.trim_min_age = trim_min_age
         self.nonce = 0
         self.cleanup_interval = cleanup_interval
 
     def x(self):
-        return self.data[:, 0]
+        return self._x[self.head:self.tail]
 
     def y(self):
-        return self.data[:, 1]
+        return self._y[self.head:self.tail]
+
+    def __len__(self):
+        return self.tail - self.head
 
     def add(self, value, interval=0.0):
         assert interval >= 0
@@ -75,31 +111,54 @@ class ShortMemoryTimeline:
         begin_ts = time.time()
         end_ts = begin_ts + interval
 
-        begin_index = np.searchsorted(self.data[:, 0], begin_ts)
-        end_index = np.searchsorted(self.data[:, 0], end_ts)
-        current_value = np.interp(begin_ts, self.x(), self.y())
+        x = self.x()
+        begin_index = np.searchsorted(x, begin_ts)
+        end_index = np.searchsorted(x, end_ts)
 
         if begin_index == 0:
             # insert at very beginning, must be a bug?
-            self.data = np.array([[end_ts, value]], dtype=self.data.dtype)
+            self.tail = self.head
+            self._append(end_ts, value)
         elif begin_index == end_index:
             # strip away future data, add linear segment at end
             # to avoid changing current data
-            self.data = np.vstack((self.data[:end_index],
-                                   [[begin_ts, current_value],
-                                    [end_ts, value]]))
+            segment = slice(begin_index - 1, begin_index + 1)
+            current_value = np.interp(begin_ts, x[segment], self.y()[segment])
+            self.tail = self.head + end_index
+            self._append(begin_ts, current_value)
+            self._append(end_ts, value)
         else:
             # strip away future data, add single data point at end
-            self.data = np.vstack((self.data[:end_index], [[end_ts, value]]))
+            self.tail = self.head + end_index
+            self._append(end_ts, value)
 
         self.cleanup_if_needed()
 
+    def _append(self, x, y):
+        if self.tail == len(self._x):
+            self._reallocate()
+        self._x[self.tail] = x
+        self._y[self.tail] = y
+        self.tail += 1
+
+    def _reallocate(self):
+        # double the capacity when more than half full, otherwise only drop the trimmed points
+        size = self.tail - self.head
+        capacity = len(self._x) * 2 if size * 2 > len(self._x) else len(self._x)
+        new_x = np.empty(capacity, dtype=self._x.dtype)
+        new_y = np.empty(capacity, dtype=self._y.dtype)
+        new_x[:size] = self.x()
+        new_y[:size] = self.y()
+        self._x, self._y = new_x, new_y
+        self.head = 0
+        self.tail = size
+
     def cleanup_if_needed(self):
         self.nonce += 1
         if self.nonce >= self.cleanup_interval:
-            if self.data.shape[0] > self.trim_min_size and self.data[0][0] < (time.time() - self.trim_min_age):
+            if len(self) > self.trim_min_size and self._x[self.head] < (time.time() - self.trim_min_age):
                 cutoff = time.time() - self.trim_min_age
-                self.data = self.data[self.data[:, 0] > cutoff]
+                self.head += np.searchsorted(self.x(), cutoff, side='right')
 
 
 class Interpolator(ABC):
@@ -108,15 +167,137 @@ class Interpolator(ABC):
         pass
 
 
+def search_forward(x, start: int, t) -> int:
+    """
+    searchsorted(x, t, side='right') - 1, for x[start] <= t. Searches windows of growing size
+    after start, so only the part of x up to t is read, and converted if x is not float64.
+    """
+    for window in (16, 256, 4096):
+        end = start + window
+        if end >= len(x) or t < x[end - 1]:
+            return start + int(np.searchsorted(x[start:end], t, side='right')) - 1
+        start = end - 1
+    return start + int(np.searchsorted(x[start:], t, side='right')) - 1
+
+
+class SegmentCursor:
+    """
+    Finds the segment x[i] <= t < x[i + 1] of a sorted array, starting at the segment found by
+    the previous query. Audio blocks and device updates query slightly later timestamps every
+    time, those are found in the same segment or a few segments further. Queries before the
+    previous one (seeks) fall back to binary search over the whole array.
+
+    The index is only a hint, any value gives correct results. So the cursor can be shared
+    between threads, and the array may change between queries.
+    """
+    def __init__(self):
+        self.index = 0
+
+    def find(self, x, t) -> int:
+        """
+        :return: searchsorted(x, t, side='right') - 1. -1 if t < x[0].
+        """
+        n = len(x)
+        i = self.index
+        if 0 <= i < n and x[i] <= t:
+            if i + 1 == n or t < x[i + 1]:
+                return i
+            i = search_forward(x, i + 1, t)
+        else:
+            i = int(np.searchsorted(x, t, side='right')) - 1
+        self.index = max(i, 0)
+        return i
+
+    def find_range(self, x, t_min, t_max) -> slice:
+        """
+        :return: the smallest slice of x that contains the segments of all timestamps in [t_min, t_max],
+            and the points at its edges needed to search and interpolate them.
+        """
+        first = max(self.find(x, t_min), 0)
+        last = search_forward(x, first, t_max) if x[first] <= t_max else first - 1
+        self.index = max(last, 0)
+        return slice(first, min(last + 2, len(x)))
+
+
+def is_native(x, y) -> bool:
+    """
+    True if np.interp can use x, y without converting them. np.interp already uses the previous
+    result as a hint when searching sorted timestamps, a cursor does not make it faster.
+    For other arrays, like float32 data, numpy converts the whole timeline on every call.
+    """
+    return (x.dtype == np.float64 and y.dtype == np.float64
+            and x.flags.c_contiguous and y.flags.c_contiguous)
+
+
+def block_range(timestamp):
+    """
+    :return: (min, max) of a block of timestamps, None if the timestamp is not a block or contains NaN.
+    """
+    if isinstance(timestamp, np.ndarray) and timestamp.ndim == 1 and len(timestamp):
+        t_min = timestamp.min()
+        t_max = timestamp.max()
+        if t_min <= t_max:
+            return t_min, t_max
+    return None
+
+
+def is_scalar(timestamp) -> bool:
+    return isinstance(timestamp, (float, int, np.floating, np.integer)) and timestamp == timestamp
+
+
 class LinearInterpolator(Interpolator):
+    """
+    Equivalent to np.interp(timestamp, timeline.x(), timeline.y()). For timelines numpy would have
+    to convert, only the part of the timeline near the previous query is searched and interpolated.
+    """
+    def __init__(self):
+        self.cursor = SegmentCursor()
+
     def interpolate(self, timeline: Timeline, timestamp):
-        return np.interp(timestamp, timeline.x(), timeline.y())
+        x = timeline.x()
+        y = timeline.y()
+        if len(x) < 2 or is_native(x, y):
+            return np.interp(timestamp, x, y)
+
+        if is_scalar(timestamp):
+            i = self.cursor.find(x, timestamp)
+            if i < 0:
+                return np.float64(y[0])
+            if i >= len(x) - 1:
+                return np.float64(y[-1])
+            # same formula as np.interp
+            x0, x1, y0, y1 = float(x[i]), float(x[i + 1]), float(y[i]), float(y[i + 1])
+            return np.float64((y1 - y0) / (x1 - x0) * (timestamp - x0) + y0)
+
+        block = block_range(timestamp)
+        if block is None:
+            return np.interp(timestamp, x, y)
+        segment = self.cursor.find_range(x, *block)
+        return np.interp(timestamp, x[segment], y[segment])
 
 
 class StairStepInterpolator(Interpolator):
+    """
+    Value of the last point at or before the timestamp. Only the part of the timeline
+    near the previous query is searched, see SegmentCursor.
+    """
+    def __init__(self):
+        self.cursor = SegmentCursor()
+
     def interpolate(self, timeline: Timeline, timestamp):
-        index = np.clip(np.searchsorted(timeline.x(), timestamp, side='right') - 1, 0, None)
-        return timeline.y()[index]
+        x = timeline.x()
+        y = timeline.y()
+        if is_scalar(timestamp):
+            return y[max(self.cursor.find(x, timestamp), 0)]
+
+        block = block_range(timestamp)
+        if block is None or len(x) < 2:
+            index = np.clip(np.searchsorted(x, timestamp, side='right') - 1, 0, None)
+            return y[index]
+        segment = self.cursor.find_range(x, *block)
+        index = np.searchsorted(x[segment], timestamp, side='right')
+        index += segment.start - 1
+        return y[np.maximum(index, 0, out=index)]
 
 
 class Axis(AbstractAxis):
@@ -127,6 +308,7 @@ class Axis(AbstractAxis):
 
     def add(self, value, interval=0.0):
         self.timeline.add(value, interval)
+        self.version = next_version()
 
     def interpolate(self, timestamp):
         return self.interpolator.interpolate(self.timeline, self.timestamp_mapper.map_timestamp(timestamp))
@@ -149,6 +331,7 @@ class ConstantAxis(AbstractAxis):
 
     def add(self, value, interval=0.0):
         self.value = value
+        self.version = next_version()
 
     def interpolate(self, timestamp):
         if isinstance(timestamp, collections.abc.Sequence):
@@ -159,6 +342,13 @@ class ConstantAxis(AbstractAxis):
         return self.value
 
 
+def latest_version(axes) -> int:
+    """
+    :return: the highest version of the axes. Changes if add() was called on any of them.
+    """
+    return max([axis.version for axis in axes], default=0)
+
+
 def create_temporal_axis(init_value, interpolation='linear'):
     if interpolation == 'linear':
         interpolator = LinearInterpolator()
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class ModulationFrequency:
     min = 0
     max = 100
@@ -33,4 +36,13 @@ class CarrierFrequencyFOC:
 
 class WaveformAmpltiudeFOC:
     min = 0.01  # Amperes
-    max = 0.20
\ No newline at end of file
+    max = 0.20
+
+
+def clamp(value, low, high):
+    """
+    Like np.clip(value, low, high), but much faster for python and numpy scalars.
+    """
+    if isinstance(value, np.ndarray):
+        return np.clip(value, low, high)
+    return min(max(value, low), high)
@@ -1,22 +1,139 @@
+import collections
+import threading
+from dataclasses import dataclass
+
 import numpy as np
 
 
-def create_pulse_envelope(n_samples):
+@dataclass
+class EnvelopeCacheStats:
+    hits: int
+    misses: int
+    entries: int
+    size_in_bytes: int
+
+
+class EnvelopeCache:
+    """
+    LRU cache of pulse envelope templates.
+
+    The raised cosine and half circle envelopes only depend on their length
+    in samples, which rarely changes between pulses.
+
+    Templates are read-only, copy before modifying them in-place.
+    """
+    def __init__(self, max_size_in_bytes=8 * 1024 * 1024):
+        self.max_size_in_bytes = max_size_in_bytes
+        self._templates = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._size_in_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+
+        template = factory()
+        template.flags.writeable = False
+
+        with self._lock:
+            if key not in self._templates:
+                self._templates[key] = template
+                self._size_in_bytes += template.nbytes
+            while self._size_in_bytes > self.max_size_in_bytes and len(self._templates) > 1:
+                _, evicted = self._templates.popitem(last=False)
+                self._size_in_bytes -= evicted.nbytes
+        return template
+
+    def stats(self) -> EnvelopeCacheStats:
+        with self._lock:
+            return EnvelopeCacheStats(self.hits, self.misses, len(self._templates), self._size_in_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self._size_in_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+
+envelope_cache = EnvelopeCache()
+
+
+def _raised_cosine(n_samples):
     return 0.5 - np.cos(np.linspace(0, np.pi * 2, n_samples)) * 0.5
 
 
-def create_pulse_envelope_half_circle(n_samples):
+def _half_circle(n_samples):
     return np.sin(np.linspace(0, np.pi, n_samples))
 
 
+def create_pulse_envelope(n_samples):
+    n_samples = int(n_samples)
+    return envelope_cache.get(('raised_cosine', n_samples), lambda: _raised_cosine(n_samples))
+
+
+def create_pulse_envelope_half_circle(n_samples):
+    n_samples = int(n_samples)
+    return envelope_cache.get(('half_circle', n_samples), lambda: _half_circle(n_samples))
+
+
 def create_pulse_with_ramp_time(n_samples, carrier_cycles, rise_time):
-    a = 1 / carrier_cycles * rise_time
+    return create_pulse_train_with_ramp_time([int(n_samples)], [carrier_cycles], [rise_time])
+
+
+def create_pulse_train_with_ramp_time(n_samples, carrier_cycles, rise_time):
+    """
+    Generates the envelopes of several pulses concatenated into one array, in one vectorized pass.
+    Each pulse rises as a quarter sine over rise_time, holds, and falls as a quarter sine over rise_time.
+    Pulses too short for that are a half sine.
+    :param n_samples: array, length of each pulse in samples
+    :param carrier_cycles: array, pulse width of each pulse in carrier cycles
+    :param rise_time: array, rise time of each pulse in carrier cycles
+    """
+    n_samples = np.asarray(n_samples, dtype=np.intp)
+    a = 1 / np.asarray(carrier_cycles, dtype=np.float64) * np.asarray(rise_time, dtype=np.float64)
+    # too short to rise and fall: half sine, rises over half the pulse
+    a[a >= 1 - a] = 0.5
     b = 1 - a
-    if a >= b:
-        return create_pulse_envelope_half_circle(n_samples)
-    theta = np.interp(np.linspace(0, 1, n_samples), [0, a, b, 1], [0, np.pi/2, np.pi/2, np.pi])
-    return np.sin(theta)
+    total = int(np.sum(n_samples))
+    starts = np.cumsum(n_samples) - n_samples
+
+    # np.interp(np.linspace(0, 1, n), [0, a, b, 1], [0, pi/2, pi/2, pi]) for every pulse,
+    # with the segment slopes of np.interp. Without rise time the pulse is pi/2 except at the end.
+    per_pulse = np.zeros((6, len(n_samples)))
+    per_pulse[0] = starts
+    np.divide(1, np.maximum(n_samples - 1, 1), out=per_pulse[1])
+    np.divide(np.pi / 2, a, out=per_pulse[2], where=a > 0)
+    per_pulse[3][a <= 0] = np.pi / 2
+    per_pulse[4] = b
+    np.divide(np.pi - np.pi / 2, 1 - b, out=per_pulse[5], where=1 - b > 0)
+    start, step, rise_slope, rise_offset, b, fall_slope = np.repeat(per_pulse, n_samples, axis=1)
+
+    # position within each pulse, like np.linspace(0, 1, n)
+    x = np.arange(total, dtype=np.float64)
+    x -= start
+    x *= step
+    ends = (starts + n_samples - 1)[n_samples > 1]
+    x[ends] = 1
+
+    # rising: slope * x, holding: pi/2, falling: slope * (x - b) + pi/2
+    theta = np.multiply(rise_slope, x, out=rise_slope)
+    theta += rise_offset
+    np.minimum(theta, np.pi / 2, out=theta)
+    fall = np.subtract(x, b, out=x)
+    fall *= fall_slope
+    np.maximum(fall, 0, out=fall)
+    theta += fall
+    theta[ends] = np.pi
+    return np.sin(theta, out=theta)
 
 
 def create_pause(n_samples):
-    return np.zeros(n_samples)
\ No newline at end of file
+    return np.zeros(n_samples)
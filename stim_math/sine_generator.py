@@ -1,5 +1,9 @@
+from enum import Enum
+
 import numpy as np
 
+from stim_math.pulse import create_pulse_envelope
+
 
 class SineGenerator1D:
     def __init__(self):
@@ -38,6 +42,72 @@ class AngleGenerator:
 
         return np.linspace(begin, end, n, endpoint=False)
 
+    def advance(self, n, frequency: float, samplerate: float):
+        """
+        Advance the angle by n samples, like generate() without computing the samples.
+        """
+        self.theta = self.theta + 2 * np.pi * frequency * (n / samplerate)
+
+
+class CarrierMode(Enum):
+    TRIG = 'trig'       # AngleGenerator + cos/sin on every sample
+    PHASOR = 'phasor'   # PhasorGenerator, complex rotation
+
+
+class PhasorGenerator:
+    """
+    Generates (cos, sin) carrier pairs by complex rotation instead of evaluating
+    trig functions for every sample.
+
+    A table with the rotations step^0 ... step^(n-1) is computed by recurrence and
+    cached until the frequency changes. Each block is the current phasor multiplied
+    by the table. The phasor is renormalized after every segment to bound drift.
+    Phase is continuous across blocks and frequency changes, and matches AngleGenerator.
+    """
+    def __init__(self, segment_length=1024):
+        self.segment_length = segment_length
+        self.phasor = 1 + 0j
+        self._table_key = None
+        self._table = None
+        self._step = None
+
+    def _rotation_table(self, frequency: float, samplerate: float):
+        key = (frequency, samplerate)
+        if key != self._table_key:
+            self._step = np.exp(1j * 2 * np.pi * frequency / samplerate)
+            table = np.full(self.segment_length, self._step)
+            table[0] = 1
+            self._table = np.cumprod(table)
+            self._table_key = key
+        return self._table
+
+    def generate_complex(self, n, frequency: float, samplerate: float):
+        table = self._rotation_table(frequency, samplerate)
+        out = np.empty(n, dtype=np.complex128)
+        for start in range(0, n, self.segment_length):
+            end = min(start + self.segment_length, n)
+            np.multiply(table[:end - start], self.phasor, out=out[start:end])
+            self.phasor = out[end - 1] * self._step
+            self.phasor /= abs(self.phasor)
+        return out
+
+    def advance(self, n, frequency: float, samplerate: float):
+        """
+        Advance the phasor by n samples, like generate_complex() but only computes the segment ends.
+        """
+        table = self._rotation_table(frequency, samplerate)
+        for start in range(0, n, self.segment_length):
+            end = min(start + self.segment_length, n)
+            self.phasor = table[end - start - 1] * self.phasor * self._step
+            self.phasor /= abs(self.phasor)
+
+    def generate(self, n, frequency: float, samplerate: float):
+        """
+        :return: (cos, sin) as float32, same as ThreePhaseSignalGenerator.carrier(theta)
+        """
+        z = self.generate_complex(n, frequency, samplerate)
+        return z.real.astype(np.float32), z.imag.astype(np.float32)
+
 
 class AngleGeneratorWithVaryingIPI:
     def __init__(self):
@@ -68,13 +138,28 @@ class AngleGeneratorWithVaryingIPI:
         x = np.linspace(begin, end, n, endpoint=False)
         return self.randomize(x, random)
 
+    def advance(self, n, frequency: float, samplerate: float, random: float) -> float:
+        """
+        Advance the angle by n samples, return only the first angle.
+        Equivalent to generate(...)[0] without computing the other samples.
+        """
+        begin = self.theta
+        self.skip(n, frequency, samplerate)
+        return float(self.randomize(begin, random))
+
+    def skip(self, n, frequency: float, samplerate: float):
+        """
+        Advance the angle by n samples without computing any angles.
+        """
+        self.theta = self.theta + 2 * np.pi * frequency * (n / samplerate)
+
 
 class PulseGenerator:
     def __init__(self):
         self.cache = np.array([])
 
     def gen_single_pulse(self, low_level, high_level, width_in_samples):
-        return high_level - (high_level - low_level) / 2 * (np.cos(np.linspace(0, 2 * np.pi, width_in_samples)) + 1)
+        return low_level + (high_level - low_level) * create_pulse_envelope(width_in_samples)
 
     def gen_idle(self, low_level, width_in_samples):
         return np.full(width_in_samples, low_level)
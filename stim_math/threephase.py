@@ -73,6 +73,25 @@ class ThreePhaseSignalGenerator:
             return L, R
 
         carrier_x, carrier_y = ThreePhaseSignalGenerator.carrier(theta)
+        return ThreePhaseSignalGenerator.generate_from_carrier(carrier_x, carrier_y, alpha, beta)
+
+    @staticmethod
+    def generate_from_carrier(carrier_x, carrier_y, alpha, beta, chunksize=10000):
+        """
+        Same as generate(), for callers that already have the carrier (cos(theta), sin(theta)).
+        """
+        if len(carrier_x) > (2 * chunksize):
+            L = np.empty_like(carrier_x, dtype=np.float32)
+            R = np.empty_like(carrier_x, dtype=np.float32)
+            for start in np.arange(0, len(carrier_x), chunksize):
+                end = start + chunksize
+                l, r = ThreePhaseSignalGenerator.generate_from_carrier(carrier_x[start:end],
+                                                                       carrier_y[start:end],
+                                                                       alpha[start:end],
+                                                                       beta[start:end])
+                L[start:end] = l
+                R[start:end] = r
+            return L, R
 
         # apply projection
         t11, t12, t21, t22 = ThreePhaseSignalGenerator.project_on_ab_coefs(alpha, beta)
@@ -354,11 +373,17 @@ class ThreePhaseHardwareCalibration:
         k = 1 / np.max((k1, k2))
         return k * 3**.5
 
-    def apply_transform(self, L, R):
+    def corrective_matrix(self):
+        """
+        :return: the 2x2 matrix that maps (L, R) to calibrated (L, R)
+        """
         transform = self.generate_transform_in_ab()
         corrective_matrix = potential_to_channel_matrix @ ab_transform @ transform @ ab_transform_inv @ potential_to_channel_matrix_inv
         corrective_matrix = corrective_matrix * self.scaling_contant(transform)
-        L, R = corrective_matrix[:2, :2] @ (L, R)
+        return corrective_matrix[:2, :2]
+
+    def apply_transform(self, L, R):
+        L, R = self.corrective_matrix() @ (L, R)
         return L, R
 
 